@@ -0,0 +1,243 @@
+"""
+Connection supervisor of a React Sync: (re)connects the RSMaster when a serial port
+appears or the link drops, instead of the user interfaces polling is_connected()
+
+Serial ports are watched with inotify on /dev (Linux), or by comparing the port
+listing periodically elsewhere. The descriptions of the ports already known not to
+be a React Sync are not fetched again, a failing port is retried with an
+exponential backoff.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import serial
+import serial.tools.list_ports as list_ports
+import rsmaster as rs
+
+
+class PollingPortWatcher:
+    """report the serial ports added and removed by comparing the port listing"""
+
+    def __init__(self, callback, period=1.0):
+        """constructor
+
+        Args:
+            callback (callable): called from the watcher thread with (added ports, removed ports)
+            period (float): seconds between two listings
+        """
+        self.callback = callback
+        self.period = period
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(name="port_watcher", target=self.__worker_task, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def __worker_task(self):
+        known = {port.device for port in list_ports.comports()}
+        while not self.stop_event.wait(self.period):
+            ports = {port.device for port in list_ports.comports()}
+            if ports != known:
+                self.callback(ports - known, known - ports)
+                known = ports
+
+
+class InotifyPortWatcher:
+    """report the tty device nodes created and deleted in /dev, Linux only"""
+
+    IN_ATTRIB = 0x004
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+    DEVICE_DIR = "/dev"
+    # udev sets the permissions of a new node after creating it
+    MASK = IN_CREATE | IN_DELETE | IN_ATTRIB
+
+    def __init__(self, callback):
+        """constructor
+
+        Args:
+            callback (callable): called from the watcher thread with (added ports, removed ports)
+
+        Raises:
+            OSError: inotify is not available
+        """
+        self.callback = callback
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, self.DEVICE_DIR.encode(), self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed on %s" % self.DEVICE_DIR)
+        # written to wake the watcher thread up when stopping
+        self.stop_read, self.stop_write = os.pipe()
+        self.thread = threading.Thread(name="port_watcher", target=self.__worker_task, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        os.write(self.stop_write, b"\0")
+        if self.thread.is_alive():
+            self.thread.join()
+        for fd in (self.fd, self.stop_read, self.stop_write):
+            os.close(fd)
+
+    def __worker_task(self):
+        while True:
+            readable, _, _ = select.select([self.fd, self.stop_read], [], [])
+            if self.stop_read in readable:
+                return
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                continue
+            added, removed = set(), set()
+            pos = 0
+            while pos + self.EVENT.size <= len(data):
+                _, mask, _, length = self.EVENT.unpack_from(data, pos)
+                name = data[pos + self.EVENT.size:pos + self.EVENT.size + length].rstrip(b"\0").decode()
+                pos += self.EVENT.size + length
+                if not name.startswith("tty"):
+                    continue
+                port = os.path.join(self.DEVICE_DIR, name)
+                if mask & self.IN_DELETE:
+                    removed.add(port)
+                    added.discard(port)
+                else:
+                    added.add(port)
+                    removed.discard(port)
+            if added or removed:
+                self.callback(added, removed)
+
+
+def create_port_watcher(callback, poll_period=1.0):
+    """inotify watcher when available, polling one otherwise"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyPortWatcher(callback)
+        except (OSError, AttributeError) as exception:
+            logging.info("inotify not available (%s), serial ports polled every %.1f s", exception, poll_period)
+    return PollingPortWatcher(callback, poll_period)
+
+
+class ConnectionSupervisor:
+    """keep an RSMaster connected to the React Sync plugged"""
+
+    BACKOFF_MIN = 0.5
+    BACKOFF_MAX = 30
+    POLL_PERIOD = 1.0
+
+    def __init__(
+        self, master, on_connected=None, on_disconnected=None,
+        backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX, poll_period=POLL_PERIOD, daemon=False
+    ):
+        """constructor
+
+        Args:
+            master (RSMaster): master to connect
+            on_connected (callable): called with the port once connected
+            on_disconnected (callable): called with the port once the link is lost
+            backoff_min (float): delay in seconds before retrying a port failing to connect,
+                doubled at each failure up to backoff_max
+            poll_period (float): port listing period without inotify
+            daemon (bool): supervisor thread not keeping the process alive
+        """
+        self.master = master
+        self.on_connected = on_connected
+        self.on_disconnected = on_disconnected
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.poll_period = poll_period
+        # ports whose description is not the React Sync one, until they are removed
+        self.rejected_ports = set()
+        self.ports_changed = True
+        self.port = None
+        self.run = False
+        self.wake = threading.Event()
+        self.watcher = None
+        self.thread = threading.Thread(name="connection_supervisor", target=self.__worker_task, daemon=daemon)
+
+    def start(self):
+        self.run = True
+        self.master.link_lost_callback = self.wake.set
+        self.watcher = create_port_watcher(self.__ports_changed, self.poll_period)
+        self.watcher.start()
+        self.thread.start()
+
+    def stop(self):
+        self.run = False
+        self.wake.set()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.master.link_lost_callback = None
+
+    def __ports_changed(self, added, removed):
+        logging.debug("Serial ports added: %s, removed: %s", sorted(added), sorted(removed))
+        self.rejected_ports -= added | removed
+        self.ports_changed = True
+        self.wake.set()
+
+    def __find_port(self):
+        """first React Sync of the port listing, the descriptions of the ports rejected
+        before are not checked again"""
+        for port, desc, hw in list_ports.comports():
+            if port in self.rejected_ports:
+                continue
+            if desc.find(rs.RS_IDENTIFIER) != -1:
+                return port
+            logging.info("description: %s", desc)
+            self.rejected_ports.add(port)
+        return None
+
+    def __worker_task(self):
+        backoff = 0
+        while self.run:
+            # cleared first: a wake up while processing is not lost
+            self.wake.clear()
+            timeout = None
+            if self.master.is_connected():
+                backoff = 0
+            else:
+                if self.port is not None:
+                    port, self.port = self.port, None
+                    logging.info("React Sync disconnected: %s", port)
+                    self.master.disconnect()
+                    if self.on_disconnected:
+                        self.on_disconnected(port)
+                    self.ports_changed = True
+                port = None
+                if self.ports_changed or backoff:
+                    self.ports_changed = False
+                    port = self.__find_port()
+                if port is not None:
+                    try:
+                        connected = self.master.connect(port)
+                    except (serial.SerialException, OSError) as exception:
+                        logging.info("React Sync %s connection failed: %s", port, exception)
+                        connected = False
+                    if connected:
+                        self.port = port
+                        backoff = 0
+                        if self.on_connected:
+                            self.on_connected(port)
+                    else:
+                        self.master.uart_driver.serial_port.port = None
+                        backoff = min(self.backoff_max, backoff * 2 or self.backoff_min)
+                        timeout = backoff
+                        logging.info("Retrying React Sync %s in %.1f s", port, backoff)
+            self.wake.wait(timeout)
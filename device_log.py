@@ -0,0 +1,279 @@
+"""
+Storage of the React Sync log messages: records batched to a writer thread and
+appended as JSON lines to files rotated by size and age
+
+one record per line: {"t": host timestamp (epoch s), "port": serial port, "level": "INFO", "msg": "..."}
+
+usage: python device_log.py query [--since 10m] [--until ...] [--level WARNING] [--grep REGEX] [--port PORT]
+       python device_log.py tail [-n 20] [-f] [--level ...] [--grep ...] [--port ...]
+"""
+import argparse
+import collections
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+FILE_NAME = "device_log.jsonl"
+
+
+class DeviceLogWriter:
+    """append the device log records to rotated JSONL files from a background thread,
+    the uart thread only queues them"""
+
+    FLUSH_INTERVAL = 0.5
+    MAX_PENDING = 100000
+    MAX_BYTES = 10 * 1024 * 1024
+    BACKUP_COUNT = 10
+
+    def __init__(
+        self, directory, max_bytes=MAX_BYTES, rotate_seconds=0, backup_count=BACKUP_COUNT,
+        flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING
+    ):
+        """constructor
+
+        Args:
+            directory (str): directory of the log files
+            max_bytes (int): size of the current file triggering its rotation, 0 for none
+            rotate_seconds (float): age of the current file triggering its rotation, 0 for none
+            backup_count (int): rotated files kept, the oldest are deleted
+            flush_interval (float): max seconds a record waits before being written
+            max_pending (int): records queued at most, the oldest are dropped when the
+                writer cannot keep up
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.pending = collections.deque(maxlen=max_pending)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.path = os.path.join(directory, FILE_NAME)
+        self.file = None
+        self.opened_at = 0
+        self.written = 0
+        self.dropped = 0
+        self.run = False
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.run = True
+        self.thread = threading.Thread(name="device_log_writer", target=self.__worker_task, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """write the records pending and close the file"""
+        self.run = False
+        self.wake.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        self.__write_pending()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write(self, port, level, message, timestamp=None):
+        """queue a record, never blocks
+
+        Args:
+            port (str): serial port of the device
+            level (str): level name
+            message (str): log message
+            timestamp (float): host reception time, now if None
+        """
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append((timestamp or time.time(), port, level, message))
+
+    def __worker_task(self):
+        while self.run:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.__write_pending()
+
+    def __write_pending(self):
+        with self.lock:
+            if not self.pending:
+                return
+            records = list(self.pending)
+            self.pending.clear()
+        lines = "".join(json.dumps({"t": round(timestamp, 6), "port": port, "level": level, "msg": message},
+                                   separators=(",", ":"), ensure_ascii=False) + "\n"
+                        for timestamp, port, level, message in records)
+        try:
+            self.__open(time.time())
+            self.file.write(lines)
+            self.file.flush()
+            self.written += len(records)
+        except OSError as exception:
+            self.dropped += len(records)
+            logging.info("Device log not written to %s: %s", self.path, exception)
+
+    def __open(self, now):
+        """open the current file, rotated first if too big or too old"""
+        if self.file is not None:
+            if (self.max_bytes and self.file.tell() >= self.max_bytes) or \
+                    (self.rotate_seconds and now - self.opened_at >= self.rotate_seconds):
+                self.file.close()
+                self.file = None
+                self.__rotate(now)
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.opened_at = now
+            if self.max_bytes and self.file.tell() >= self.max_bytes:
+                # left big by a previous run
+                self.file.close()
+                self.__rotate(now)
+                self.file = open(self.path, "a", encoding="utf-8")
+
+    def __rotate(self, now):
+        stamp = datetime.datetime.fromtimestamp(now).strftime("%Y%m%d-%H%M%S-%f")
+        os.replace(self.path, os.path.join(self.directory, "device_log.%s.jsonl" % stamp))
+        for path in rotated_files(self.directory)[:-self.backup_count or None]:
+            os.remove(path)
+
+
+def config_device_log(config):
+    """
+    Args:
+        config (ReactStepMonitorConfig): log settings
+
+    Returns:
+        DeviceLogWriter: writer of the configured device log directory, not started
+    """
+    return DeviceLogWriter(config.device_log_dir, config.device_log_max_bytes,
+                           config.device_log_rotate_seconds, config.device_log_backup_count)
+
+
+def rotated_files(directory):
+    """rotated log files, oldest first"""
+    return sorted(glob.glob(os.path.join(directory, "device_log.*.jsonl")))
+
+
+def log_files(directory):
+    """every log file, oldest first"""
+    files = rotated_files(directory)
+    current = os.path.join(directory, FILE_NAME)
+    if os.path.exists(current):
+        files.append(current)
+    return files
+
+
+def parse_time(value):
+    """epoch seconds of an ISO date/time or of a duration before now (30s, 10m, 2h, 1d)"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", value)
+    if match:
+        return time.time() - float(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def record_filter(since=None, until=None, level=None, pattern=None, port=None):
+    """
+    Returns:
+        callable: True for the records matching every criterion given
+    """
+    min_level = LEVELS.index(level) if level else 0
+    regex = re.compile(pattern) if pattern else None
+
+    def match(record):
+        return ((since is None or record["t"] >= since)
+                and (until is None or record["t"] < until)
+                and (not min_level or (LEVELS.index(record["level"]) if record["level"] in LEVELS else 99) >= min_level)
+                and (port is None or record["port"] == port)
+                and (regex is None or regex.search(record["msg"]) is not None))
+    return match
+
+
+def read_records(path, position=0):
+    """
+    Yields:
+        tuple: (record dict, file position after it), the incomplete last line is skipped
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        file.seek(position)
+        while True:
+            line = file.readline()
+            if not line.endswith("\n"):
+                return
+            position = file.tell()
+            try:
+                yield json.loads(line), position
+            except ValueError:
+                continue
+
+
+def query(directory, match):
+    """
+    Yields:
+        dict: records of every log file matching, oldest first
+    """
+    for path in log_files(directory):
+        for record, _ in read_records(path):
+            if match(record):
+                yield record
+
+
+def format_record(record):
+    stamp = datetime.datetime.fromtimestamp(record["t"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    return "%s %s %-7s %s" % (stamp, record["port"], record["level"], record["msg"])
+
+
+def tail(directory, match, count, follow, poll_period=0.2):
+    """print the last count matching records, then the new ones if follow"""
+    for record in collections.deque(query(directory, match), maxlen=count):
+        print(format_record(record))
+    if not follow:
+        return
+    path = os.path.join(directory, FILE_NAME)
+    position = os.path.getsize(path) if os.path.exists(path) else 0
+    inode = os.stat(path).st_ino if os.path.exists(path) else None
+    while True:
+        time.sleep(poll_period)
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        if stat.st_ino != inode:
+            # rotated: the new current file is read from its start
+            inode, position = stat.st_ino, 0
+        for record, position in read_records(path, position):
+            if match(record):
+                print(format_record(record), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="query the React Sync device logs")
+    parser.add_argument("command", choices=["query", "tail"])
+    parser.add_argument("--dir", help="log directory, the configured one if not given")
+    parser.add_argument("--since", help="ISO date/time or duration before now (30s, 10m, 2h, 1d)")
+    parser.add_argument("--until", help="ISO date/time or duration before now")
+    parser.add_argument("--level", choices=LEVELS, help="minimum level")
+    parser.add_argument("--grep", help="regular expression searched in the messages")
+    parser.add_argument("--port", help="serial port of the device")
+    parser.add_argument("-n", type=int, default=20, help="tail: number of records shown")
+    parser.add_argument("-f", "--follow", action="store_true", help="tail: wait for the new records")
+    parser.add_argument("--json", action="store_true", help="query: print the JSON records")
+    args = parser.parse_args()
+    directory = args.dir
+    if directory is None:
+        import reactstepmonitor_config as rc
+        directory = rc.ReactStepMonitorConfig().device_log_dir
+    match = record_filter(parse_time(args.since) if args.since else None,
+                          parse_time(args.until) if args.until else None,
+                          args.level, args.grep, args.port)
+    try:
+        if args.command == "query":
+            for record in query(directory, match):
+                print(json.dumps(record, ensure_ascii=False) if args.json else format_record(record))
+        else:
+            tail(directory, match, args.n, args.follow)
+    except (KeyboardInterrupt, BrokenPipeError):
+        sys.exit(0)
@@ -0,0 +1,273 @@
+"""
+Delta synchronization of the files of a React Sync with a local directory
+
+A manifest of the files of each device (name, size and sha256 of the content) is kept
+on disk, built from the device listings and the transfers completed. Only the local
+files new or changed since the last transfer are sent, the device files no longer in
+the directory are deleted, the unchanged ones do not go over the link.
+"""
+import hashlib
+import json
+import logging
+import os
+import serial.tools.list_ports as list_ports
+import payload_file as pf
+import rsdevice_pool as rp
+
+SYNC_EXTENSIONS = (".wkt", ".ses")
+
+
+def device_id(port):
+    """name of the manifest of the device plugged on a serial port: the USB serial
+    number of the React Sync, the port name if it has none"""
+    for info in list_ports.comports():
+        if info.device == port and info.serial_number:
+            return rp.port_name(info.serial_number)
+    return rp.port_name(port)
+
+
+def device_file_name(filename):
+    """name of a file once stored on the device, truncated to the file payload name size"""
+    return filename.encode("ascii")[:pf.PayloadFile.FILE_NAME_SIZE].decode("ascii")
+
+
+def file_digest(file_path):
+    """
+    Returns:
+        tuple: (size in bytes, sha256 hex digest of the content)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+
+def scan_directory(directory):
+    """local files to synchronize
+
+    Returns:
+        dict: device file name -> (size, sha256, path) of each .wkt/.ses file of the directory
+
+    Raises:
+        Exception: two files would have the same name on the device
+    """
+    files = {}
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if not entry.is_file() or not entry.name.endswith(SYNC_EXTENSIONS):
+            continue
+        name = device_file_name(entry.name)
+        if name in files:
+            raise Exception("Files %s and %s have the same name on the device: %s" % (
+                os.path.basename(files[name][2]), entry.name, name))
+        files[name] = file_digest(entry.path) + (entry.path,)
+    return files
+
+
+class DeviceManifest:
+    """files this host sent to a device and still stored there: name -> size and sha256,
+    saved as json"""
+
+    def __init__(self, directory, device):
+        self.path = os.path.join(directory, "%s.json" % device)
+        self.device = device
+        self.files = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                self.files = {name: (entry["size"], entry["hash"]) for name, entry in json.load(file).items()}
+        except FileNotFoundError:
+            self.files = {}
+        except (KeyError, TypeError, ValueError) as exception:
+            logging.info("Ignoring invalid device manifest %s: %s", self.path, exception)
+            self.files = {}
+        return self
+
+    def save(self):
+        """write the manifest, atomically replacing the previous one"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({name: {"size": size, "hash": content_hash}
+                       for name, (size, content_hash) in sorted(self.files.items())}, file, indent=1)
+        os.replace(temporary_path, self.path)
+
+    def is_stored(self, name, size, content_hash):
+        """True if the device has the file with this content"""
+        return self.files.get(name) == (size, content_hash)
+
+    def record(self, name, size, content_hash):
+        """the file was transferred to the device"""
+        self.files[name] = (size, content_hash)
+
+    def forget(self, name):
+        """the file was deleted from the device"""
+        self.files.pop(name, None)
+
+    def reconcile(self, names):
+        """keep the files of a device listing only: the content of the files stored by
+        another host is unknown, the files deleted by another host are gone
+
+        Returns:
+            list: names of the device files whose content is unknown
+        """
+        names = set(names)
+        for name in set(self.files) - names:
+            del self.files[name]
+        return sorted(names - set(self.files))
+
+
+class SyncResult:
+    """outcome of the synchronization of a device"""
+
+    def __init__(self):
+        self.uploaded = []
+        self.deleted = []
+        self.unchanged = []
+        self.failed = {}  # name -> exception
+
+    def summary(self):
+        return "%i uploaded, %i deleted, %i unchanged, %i failed" % (
+            len(self.uploaded), len(self.deleted), len(self.unchanged), len(self.failed))
+
+    def __str__(self):
+        return self.summary()
+
+
+class DeviceSync:
+    """file operations of an RSMaster keeping the manifest of its device up to date"""
+
+    def __init__(self, master, manifest_dir):
+        """constructor
+
+        Args:
+            master (RSMaster): connected master of the device
+            manifest_dir (str): where the device manifests are saved
+        """
+        self.master = master
+        self.manifest_dir = manifest_dir
+        self.manifest = None
+
+    def device_manifest(self):
+        """manifest of the device connected, loaded again when the port changes"""
+        device = device_id(self.master.uart_driver.serial_port.port)
+        if self.manifest is None or self.manifest.device != device:
+            self.manifest = DeviceManifest(self.manifest_dir, device).load()
+        return self.manifest
+
+    def list_device_files(self):
+        """list the workout and session files of the device and reconcile the manifest
+
+        Returns:
+            list: names of the device files
+        """
+        names = self.master.send_list_workout() + self.master.send_list_sessions()
+        manifest = self.device_manifest()
+        unknown = manifest.reconcile(names)
+        if unknown:
+            logging.info("Content of %i device files unknown: %s", len(unknown), ", ".join(unknown))
+        manifest.save()
+        return names
+
+    def push_file(self, file_path, force=False, progress=None):
+        """send a file unless the device already has it with the same content
+
+        Args:
+            force (bool): send it anyway
+            progress (callable): called with the TransferProgress of the file (send_workout_file)
+
+        Returns:
+            bool: True if the file was sent
+        """
+        name = device_file_name(os.path.basename(file_path))
+        size, content_hash = file_digest(file_path)
+        manifest = self.device_manifest()
+        # the manifest is checked against the device listing, the file may have been
+        # deleted by another host
+        if not force and manifest.is_stored(name, size, content_hash) and name in self.list_device_files():
+            logging.info("File %s unchanged on the device, not sent", name)
+            return False
+        self.__send_file(file_path, name, size, content_hash, progress)
+        return True
+
+    def delete_file(self, name):
+        """
+        Returns:
+            bool: True if the device deleted the file
+        """
+        deleted = self.master.send_delete_file(name)
+        manifest = self.device_manifest()
+        # deleted or not there: its content is no longer known either way
+        manifest.forget(name)
+        manifest.save()
+        return deleted
+
+    def sync(self, directory, delete=True, local_files=None, progress=None, delete_unknown=False):
+        """make the device files the .wkt/.ses files of a local directory
+
+        Args:
+            directory (str): local directory of the files
+            delete (bool): delete the files sent by this host (recorded in the manifest)
+                no longer in the directory
+            local_files (dict): scan_directory(directory) result, to scan it once for several devices
+            progress (callable): called with the TransferProgress of each file sent
+            delete_unknown (bool): delete too the device files not in the directory this host
+                did not send (other hosts, device itself)
+
+        Returns:
+            SyncResult: files uploaded, deleted, unchanged and failed
+        """
+        if local_files is None:
+            local_files = scan_directory(directory)
+        result = SyncResult()
+        device_files = set(self.list_device_files())
+        manifest = self.device_manifest()
+        # reconciled with the listing: the files sent by this host still on the device
+        removed = set()
+        if delete:
+            removed |= set(manifest.files) - set(local_files)
+        if delete_unknown:
+            removed |= device_files - set(manifest.files) - set(local_files)
+        for name, (size, content_hash, file_path) in sorted(local_files.items()):
+            if name in device_files and manifest.is_stored(name, size, content_hash):
+                result.unchanged.append(name)
+                continue
+            try:
+                self.__send_file(file_path, name, size, content_hash, progress)
+                result.uploaded.append(name)
+            except Exception as exception:
+                logging.info("Sync of %s failed: %s", name, exception)
+                result.failed[name] = exception
+        if removed:
+            for name in sorted(removed):
+                if self.master.send_delete_file(name):
+                    result.deleted.append(name)
+                else:
+                    result.failed[name] = Exception("Error deleting file: %s" % name)
+                manifest.forget(name)
+            manifest.save()
+        logging.info("React Sync %s synchronized with %s: %s", manifest.device, directory, result.summary())
+        return result
+
+    def __send_file(self, file_path, name, size, content_hash, progress=None):
+        manifest = self.device_manifest()
+        # a file partially written is not the former one anymore
+        manifest.forget(name)
+        self.master.send_workout_file(file_path, progress)
+        manifest.record(name, size, content_hash)
+        manifest.save()
+
+
+def sync_pool(pool, directory, manifest_dir, delete=True, ports=None, delete_unknown=False):
+    """synchronize every device of a DevicePool with a local directory, scanned once
+
+    Returns:
+        dict: port -> SyncResult, or the exception raised
+    """
+    local_files = scan_directory(directory)
+    return pool.run(lambda master: DeviceSync(master, manifest_dir).sync(
+                        directory, delete, local_files, delete_unknown=delete_unknown),
+                    "sync %s" % os.path.basename(os.path.normpath(directory)), ports)
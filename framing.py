@@ -0,0 +1,125 @@
+"""
+Byte stuffing codec of the serial frames, shared by the tx and rx sides
+[START][stuffed frame body][STOP], START / STOP / ESC inside the body are preceded by ESC
+
+Whole buffers are processed by bytes.replace and compiled regular expressions so
+that the per byte work runs in C: a few passes over the buffer are still much
+faster than a python loop over each byte (see rsbench.py codec).
+"""
+import binascii
+import re
+import zlib
+
+FLAG_START = b"\x12"
+FLAG_STOP = b"\x13"
+FLAG_ESC = b"\x14"
+
+# optional integrity trailer appended to the frame body before stuffing
+CRC_SIZES = {"crc16": 2, "crc32": 4}
+
+# stuffed frame body: runs of plain bytes or escape pairs, stops on a raw flag
+# or on an escape missing its escaped byte (end of the buffer)
+_BODY = re.compile(rb"(?:[^\x12-\x14]+|\x14.)*", re.DOTALL)
+
+
+def stuff(data):
+    """escape the flags of a frame body"""
+    return (
+        data.replace(FLAG_ESC, FLAG_ESC + FLAG_ESC)
+        .replace(FLAG_START, FLAG_ESC + FLAG_START)
+        .replace(FLAG_STOP, FLAG_ESC + FLAG_STOP)
+    )
+
+
+def unstuff(data):
+    """remove the escapes of a stuffed frame body
+    in a valid body a raw START or STOP is always preceded by its escape, once those
+    pairs are replaced the remaining escapes are consecutive escaped ESC pairs"""
+    if FLAG_ESC not in data:
+        return bytes(data)
+    return bytes(
+        data.replace(FLAG_ESC + FLAG_START, FLAG_START)
+        .replace(FLAG_ESC + FLAG_STOP, FLAG_STOP)
+        .replace(FLAG_ESC + FLAG_ESC, FLAG_ESC)
+    )
+
+
+def crc_trailer(crc, body):
+    """integrity trailer of a frame body
+
+    Args:
+        crc (str): "crc16" (CRC-16/CCITT-FALSE) or "crc32" (IEEE, as zlib)
+    """
+    if crc == "crc16":
+        return binascii.crc_hqx(body, 0xFFFF).to_bytes(2, byteorder="big")
+    return zlib.crc32(body).to_bytes(4, byteorder="big")
+
+
+def encode_frame(body):
+    """return the frame to write on the wire for the given body"""
+    return FLAG_START + stuff(bytes(body)) + FLAG_STOP
+
+
+class FrameDecoder:
+    """streaming decoder: feed it byte slices of any size as they are read,
+    get back the bodies of the frames completed"""
+
+    def __init__(self):
+        # stuffed bytes of the frame being received, reused from one frame to the next
+        self.buffer = bytearray()
+        self.in_frame = False
+        # the buffer ends with an escape whose escaped byte is in the next slice
+        self.escape_pending = False
+        # bytes dropped outside frames or in truncated frames
+        self.discarded = 0
+
+    def reset(self):
+        self.buffer.clear()
+        self.in_frame = False
+        self.escape_pending = False
+
+    def feed(self, data):
+        """decode a slice of received bytes
+
+        Returns:
+            list: bodies (bytes, un-stuffed, without flags) of the frames completed
+        """
+        frames = []
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if not self.in_frame:
+                start = data.find(FLAG_START, pos)
+                if start < 0:
+                    self.discarded += size - pos
+                    break
+                self.discarded += start - pos
+                self.in_frame = True
+                pos = start + 1
+                continue
+            if self.escape_pending:
+                self.buffer += data[pos:pos + 1]
+                self.escape_pending = False
+                pos += 1
+                continue
+            end = _BODY.match(data, pos).end()
+            self.buffer += data[pos:end]
+            if end == size:
+                break
+            flag = data[end]
+            if flag == FLAG_ESC[0]:
+                # escape at the end of the slice
+                self.buffer += FLAG_ESC
+                self.escape_pending = True
+                pos = end + 1
+            elif flag == FLAG_STOP[0]:
+                frames.append(unstuff(self.buffer))
+                self.buffer.clear()
+                self.in_frame = False
+                pos = end + 1
+            else:
+                # unescaped start flag: the frame in progress is truncated, resync
+                self.discarded += len(self.buffer) + 1
+                self.buffer.clear()
+                pos = end + 1
+        return frames
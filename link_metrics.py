@@ -0,0 +1,299 @@
+"""
+Link metrics of the React Sync masters: latency histograms, Prometheus text export
+(file and localhost HTTP endpoint), periodic summary in the log and text report
+
+The metrics are the RSMaster.link_stats() dicts of the current connection of each
+device, keyed by serial port.
+"""
+import logging
+import os
+import threading
+import time
+
+PREFIX = "reactsync"
+# nested link_stats dicts whose keys are label values: key -> label name
+LABELS = {"rx_types": "type", "tx_types": "type", "rx_queues": "channel", "tx_queues": "priority"}
+
+
+class LatencyHistogram:
+    """log-linear histogram of durations, with the HDR histogram layout: values in
+    microseconds, each power of two split in SUB_BUCKETS linear buckets so that a
+    value is known within 1/SUB_BUCKETS whatever its magnitude, in constant memory"""
+
+    SUB_BUCKET_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    MAX_SHIFT = 32  # values up to 2^37 us (38 h)
+    # upper bounds (s) of the cumulative buckets of the Prometheus export
+    EXPORT_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_SHIFT + 2) << self.SUB_BUCKET_BITS)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def __index(self, microseconds):
+        shift = max(0, microseconds.bit_length() - self.SUB_BUCKET_BITS - 1)
+        if shift > self.MAX_SHIFT:
+            return len(self.counts) - 1
+        return (shift << self.SUB_BUCKET_BITS) + (microseconds >> shift)
+
+    def __upper_bound(self, index):
+        """upper bound in seconds of the values of a bucket"""
+        shift = max(0, (index >> self.SUB_BUCKET_BITS) - 1)
+        return ((index - (shift << self.SUB_BUCKET_BITS)) + 1 << shift) / 1e6
+
+    def record(self, seconds):
+        index = self.__index(max(0, int(seconds * 1e6)))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.sum = 0
+            self.max = 0
+
+    def percentile(self, fraction):
+        """
+        Returns:
+            float: upper bound in seconds of the values below which the fraction (0 to 1)
+                of the samples fall, 0 without samples
+        """
+        with self.lock:
+            target = fraction * self.count
+            cumulative = 0
+            for index, count in enumerate(self.counts):
+                cumulative += count
+                if count and cumulative >= target:
+                    return min(self.__upper_bound(index), self.max)
+        return 0
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: count, sum, max, mean, p50/p90/p99 (s) and the cumulative export
+                buckets [(upper bound, count), ...]
+        """
+        with self.lock:
+            buckets = []
+            cumulative = 0
+            index = 0
+            for bound in self.EXPORT_BOUNDS:
+                while index < len(self.counts) and self.__upper_bound(index) <= bound:
+                    cumulative += self.counts[index]
+                    index += 1
+                buckets.append((bound, cumulative))
+            count, total, maximum = self.count, self.sum, self.max
+        return {
+            "count": count,
+            "sum": total,
+            "max": maximum,
+            "mean": total / count if count else 0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": buckets,
+        }
+
+
+def masters_stats(masters):
+    """
+    Args:
+        masters (list): RSMaster of each device
+
+    Returns:
+        dict: serial port (or "-" once disconnected) -> link_stats()
+    """
+    return {master.uart_driver.serial_port.port or "-": master.link_stats() for master in masters}
+
+
+def label_text(labels):
+    return ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in labels)
+
+
+def collect_samples(samples, name, value, labels):
+    """add the samples of a link_stats value: scalars, labelled dicts, histograms"""
+    if isinstance(value, bool) or value is None:
+        return
+    if isinstance(value, (int, float)):
+        samples.setdefault((name, "gauge"), []).append(("", labels, value))
+    elif isinstance(value, dict) and "buckets" in value:
+        samples.setdefault((name + "_seconds", "histogram"), []).extend(
+            [("_bucket", labels + (("le", bound),), count) for bound, count in value["buckets"]]
+            + [("_bucket", labels + (("le", "+Inf"),), value["count"]),
+               ("_sum", labels, value["sum"]), ("_count", labels, value["count"])])
+    elif isinstance(value, dict):
+        label = LABELS.get(name[len(PREFIX) + 1:])
+        for key, item in value.items():
+            if label is not None and isinstance(item, dict):
+                for item_key, item_value in item.items():
+                    collect_samples(samples, "%s_%s" % (name, item_key), item_value, labels + ((label, key),))
+            elif name == PREFIX + "_histograms":
+                collect_samples(samples, "%s_%s" % (PREFIX, key), item, labels)
+            else:
+                collect_samples(samples, "%s_%s" % (name, key), item, labels)
+
+
+def prometheus_text(stats):
+    """
+    Args:
+        stats (dict): serial port -> link_stats()
+
+    Returns:
+        str: the metrics in the Prometheus text exposition format
+    """
+    samples = {}
+    for port, port_stats in stats.items():
+        collect_samples(samples, PREFIX, port_stats, (("port", port),))
+    lines = []
+    for (name, metric_type), metric_samples in sorted(samples.items()):
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for suffix, labels, value in metric_samples:
+            lines.append("%s%s{%s} %s" % (name, suffix, label_text(labels), repr(float(value))))
+    return "\n".join(lines) + "\n"
+
+
+def type_summary(types):
+    """frames of each message type: LOG 1200, ACK 30..."""
+    return ", ".join("%s %i" % (name, entry["frames"]) for name, entry in sorted(types.items())) or "none"
+
+
+def summary_line(port, stats):
+    """one line summary of the link of a device"""
+    command, chunk_ack = stats["histograms"]["command_rtt"], stats["histograms"]["chunk_ack_rtt"]
+    overflows = sum(queue["dropped"] + queue["spilled"] for queue in stats.get("rx_queues", {}).values())
+    return ("React Sync %s link: rx %i frames, %i bytes (%s), tx %i frames, %i bytes (%s), stuffing %.1f%%/%.1f%%, "
+            "%i crc errors, %i malformed, %i lost, %i ack timeouts, %i nacks, %i rx overflows, %i reconnects, "
+            "command rtt p50 %.0f ms p99 %.0f ms (%i), chunk ack p50 %.0f ms p99 %.0f ms (%i)") % (
+        port, stats["rx_frames"], stats["rx_link_bytes"], type_summary(stats["rx_types"]),
+        stats["tx_frames"], stats["tx_link_bytes"], type_summary(stats["tx_types"]),
+        stats["rx_stuffing_overhead"] * 100, stats["tx_stuffing_overhead"] * 100,
+        stats["rx_crc_errors"], stats["rx_malformed"], stats["rx_lost"], stats["ack_timeouts"], stats["nacks"],
+        overflows, stats["reconnects"],
+        command["p50"] * 1000, command["p99"] * 1000, command["count"],
+        chunk_ack["p50"] * 1000, chunk_ack["p99"] * 1000, chunk_ack["count"])
+
+
+def format_stats(port, stats):
+    """
+    Returns:
+        list: lines of a readable report of the link of a device
+    """
+    lines = ["React Sync %s (%i reconnects)" % (port, stats["reconnects"])]
+    for direction in ("rx", "tx"):
+        lines.append("  %s: %i bytes on the wire, stuffing overhead %.1f%%" % (
+            direction, stats["%s_link_bytes" % direction], stats["%s_stuffing_overhead" % direction] * 100))
+        for name, entry in sorted(stats["%s_types" % direction].items()):
+            lines.append("    %-8s %8i frames %10i bytes" % (name, entry["frames"], entry["bytes"]))
+    lines.append("  rx errors: %i crc, %i malformed, %i lost, %i duplicated" % (
+        stats["rx_crc_errors"], stats["rx_malformed"], stats["rx_lost"], stats["rx_duplicated"]))
+    lines.append("  transfers: %i files, %i ack timeouts, %i nacks, %.0f bytes/s, compression ratio %.2f" % (
+        stats["tx_files"], stats["ack_timeouts"], stats["nacks"], stats["tx_file_bytes_per_second"],
+        stats["compression_ratio"]))
+    for name, queue in sorted(stats.get("rx_queues", {}).items()):
+        lines.append("  rx channel %-8s max depth %i, %i dropped, %i blocked (%.2f s), %i spilled" % (
+            name, queue["max_depth"], queue["dropped"], queue["blocked"], queue["blocked_seconds"], queue["spilled"]))
+    for name, histogram in sorted(stats["histograms"].items()):
+        lines.append("  %-14s %6i samples, mean %.1f ms, p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms" % (
+            name, histogram["count"], histogram["mean"] * 1000, histogram["p50"] * 1000,
+            histogram["p90"] * 1000, histogram["p99"] * 1000, histogram["max"] * 1000))
+    return lines
+
+
+class MetricsExporter:
+    """publish the link metrics: Prometheus text file rewritten periodically, localhost
+    HTTP endpoint and summary lines in the log"""
+
+    def __init__(self, source, file=None, http_port=0, period=15, summary_period=0):
+        """constructor
+
+        Args:
+            source (callable): returns the stats to publish, serial port -> link_stats()
+            file (str): Prometheus text file (node exporter textfile collector), None for none
+            http_port (int): port of the http://127.0.0.1:<port>/metrics endpoint, 0 for none
+            period (float): seconds between two writes of the file
+            summary_period (float): seconds between two summaries in the log, 0 for none
+        """
+        self.source = source
+        self.file = file
+        self.http_port = http_port
+        self.period = period
+        self.summary_period = summary_period
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(name="metrics_exporter", target=self.__worker_task, daemon=True)
+        self.server = None
+
+    def start(self):
+        if self.http_port:
+            # imported on use: link_metrics is imported by rsmaster, whose import time
+            # is the cold start of the command line tools
+            import http.server
+            exporter = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = prometheus_text(exporter.source()).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    logging.debug("metrics endpoint: " + format, *args)
+
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", self.http_port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(name="metrics_http", target=self.server.serve_forever, daemon=True).start()
+            logging.info("Link metrics served on http://127.0.0.1:%i/metrics", self.server.server_address[1])
+        if self.file or self.summary_period:
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def write_file(self):
+        """write the Prometheus text file, atomically replacing the previous one"""
+        temporary_path = self.file + ".tmp"
+        with open(temporary_path, "w") as file:
+            file.write(prometheus_text(self.source()))
+        os.replace(temporary_path, self.file)
+
+    def log_summary(self):
+        for port, stats in self.source().items():
+            logging.info(summary_line(port, stats))
+
+    def __worker_task(self):
+        periods = [period for period in (self.period if self.file else 0, self.summary_period) if period]
+        tick = min(periods)
+        next_summary = time.monotonic() + self.summary_period
+        while not self.stop_event.wait(tick):
+            try:
+                if self.file:
+                    self.write_file()
+                if self.summary_period and time.monotonic() >= next_summary:
+                    next_summary += self.summary_period
+                    self.log_summary()
+            except Exception as exception:
+                logging.info("Link metrics not exported: %s", exception)
+        if self.file:
+            try:
+                self.write_file()
+            except OSError as exception:
+                logging.info("Link metrics not exported: %s", exception)
@@ -1,5 +1,15 @@
+"""
+ACK frame payload: [AckType] followed by the data of the answer
+
+The file chunk acks of a device answering the connect request carry the chunk id,
+little endian, on 4 bytes with the protocol v2 and on 1 byte (low byte of the id) with
+the v1, in stop-and-wait as in windowed transfers: the host drops the acks of the
+chunks not in flight (late ack of a copy sent again). The devices without the connect
+negotiation send bare acks, their chunks are not sent again on an ack timeout.
+"""
 from enum import Enum
 
 class AckType(Enum):
     OK = 0
-    ERROR = 1
\ No newline at end of file
+    ERROR = 1
+    NACK = 2 # chunk rejected by the device, to be sent again
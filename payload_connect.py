@@ -0,0 +1,41 @@
+"""
+CONNECT command payload: the link capabilities of the host, answered by those of the device
+
+Firmware contract: a CONNECT command resets the device to the v1 framing without crc,
+whatever framing it used before (a host reconnecting after a restart or a lost link
+sends it in the v1 framing, the device may still be in the framing negotiated then):
+the device answers in the v1 framing, then switches to the newly negotiated one.
+The host also accepts an answer in the framing negotiated before, from a device not
+reset by the CONNECT.
+"""
+import ctypes
+
+PROTOCOL_VERSION = 2
+
+# optional link features, bits of PayloadConnect.features
+FEATURE_CRC16 = 0x0001
+FEATURE_CRC32 = 0x0002
+FEATURE_RESUME = 0x0004  # device keeps the chunks received of an interrupted transfer
+FEATURE_TAGGED_REPLIES = 0x0008  # command answers are payload_reply.PayloadReply frames
+FEATURE_DEFLATE = 0x0010  # protocol v2 files may be sent compressed (payload_file.FLAG_DEFLATE)
+FEATURE_LOG_CONTROL = 0x0020  # LOG_CONTROL command: device log level and rate limit
+FEATURE_NUMBERED_FRAMES = 0x0040  # consecutive packet ids, a repeated id is a retransmitted frame
+
+class PayloadConnect(ctypes.LittleEndianStructure):
+    """link capabilities exchanged in the CONNECT handshake
+    the host sends its own, the device answers with an ack followed by its own"""
+    _pack_ = 1
+    _fields_ = [
+        ("protocol_version", ctypes.c_uint8),
+        ("window_size", ctypes.c_uint8),
+        ("max_chunk_size", ctypes.c_uint16),  # protocol v2: file data bytes per chunk
+        ("features", ctypes.c_uint16),  # host: features wished, device: features accepted
+    ]
+
+    def __init__(self, packet = None):
+       if packet is not None:
+          # a shorter packet from an older peer leaves the missing fields to 0
+          ctypes.memmove(ctypes.addressof(self), bytes(packet), min(len(packet), ctypes.sizeof(self)))
+
+    def serialize(self):
+        return bytearray(self)
@@ -2,12 +2,19 @@ from enum import Enum
 from enum import IntEnum
 import ctypes
 import logging
+import struct
 
+# PayloadFileV2.flags
+# the chunks carry the file compressed as a raw deflate stream (no zlib header) with
+# a window of 2^DEFLATE_WINDOW_BITS bytes, to be inflated by the device as received
+FLAG_DEFLATE = 0x01
+DEFLATE_WINDOW_BITS = 10
 
 
 class PayloadFile(ctypes.Structure):
     FILE_NAME_SIZE   = 20
     FILE_CHUNK_SIZE  = 196
+    MAX_CHUNKS       = 255
 
     _pack_ = 2
     _fields_ = [
@@ -43,3 +50,89 @@ class PayloadFile(ctypes.Structure):
         serialized_data.extend(self.data)
 
         return serialized_data
+
+
+class PayloadFileV2(ctypes.LittleEndianStructure):
+    """protocol v2 file chunk: header followed by the chunk_size valid data bytes
+    the chunk size is negotiated at connection, up to what a 16-bit frame length holds"""
+    FILE_NAME_SIZE   = 20
+    MAX_CHUNK_SIZE   = 0xFFFF - 31  # frame length minus this header
+
+    _pack_ = 1
+    _fields_ = [
+        ("chunk_id", ctypes.c_uint32),
+        ("number_of_chunks", ctypes.c_uint32),
+        ("chunk_size", ctypes.c_uint16),
+        ("flags", ctypes.c_uint8),  # FLAG_ bits of the file
+        ("name", ctypes.c_uint8 * FILE_NAME_SIZE),
+    ]
+
+    def __init__(self, data = b""):
+       super().__init__()
+       self.data = data
+
+    def serialize(self):
+        return bytearray(self) + self.data
+
+
+class FileChunker:
+    """zero-copy serialization of the chunks of a file
+    the chunk header is packed and the data copied from a memoryview over the file
+    (e.g. memory-mapped) into one frame buffer allocated for the whole transfer,
+    each chunk is returned as a view of that buffer, valid until the next chunk"""
+
+    # same layouts as PayloadFile and PayloadFileV2
+    HEADER_V1 = struct.Struct("<BBB%ds" % PayloadFile.FILE_NAME_SIZE)
+    HEADER_V2 = struct.Struct("<IIHB%ds" % PayloadFileV2.FILE_NAME_SIZE)
+
+    def __init__(self, data, filename_bytes, chunk_size, protocol_version, flags=0):
+        """constructor
+
+        Args:
+            data (memoryview): content of the file, compressed if flags has FLAG_DEFLATE
+            filename_bytes (bytes): name of the file, truncated to FILE_NAME_SIZE
+            chunk_size (int): file bytes per chunk
+            protocol_version (int): v1 chunks are padded to FILE_CHUNK_SIZE,
+                v2 chunks only carry their valid bytes
+            flags (int): FLAG_ bits of the v2 chunks
+        """
+        self.data = data
+        self.filename_bytes = filename_bytes
+        self.chunk_size = chunk_size
+        self.protocol_version = protocol_version
+        self.flags = flags
+        self.total_chunks = (len(data) + chunk_size - 1) // chunk_size
+        self.header = self.HEADER_V2 if protocol_version >= 2 else self.HEADER_V1
+        self.buffer = bytearray(self.header.size + chunk_size)
+        self.view = memoryview(self.buffer)
+        self.zeros = memoryview(bytes(chunk_size))
+
+    def chunk_length(self, chunk_id):
+        """number of valid file bytes of the chunk"""
+        return min(self.chunk_size, len(self.data) - chunk_id * self.chunk_size)
+
+    def chunk(self, chunk_id):
+        """serialize the payload of the given chunk
+
+        Returns:
+            memoryview: payload, a view of the frame buffer overwritten by the next call
+        """
+        length = self.chunk_length(chunk_id)
+        start = chunk_id * self.chunk_size
+        if self.protocol_version >= 2:
+            self.header.pack_into(self.buffer, 0, chunk_id, self.total_chunks, length, self.flags, self.filename_bytes)
+        else:
+            self.header.pack_into(self.buffer, 0, chunk_id, self.total_chunks, length, self.filename_bytes)
+        data_start = self.header.size
+        self.view[data_start:data_start + length] = self.data[start:start + length]
+        if self.protocol_version >= 2:
+            return self.view[:data_start + length]
+        if length < self.chunk_size:
+            # v1 chunks have a fixed size, clear what the previous chunk left
+            self.view[data_start + length:] = self.zeros[length:]
+        return self.view
+
+    def release(self):
+        """release the views so that the underlying file mapping can be closed"""
+        self.view.release()
+        self.data.release()
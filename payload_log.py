@@ -11,6 +11,80 @@ class LogLevel(Enum):
   LOG_LEVEL_WARNING = 2
   LOG_LEVEL_ERROR = 3
 
+# PayloadLogControl values leaving the device setting unchanged
+LOG_LEVEL_KEEP = 0xFF
+LOG_RATE_KEEP = 0xFFFF
+
+
+class PayloadLogControl(ctypes.LittleEndianStructure):
+    """LOG_CONTROL command: messages below min_level are not sent by the device,
+    nor the ones beyond max_rate per second (0 for no limit)"""
+    _pack_ = 1
+    _fields_ = [
+        ("min_level", ctypes.c_uint8),  # LogLevel value or LOG_LEVEL_KEEP
+        ("max_rate", ctypes.c_uint16),  # messages per second or LOG_RATE_KEEP
+    ]
+
+    def serialize(self):
+        return bytearray(self)
+
+
+class PayloadLogStats(ctypes.LittleEndianStructure):
+    """answer of the LOG_CONTROL command: settings applied and messages not sent
+    since the connection"""
+    _pack_ = 1
+    _fields_ = [
+        ("min_level", ctypes.c_uint8),
+        ("max_rate", ctypes.c_uint16),
+        ("suppressed_messages", ctypes.c_uint32),
+        ("suppressed_bytes", ctypes.c_uint32),  # frame bytes the messages would have used on the link
+    ]
+
+    def __init__(self, packet = None):
+       if packet is not None:
+          ctypes.memmove(ctypes.addressof(self), bytes(packet), min(len(packet), ctypes.sizeof(self)))
+
+    def serialize(self):
+        return bytearray(self)
+
+
+# level names as shown in the logs (INFO, ERROR...), computed once
+LEVEL_NAMES = {level.value: level.name.rsplit("_", 1)[-1] for level in LogLevel}
+
+
+def parse_level(name):
+    """
+    Args:
+        name (str): level name, case insensitive (debug, info, warning, error)
+
+    Returns:
+        LogLevel: the level
+
+    Raises:
+        KeyError: unknown level name
+    """
+    return LogLevel["LOG_LEVEL_" + name.upper()]
+
+
+def level_name(level):
+    """name of a device log level, LEVEL<n> for a level unknown to this version"""
+    name = LEVEL_NAMES.get(level)
+    return name if name is not None else "LEVEL%i" % level
+
+
+def decode_log(payload):
+    """decode a LOG frame payload without copying it into a PayloadLog: only the
+    message bytes before the zero padding are decoded
+
+    Returns:
+        tuple: (level, message)
+    """
+    end = payload.find(b"\0", 1, LOG_MESSAGE_SIZE + 1)
+    if end == -1:
+        end = LOG_MESSAGE_SIZE + 1
+    return payload[0], payload[1:end].decode("utf-8", "replace")
+
+
 class PayloadLog(ctypes.Structure):
     _pack_ = 1
     _fields_ = [
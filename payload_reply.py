@@ -0,0 +1,25 @@
+import ctypes
+
+
+class PayloadReply(ctypes.LittleEndianStructure):
+    """header of the COMMAND frames answering a command when FEATURE_TAGGED_REPLIES
+    is negotiated, followed by the entry data (e.g. a file name)
+    a command is answered by count frames (index 0 to count - 1), or by a single
+    frame without data when count is 0 (empty list, command without result)"""
+    _pack_ = 1
+    _fields_ = [
+        ("request_id", ctypes.c_uint16),  # packet id of the command frame answered
+        ("index", ctypes.c_uint16),  # entry carried by this frame
+        ("count", ctypes.c_uint16),  # total entries of the answer
+        ("status", ctypes.c_uint8),  # payload_ack.AckType of the command
+    ]
+
+    def __init__(self, packet = None):
+       if packet is not None:
+          ctypes.memmove(ctypes.addressof(self), bytes(packet), min(len(packet), ctypes.sizeof(self)))
+          self.data = bytes(packet[ctypes.sizeof(self):])
+       else:
+          self.data = b""
+
+    def serialize(self):
+        return bytearray(self) + self.data
@@ -0,0 +1,41 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """token bucket rate limiter, thread safe
+    a consumer may overdraw the bucket, it then waits until the debt is paid back"""
+
+    def __init__(self, rate, burst=None):
+        """constructor
+
+        Args:
+            rate (float): tokens refilled per second, 0 for no limit
+            burst (float): max tokens saved while idle, defaults to one second of rate
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """take amount tokens without blocking
+
+        Returns:
+            float: time in seconds the caller has to wait to respect the rate
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def consume(self, amount=1):
+        """take amount tokens, blocking as long as needed to respect the rate"""
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
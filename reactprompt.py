@@ -1,10 +1,17 @@
 import logging
-import time
+import logging.handlers
 import signal
 import threading
 import rsmaster as rs
+import uart_driver as ud
 import reactstepmonitor_config as rc
+import connection_supervisor as cs
+import device_sync as ds
+import device_log as dl
+import payload_log as pl
+import link_metrics as lm
 import os
+import sys
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit import print_formatted_text as print
@@ -12,6 +19,7 @@ from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.completion import NestedCompleter
 from prompt_toolkit.completion import PathCompleter
 from prompt_toolkit.completion import Completer
+from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.document import Document
 
 
@@ -19,18 +27,23 @@ from prompt_toolkit.document import Document
 command_handlers = [
     ('exit', 'exit React Prompt', 'stop', False),
     ('list workout', 'list the workout in the react sync device', 'list_workout', False),
-    ('list sessions', 'list the sessions in the react sync device', 'TODO', False),
+    ('list sessions', 'list the sessions in the react sync device', 'list_sessions', False),
+    ('stats', 'show the link counters and latencies of the react sync', 'show_stats', False),
     ('help', 'show this help', 'show_help', False),
     ('clear', 'clear the screen of the terminal', 'clear_screen', False),
     ('del', 'delete a file passed as argument', 'delete_command', True),
     ('put workout', 'transfer to react sync the workout file passed as argument', 'put_workout_command', True),
-    ('put session', 'transfer to react sync the session file passed as argument', 'TODO', True)
+    ('put session', 'transfer to react sync the session file passed as argument', 'TODO', True),
+    ('sync wipe', 'sync, and delete too the device files not in the directory sent by other hosts', 'sync_wipe_command', True),
+    ('sync', 'send the new or changed .wkt/.ses files of the directory passed as argument, delete the ones formerly sent no longer in it', 'sync_command', True),
+    ('loglevel', 'set the device log level (debug, info, warning, error) [max messages/s], show: settings and log bytes/s suppressed', 'log_level_command', True)
 ]
 
 class MyCustomCompleter(Completer):
 
     def __init__(self):
         self.path_completer = PathCompleter(expanduser=True)
+        self.level_completer = WordCompleter(['debug', 'info', 'warning', 'error', 'show'])
         self.command_completer = NestedCompleter.from_nested_dict(self.generate_completer(command_handlers))
 
     def generate_completer(self, command_handlers):
@@ -54,6 +67,14 @@ class MyCustomCompleter(Completer):
             sub_document = Document(words[2])
             for suggestion in self.path_completer.get_completions(sub_document, complete_event):
                 yield suggestion
+        elif len(words) >= 2 and words[0] == 'sync' and len(words) == (3 if words[1] == 'wipe' else 2):
+            sub_document = Document(words[-1])
+            for suggestion in self.path_completer.get_completions(sub_document, complete_event):
+                yield suggestion
+        elif len(words) == 2 and words[0] == 'loglevel':
+            sub_document = Document(words[1])
+            for suggestion in self.level_completer.get_completions(sub_document, complete_event):
+                yield suggestion
         else:
             for suggestion in self.command_completer.get_completions(document, complete_event):
                 yield suggestion
@@ -95,12 +116,46 @@ class ReactPrompt:
         signal.signal(signal.SIGTERM, self.exit_gracefully)
         signal.signal(signal.SIGINT, self.exit_gracefully)
         config = rc.ReactStepMonitorConfig()
-        self.worker = threading.Thread(
-            target=self.worker_task, name="React Step Monitor worker thread"
-        )
+        self.connected = threading.Event()
+        # length of the progress line shown, 0 if none
+        self.progress_width = 0
         # activate RS Master
-        self.rsm = rs.RSMaster()
-        self.rsm.connect()
+        self.rsm = rs.RSMaster(
+            ud.UartDriver(
+                rx_timeout=config.uart_rx_timeout,
+                tx_bytes_per_second=config.uart_tx_bytes_per_second,
+                tx_frames_per_second=config.uart_tx_frames_per_second,
+                capture_dir=config.uart_capture_dir,
+            ),
+            window_size=config.transfer_window_size,
+            chunk_size=config.transfer_chunk_size,
+            crc=config.uart_crc,
+            checkpoint_dir=config.transfer_checkpoint_dir,
+            compression=config.transfer_compression,
+            rx_channels=config.rx_channels,
+            spill_dir=config.rx_spill_dir,
+        )
+        # device log messages stored apart from log.txt
+        self.device_log = dl.config_device_log(config)
+        self.device_log.start()
+        self.rsm.device_log = self.device_log
+        self.rsm.log = config.device_log_echo
+        self.rsm.device_log_level = config.device_log_level
+        self.rsm.device_log_rate = config.device_log_rate
+        self.rsm.mute_device_logs = config.device_log_mute_transfers
+        # unchanged files are not sent again
+        self.device_sync = ds.DeviceSync(self.rsm, config.sync_manifest_dir)
+        # connects the React Sync once plugged, and again after a link drop
+        self.supervisor = cs.ConnectionSupervisor(
+            self.rsm,
+            on_connected=self.on_connected,
+            on_disconnected=self.on_disconnected,
+            backoff_min=config.connection_backoff_min,
+            backoff_max=config.connection_backoff_max,
+            poll_period=config.connection_poll_period,
+            daemon=True,
+        )
+        self.supervisor.start()
 
         session = PromptSession()
         self.bindings = KeyBindings()
@@ -115,15 +170,15 @@ class ReactPrompt:
         print("    React Studio - prompt version    ")
         print("--------------------------------------")
         print("Connecting to React Sync ...", end='')
-        while (not self.rsm.is_connected()) and (not self.exit_now):
+        while not self.connected.wait(1) and not self.exit_now:
             print(".", end='')
-            time.sleep(1)
         print(" ok")
         print("")
+        completer = MyCustomCompleter()
         while not self.exit_now:
             message = [('class:default', 'ReactStudioPrompt % ')]
             command = session.prompt(
-                message, key_bindings=self.bindings, completer=MyCustomCompleter(), style=style
+                message, key_bindings=self.bindings, completer=completer, style=style
             )
 
             # Find the handler and execute it
@@ -147,18 +202,19 @@ class ReactPrompt:
                 print(f"Unknown command: {command}")
 
     def stop(self):
+        self.supervisor.stop()
         self.rsm.stop_communication()
+        self.rsm.uart_driver.stop_capture()
+        self.device_log.stop()
         self.exit_now = True
-        if self.worker.is_alive():
-            self.worker.join()
-            logging.info("%s is stopped", self.worker.name)
+        logging.info("%s is stopped", self.supervisor.thread.name)
 
-    def worker_task(self):
-        while not self.exit_now:
-            if not self.rsm.is_connected():
-                self.rsm.disconnect()
-                self.rsm.connect()
-            time.sleep(1)
+    def on_connected(self, port):
+        self.connected.set()
+
+    def on_disconnected(self, port):
+        self.connected.clear()
+        print(f"React Sync disconnected ({port}), waiting for it to be plugged again")
 
     def show_help(self):
         print('')
@@ -172,7 +228,10 @@ class ReactPrompt:
     def delete_command(self, argument):
         if argument:
             print(f"Deleting file: {argument}")
-            self.rsm.send_delete_file(argument)
+            if self.device_sync.delete_file(argument):
+                print(f"File: {argument} deleted")
+            else:
+                print(f"Error deleting file: {argument}")
         else:
             print(f"Invalid usage. Usage: del [file_name]")
     
@@ -180,12 +239,77 @@ class ReactPrompt:
         if argument:
             print(f"Sending file: {argument}")
             try:
-                self.rsm.send_workout_file(argument)
+                if not self.device_sync.push_file(argument, progress=self.show_progress):
+                    print("File unchanged on the device, not sent")
             except Exception as e:
-                print(e)                
+                self.end_progress()
+                print(e)
         else:
             print(f"Invalid usage. Usage: put [file_name with fullpath]")
 
+    def sync_command(self, argument, delete_unknown=False):
+        if not os.path.isdir(argument):
+            print(f"Not a directory: {argument}")
+            return
+        print(f"Synchronizing with: {argument}")
+        try:
+            result = self.device_sync.sync(argument, progress=self.show_progress, delete_unknown=delete_unknown)
+        except Exception as e:
+            self.end_progress()
+            print(e)
+            return
+        self.end_progress()
+        for name in result.uploaded:
+            print(f"sent: {name}")
+        for name in result.deleted:
+            print(f"deleted: {name}")
+        for name, error in result.failed.items():
+            print(f"failed: {name}: {error}")
+        print(result.summary())
+
+    def sync_wipe_command(self, argument):
+        self.sync_command(argument, delete_unknown=True)
+
+    def log_level_command(self, argument):
+        words = argument.split()
+        try:
+            if words[0] == 'show':
+                stats = self.rsm.send_log_control()
+            else:
+                stats = self.rsm.send_log_control(pl.parse_level(words[0]),
+                                                  int(words[1]) if len(words) > 1 else None)
+        except (KeyError, ValueError):
+            print("Invalid usage. Usage: loglevel debug|info|warning|error [max messages/s] | loglevel show")
+            return
+        if stats is None:
+            print("Device log level not changed: not supported or no answer from React Sync")
+            return
+        print(f"Device log level: {pl.level_name(stats.min_level)}, "
+              f"max rate: {stats.max_rate or 'none'}{' messages/s' if stats.max_rate else ''}")
+        print(f"Suppressed: {stats.suppressed_messages} messages, {stats.suppressed_bytes} bytes "
+              f"({self.rsm.log_suppressed_rate:.0f} bytes/s since the previous query)")
+
+    def show_stats(self):
+        for port, stats in lm.masters_stats([self.rsm]).items():
+            for line in lm.format_stats(port, stats):
+                print(line)
+
+    def show_progress(self, progress):
+        """live rate line of the file being sent, rewritten on each chunk acknowledged"""
+        line = progress.summary()
+        sys.stdout.write("\r" + line.ljust(self.progress_width))
+        sys.stdout.flush()
+        self.progress_width = len(line)
+        if progress.finished is not None:
+            self.end_progress()
+
+    def end_progress(self):
+        """terminate the progress line, left unfinished by a failed transfer"""
+        if self.progress_width:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+            self.progress_width = 0
+
     def list_workout(self):
         file_list = self.rsm.send_list_workout()
         if file_list:
@@ -194,6 +318,14 @@ class ReactPrompt:
         else:
             print("No workout file")
 
+    def list_sessions(self):
+        file_list = self.rsm.send_list_sessions()
+        if file_list:
+            for filename in file_list:
+                print(filename)
+        else:
+            print("No session file")
+
 
 if __name__ == "__main__":
     if rc.ReactStepMonitorConfig().logging_level == "info":
@@ -201,13 +333,14 @@ if __name__ == "__main__":
     else:
         logging_level = logging.DEBUG
 
-    log_file = "log.txt"  # Replace with your desired log file name
+    config = rc.ReactStepMonitorConfig()
     logging.basicConfig(
         level=logging_level,
         format="%(asctime)s %(message)s",
         datefmt="%b %d %H:%M:%S",
-        filename=log_file,
-        filemode="w"
+        # appended to the history of the previous runs, rotated by size
+        handlers=[logging.handlers.RotatingFileHandler(
+            config.log_file, maxBytes=config.log_max_bytes, backupCount=config.log_backup_count)],
     )
     logging.info("----------------------------------------------")
     logging.info(
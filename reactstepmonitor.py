@@ -1,10 +1,13 @@
 import logging
-import time
+import logging.handlers
 import signal
 import curses
-import threading
 import rsmaster as rs
+import uart_driver as ud
 import reactstepmonitor_config as rc
+import connection_supervisor as cs
+import device_log as dl
+import link_metrics as lm
 
 import click
 from prompt_toolkit import PromptSession
@@ -25,32 +28,60 @@ class ReactStepMonitor:
         signal.signal(signal.SIGTERM, self.exit_gracefully)
         signal.signal(signal.SIGINT, self.exit_gracefully)
         config = rc.ReactStepMonitorConfig()
-        self.worker = threading.Thread(
-            target=self.worker_task, name="React Step Monitor worker thread"
-        )
         # activate RS Master
-        self.rsm = rs.RSMaster()
-        self.rsm.connect()
-
-    def worker_task(self):
-        while not self.exit_now:
-            if not self.rsm.is_connected():
-                self.rsm.disconnect()
-                self.rsm.connect()
-            time.sleep(1)
-
+        self.rsm = rs.RSMaster(
+            ud.UartDriver(
+                rx_timeout=config.uart_rx_timeout,
+                tx_bytes_per_second=config.uart_tx_bytes_per_second,
+                tx_frames_per_second=config.uart_tx_frames_per_second,
+                capture_dir=config.uart_capture_dir,
+            ),
+            window_size=config.transfer_window_size,
+            chunk_size=config.transfer_chunk_size,
+            crc=config.uart_crc,
+            checkpoint_dir=config.transfer_checkpoint_dir,
+            compression=config.transfer_compression,
+            rx_channels=config.rx_channels,
+            spill_dir=config.rx_spill_dir,
+        )
+        # device log messages stored apart from log.txt
+        self.device_log = dl.config_device_log(config)
+        self.rsm.device_log = self.device_log
+        self.rsm.log = config.device_log_echo
+        self.rsm.device_log_level = config.device_log_level
+        self.rsm.device_log_rate = config.device_log_rate
+        self.rsm.mute_device_logs = config.device_log_mute_transfers
+        # connects the React Sync once plugged, and again after a link drop
+        self.supervisor = cs.ConnectionSupervisor(
+            self.rsm,
+            backoff_min=config.connection_backoff_min,
+            backoff_max=config.connection_backoff_max,
+            poll_period=config.connection_poll_period,
+        )
+        # link counters and latencies: Prometheus file/endpoint, periodic summary in the log
+        self.metrics = lm.MetricsExporter(
+            lambda: lm.masters_stats([self.rsm]),
+            file=config.metrics_file,
+            http_port=config.metrics_http_port,
+            period=config.metrics_period,
+            summary_period=config.metrics_summary_period,
+        )
 
     def start(self):
-        if not (self.worker.is_alive()):
-            self.worker.start()
+        if not (self.supervisor.thread.is_alive()):
+            self.device_log.start()
+            self.supervisor.start()
+            self.metrics.start()
 
     def stop(self):
         logging.info("---------- STOPPING ----------------")
-        self.rsm.stop_communication()
+        self.supervisor.stop()
+        self.metrics.stop()
+        self.rsm.disconnect()
+        self.rsm.uart_driver.stop_capture()
+        self.device_log.stop()
         self.exit_now = True
-        if self.worker.is_alive():
-            self.worker.join()
-            logging.info("%s is stopped", self.worker.name)
+        logging.info("%s is stopped", self.supervisor.thread.name)
 
 if __name__ == "__main__":
     if rc.ReactStepMonitorConfig().logging_level == "info":
@@ -61,13 +92,14 @@ if __name__ == "__main__":
     # logging.basicConfig(
     #     level=logging_level, format="%(asctime)s %(message)s", datefmt="%b %d %H:%M:%S"
     # )
-    log_file = "log.txt"  # Replace with your desired log file name
+    config = rc.ReactStepMonitorConfig()
     logging.basicConfig(
     level=logging.INFO,  # Set the desired log level
     format="%(asctime)s %(message)s",  # Define log message format
     datefmt="%b %d %H:%M:%S",  # Define date format
-    filename=log_file,  # Set the log file name
-    filemode="w"  # Set the file mode (overwrite if it exists)
+    # appended to the history of the previous runs, rotated by size
+    handlers=[logging.handlers.RotatingFileHandler(
+        config.log_file, maxBytes=config.log_max_bytes, backupCount=config.log_backup_count)],
     )
     logging.info("----------------------------------------------")
     logging.info(
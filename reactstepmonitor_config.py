@@ -4,6 +4,8 @@ import yaml
 import logging
 import logging
 import singleton_meta as sm
+import rx_channel as rxc
+import payload_log as pl
 
 
 class ReactStepMonitorConfig(metaclass=sm.SingletonMeta):
@@ -18,6 +20,53 @@ class ReactStepMonitorConfig(metaclass=sm.SingletonMeta):
             with open(file, "r") as config_file:
                 config = yaml.safe_load(config_file)
                 self.logging_level = config["log"]["level"]
+                log = config["log"]
+                self.log_file = log.get("file", "log.txt")
+                self.log_max_bytes = int(log.get("max_bytes", 10 * 1024 * 1024))
+                self.log_backup_count = int(log.get("backup_count", 5))
+                self.device_log_dir = log.get("device_dir", "device_logs")
+                self.device_log_max_bytes = int(log.get("device_max_bytes", 10 * 1024 * 1024))
+                self.device_log_rotate_seconds = float(log.get("device_rotate_seconds", 0))
+                self.device_log_backup_count = int(log.get("device_backup_count", 10))
+                self.device_log_echo = bool(log.get("device_echo", False))
+                # device side filtering of the log messages, applied at connection
+                self.device_log_level = pl.parse_level(log["device_level"]) if log.get("device_level") else None
+                self.device_log_rate = int(log["device_max_rate"]) if log.get("device_max_rate") is not None else None
+                self.device_log_mute_transfers = bool(log.get("device_mute_transfers", True))
+                uart = config.get("uart") or {}
+                self.uart_rx_timeout = float(uart.get("rx_timeout", 0.1))
+                self.uart_tx_bytes_per_second = int(uart.get("tx_bytes_per_second", 0))
+                self.uart_tx_frames_per_second = int(uart.get("tx_frames_per_second", 0))
+                self.uart_crc = uart.get("crc", "crc16")
+                if self.uart_crc not in ("crc16", "crc32", "none"):
+                    raise KeyError("uart.crc must be crc16, crc32 or none")
+                self.uart_capture_dir = uart.get("capture_dir")
+                transfer = config.get("transfer") or {}
+                self.transfer_window_size = int(transfer.get("window_size", 8))
+                self.transfer_chunk_size = int(transfer.get("chunk_size", 4096))
+                self.transfer_checkpoint_dir = transfer.get("checkpoint_dir")
+                self.transfer_compression = transfer.get("compression", "deflate")
+                if self.transfer_compression not in ("deflate", "none"):
+                    raise KeyError("transfer.compression must be deflate or none")
+                connection = config.get("connection") or {}
+                self.connection_backoff_min = float(connection.get("reconnect_backoff_min", 0.5))
+                self.connection_backoff_max = float(connection.get("reconnect_backoff_max", 30))
+                self.connection_poll_period = float(connection.get("port_poll_period", 1))
+                rx = config.get("rx") or {}
+                # reply type -> (max payloads in memory, overflow policy)
+                self.rx_channels = {
+                    "ack": (int(rx.get("ack_queue_size", 10)), rxc.OverflowPolicy(rx.get("ack_policy", "spill"))),
+                    "command": (int(rx.get("command_queue_size", 10)),
+                                rxc.OverflowPolicy(rx.get("command_policy", "spill"))),
+                }
+                self.rx_spill_dir = rx.get("spill_dir")
+                sync = config.get("sync") or {}
+                self.sync_manifest_dir = sync.get("manifest_dir", ".device_manifests")
+                metrics = config.get("metrics") or {}
+                self.metrics_file = metrics.get("file")
+                self.metrics_http_port = int(metrics.get("http_port") or 0)
+                self.metrics_period = float(metrics.get("period", 15))
+                self.metrics_summary_period = float(metrics.get("summary_period", 0))
         except FileNotFoundError as exception:
             msg = "Configuration file not found. Please create a config.yaml file in the project root directory."
         except KeyError as exception:
@@ -1,14 +1,14 @@
+import collections
 import logging
-import time
-import signal
-import curses
 import threading
 import rsmaster as rs
+import uart_driver as ud
 import reactstepmonitor_config as rc
+import connection_supervisor as cs
+import device_sync as ds
+import device_log as dl
 import tkinter as tk
 from tkinter import font, messagebox, scrolledtext, ttk, filedialog
-import queue
-import asyncio
 
 
 # Define constants for file extensions
@@ -16,27 +16,54 @@ SESSION_EXTENSION_FILENAME = "*.ses"
 WORKOUT_EXTENSION_FILENAME = "*.wkt"
 
 class QueueHandler(logging.Handler):
-    """Class to send logging records to a queue
+    """Class to send logging records to a bounded queue
 
-    It can be used from different threads
+    It can be used from different threads, the oldest records are dropped when the
+    GUI does not keep up, and only the records displayed are formatted
     """
 
-    def __init__(self, log_queue):
+    MAX_PENDING = 10000
+
+    def __init__(self, max_pending=MAX_PENDING):
         super().__init__()
-        self.log_queue = log_queue
+        self.records = collections.deque(maxlen=max_pending)
+        self.dropped = 0
 
     def emit(self, record):
-        message = self.format(record)
-        self.log_queue.put(message)
+        # deque appends are thread safe, the handler lock guards the drop counter
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+    def drain(self, max_records):
+        """
+        Args:
+            max_records (int): records returned at most, the most recent ones
+
+        Returns:
+            tuple: (list of (formatted record, level), records dropped since the previous drain)
+        """
+        self.acquire()
+        try:
+            records = list(self.records)
+            self.records.clear()
+            dropped = self.dropped + max(0, len(records) - max_records)
+            self.dropped = 0
+        finally:
+            self.release()
+        return [(self.format(record), record.levelno) for record in records[-max_records:]], dropped
 
 class ReactStepToolbox(tk.Tk):
-    
+
+    LOG_POLL_PERIOD = 50  # ms between two refreshes of the log view
+    MAX_LINES_PER_POLL = 250  # lines shown per refresh, the older ones of a flood are dropped
+    MAX_LOG_LINES = 5000  # lines kept in the log view, the oldest are removed
+
     def __init__(self):
         """ constructor """
         super().__init__()
         self.title("ReactStep Toolbox") 
-        self.log_queue = queue.Queue()
-        self.queue_handler = QueueHandler(self.log_queue)
+        self.queue_handler = QueueHandler()
         formatter = logging.Formatter('%(asctime)s: %(message)s')
         self.queue_handler.setFormatter(formatter)
         logging.getLogger().addHandler(self.queue_handler)
@@ -57,25 +84,74 @@ class ReactStepToolbox(tk.Tk):
         self.geometry(f'{rw}x{rh}+{int((sw-rw)/2)}+{int((sh-rh)/2)-30}')
         # finalize init
         self.__show_welcome_message()
-        # launch background worker thread
         self.exit_now = False
-        self.worker = threading.Thread(
-            target=self.__worker_task, name="ReactStep Toolbox Worker Thread"
-        )
-        self.worker.daemon = True
         # activate RS Master
-        self.rsm = rs.RSMaster()
-        self.rsm.connect()
-        self.worker.start()
-        self.after(10, self.poll_log_queue)
-        
+        config = rc.ReactStepMonitorConfig()
+        self.rsm = rs.RSMaster(
+            ud.UartDriver(
+                rx_timeout=config.uart_rx_timeout,
+                tx_bytes_per_second=config.uart_tx_bytes_per_second,
+                tx_frames_per_second=config.uart_tx_frames_per_second,
+                capture_dir=config.uart_capture_dir,
+            ),
+            window_size=config.transfer_window_size,
+            chunk_size=config.transfer_chunk_size,
+            crc=config.uart_crc,
+            checkpoint_dir=config.transfer_checkpoint_dir,
+            compression=config.transfer_compression,
+            rx_channels=config.rx_channels,
+            spill_dir=config.rx_spill_dir,
+        )
+        # device log messages stored, still shown in the terminal view
+        self.device_log = dl.config_device_log(config)
+        self.device_log.start()
+        self.rsm.device_log = self.device_log
+        self.rsm.device_log_level = config.device_log_level
+        self.rsm.device_log_rate = config.device_log_rate
+        self.rsm.mute_device_logs = config.device_log_mute_transfers
+        # unchanged files are not sent again
+        self.device_sync = ds.DeviceSync(self.rsm, config.sync_manifest_dir)
+        # connects the React Sync once plugged, and again after a link drop
+        self.connected_port = None
+        self.supervisor = cs.ConnectionSupervisor(
+            self.rsm,
+            on_connected=self.__on_connected,
+            on_disconnected=self.__on_disconnected,
+            backoff_min=config.connection_backoff_min,
+            backoff_max=config.connection_backoff_max,
+            poll_period=config.connection_poll_period,
+            daemon=True,
+        )
+        self.supervisor.start()
+        self.shown_port = ""
+        # progress of the file transfer thread: latest (percent, summary) to show, transfer over
+        self.transfer_state = None
+        self.transfer_done = False
+        self.after(self.LOG_POLL_PERIOD, self.poll_log_queue)
+
     def poll_log_queue(self):
-            try:
-                record = self.log_queue.get(block=False)
-                self.__write_terminal(record)
-            except queue.Empty:
-                pass
-            self.after(10, self.poll_log_queue)  # Schedule the next polling
+            # every record pending in a single insert, the most recent ones only during a flood
+            lines, dropped = self.queue_handler.drain(self.MAX_LINES_PER_POLL)
+            if lines or dropped:
+                chunks = []
+                if dropped:
+                    chunks += [f"--- {dropped} lines dropped ---\n", "warning"]
+                for line, level in lines:
+                    chunks += [line + "\n", "warning" if level >= logging.WARNING else ""]
+                self.__insert_terminal(chunks)
+            # the transfer thread only sets its state, the window is updated here
+            state = self.transfer_state
+            if state is not None:
+                self.transfer_state = None
+                self.progress_bar["value"], self.progress_label["text"] = state
+            if self.transfer_done:
+                self.transfer_done = False
+                self.progress_window.destroy()
+            if self.connected_port != self.shown_port:
+                # tk widgets are only updated from the main thread
+                self.shown_port = self.connected_port
+                self.title("ReactStep Toolbox" + (f" - {self.shown_port}" if self.shown_port else " - disconnected"))
+            self.after(self.LOG_POLL_PERIOD, self.poll_log_queue)  # Schedule the next polling
 
     def __create_top_menu(self):
         """ create top menu of the toolbox app """
@@ -104,11 +180,14 @@ class ReactStepToolbox(tk.Tk):
     def create_progress_window(self):
         self.progress_window = tk.Toplevel(self)
         self.progress_window.title("File Transfer Progress")
-        self.center_window(self.progress_window, 400, 50)
+        self.center_window(self.progress_window, 480, 90)
 
         # Create a progress bar in determinate mode
-        self.progress_bar = ttk.Progressbar(self.progress_window, length=300, mode='determinate')
-        self.progress_bar.pack(padx=20, pady=20)
+        self.progress_bar = ttk.Progressbar(self.progress_window, length=400, mode='determinate')
+        self.progress_bar.pack(padx=20, pady=(20, 5))
+        # rate, ack round trip time and time left
+        self.progress_label = ttk.Label(self.progress_window, text="")
+        self.progress_label.pack(padx=20, pady=(0, 10))
 
     def center_window(self, window, width, height):
         main_frame_x = self.frame_main.winfo_rootx()
@@ -122,26 +201,21 @@ class ReactStepToolbox(tk.Tk):
         window.geometry(f"{window_width}x{window_height}+{window_x}+{window_y}")
 
     def perform_file_transfer(self, file_path):
-        # Simulate the async file transfer here (replace with your actual logic)
-        asyncio.run(self.async_file_transfer(file_path))
-        logging.info("File transfer completed.")
+        """ file transfer thread, its progress is shown by poll_log_queue """
+        try:
+            if self.device_sync.push_file(file_path, progress=self.__on_transfer_progress):
+                logging.info("File transfer completed.")
+            else:
+                logging.info("File unchanged on the device, not sent")
+        except Exception as exception:
+            logging.warning("File transfer failed: %s", exception)
         # Close the progress window after the file transfer is complete
-        self.progress_window.destroy()
-
-    async def async_file_transfer(self, file_path):
-        
-        self.rsm.send_workout_file(file_path)
-        # Simulate the async file transfer here (replace with your actual logic)
-        interval = .05  # Interval for progress update in seconds
-        progress_value = 0
-
-        while progress_value < 100:
-            progress_value += 10
-            self.progress_bar["value"] = progress_value
-            await asyncio.sleep(interval)
+        self.transfer_done = True
 
+    def __on_transfer_progress(self, progress):
+        """ called from the transfer thread on each chunk acknowledged """
+        self.transfer_state = (progress.fraction * 100, progress.summary())
 
-    
     def __create_main_layout(self):
         """ create main layout with 2 rows, 1 column """
         self.rowconfigure(0, weight=10)
@@ -183,17 +257,28 @@ class ReactStepToolbox(tk.Tk):
 
     def __write_terminal(self, txt, tag=""):
         """ write txt message in the rx text widget """
+        self.__insert_terminal([txt + "\n", tag])
+
+    def __insert_terminal(self, chunks):
+        """ append text to the rx text widget, keeping its last MAX_LOG_LINES lines
+
+        Args:
+            chunks (list): text, tag, text, tag... inserted at once
+        """
         self.scrolled_text_rx.configure(state=tk.NORMAL)
-        self.scrolled_text_rx.insert(tk.END, txt, tag)
-        self.scrolled_text_rx.insert(tk.END, "\n")
+        self.scrolled_text_rx.insert(tk.END, *chunks)
+        # the text always ends with an empty line after the last newline
+        excess = int(self.scrolled_text_rx.index("end-1c").split(".")[0]) - 1 - self.MAX_LOG_LINES
+        if excess > 0:
+            self.scrolled_text_rx.delete("1.0", f"{excess + 1}.0")
+        self.scrolled_text_rx.configure(state=tk.DISABLED)
         self.scrolled_text_rx.see(tk.END)
 
-    def __worker_task(self):
-        while True:
-            if not self.rsm.is_connected():
-                self.rsm.disconnect()
-                self.rsm.connect()
-            time.sleep(1)
+    def __on_connected(self, port):
+        self.connected_port = port
+
+    def __on_disconnected(self, port):
+        self.connected_port = None
 
     def __exit_self(self):
         """ exit application callback """
@@ -205,8 +290,11 @@ class ReactStepToolbox(tk.Tk):
         self.__exit()
 
     def __exit(self):
-        logging.info("%s is stopped", self.worker.name)
-        self.rsm.stop_communication()
+        self.supervisor.stop()
+        logging.info("%s is stopped", self.supervisor.thread.name)
+        self.rsm.disconnect()
+        self.rsm.uart_driver.stop_capture()
+        self.device_log.stop()
         self.destroy()
 
 if __name__ == "__main__":
@@ -0,0 +1,405 @@
+"""
+Benchmarks of the serial link against the simulated React Sync device:
+file transfer throughput, command round trip latency, rx decode cpu cost,
+framing codec, device pool throughput and cold start of the rsctl command line
+
+usage: python rsbench.py [transfer|rtt|rx|codec|pool|startup|all] [--transport memory|pty] ...
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import framing as fr
+import rsmaster as rs
+import rsmaster_async as rsa
+import uart_driver as ud
+import payload_log as pl
+import rsdevice_sim as sim
+import serial_capture as sc
+import rsdevice_pool as dp
+import device_log as dl
+
+
+def open_link(transport, baudrate, bit_error_rate=0):
+    """link to a simulated device
+
+    Args:
+        transport (str): "memory" (SimulatedSerial pair) or "pty" (Linux pseudo-terminal
+            opened by the host with pyserial)
+
+    Returns:
+        tuple: (serial port of the host UartDriver, None for a new pyserial one,
+            port to connect, device end of the link)
+    """
+    if transport == "pty":
+        path, device_port = sim.PtySerial.open(baudrate, bit_error_rate)
+        return None, path, device_port
+    host_port, device_port = sim.SimulatedSerial.pair(baudrate, bit_error_rate)
+    return host_port, host_port.port, device_port
+
+
+def file_content(content, size):
+    """
+    Args:
+        content (str): "random" (incompressible) or "workout" (structured text steps)
+    """
+    if content == "random":
+        return os.urandom(size)
+    rng = random.Random(size)
+    steps = []
+    length = 0
+    while length < size:
+        step = "step %i: type=%s duration=%i intensity=%i lights=%s\n" % (
+            len(steps), rng.choice(["reaction", "sequence", "rest"]), rng.randrange(5, 120),
+            rng.randrange(1, 10), ",".join(str(rng.randrange(8)) for _ in range(rng.randrange(1, 5))))
+        steps.append(step)
+        length += len(step)
+    return "".join(steps).encode("ascii")[:size]
+
+
+def bench_file_transfer(
+    window_sizes, file_size, baudrate, latency, bytes_per_second=0, chunk_size=4096, protocol_version=2,
+    bit_error_rate=0, crc="crc16", use_async=False, transport="memory", compression="deflate", content="random"
+):
+    """send the same file with each window size and print the bytes/s achieved"""
+    print(f"file transfer{' (asyncio)' if use_async else ''} over {transport}: {file_size} bytes {content}, protocol v{protocol_version}, {baudrate} bauds, "
+          f"device latency {latency * 1000:.1f} ms/chunk, bit error rate {bit_error_rate:g}, {crc}, "
+          f"compression {compression}, tx pacing {f'{bytes_per_second} bytes/s' if bytes_per_second else 'none'}")
+    data = file_content(content, file_size)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "bench.wkt")
+        with open(file_path, "wb") as file:
+            file.write(data)
+        for window_size in window_sizes:
+            host_port, port, device_port = open_link(transport, baudrate, bit_error_rate)
+            device = sim.SimulatedDevice(device_port, window_size=max(window_sizes), latency=latency,
+                                         protocol_version=protocol_version)
+            device.start()
+            master = rsa.AsyncRSMaster if use_async else rs.RSMaster
+            rsm = master(ud.UartDriver(serial_port=host_port, tx_bytes_per_second=bytes_per_second),
+                         window_size=window_size, chunk_size=chunk_size, crc=crc, compression=compression)
+            # a lost ack is detected sooner than with the default timeout, a pty buffers
+            # the whole window before the device reads it at the link speed
+            rsm.ACK_TIMEOUT = 0.5 + (window_size * chunk_size * 10 / baudrate if transport == "pty" and baudrate else 0)
+            try:
+                if use_async:
+                    elapsed = asyncio.run(async_file_transfer(rsm, file_path, port))
+                else:
+                    rsm.connect(port)
+                    start = time.perf_counter()
+                    rsm.send_workout_file(file_path)
+                    elapsed = time.perf_counter() - start
+            finally:
+                if not use_async:
+                    rsm.disconnect()
+                device.stop()
+                device_port.close()
+            if device.files.get("bench.wkt") != data:
+                raise Exception("file received by the simulated device is corrupted")
+            line = f"  window {window_size:>3}, chunk {rsm.chunk_size:>5}: {file_size / elapsed:8.0f} bytes/s ({elapsed:.2f} s)"
+            if rsm.link_stats()["compression_ratio"] != 1:
+                line += f", compression ratio {rsm.link_stats()['compression_ratio']:.2f}"
+            if bit_error_rate:
+                line += f", {rsm.link_stats()['rx_crc_errors']} corrupted acks dropped"
+            print(line)
+
+
+def bench_pool(device_counts, file_size, baudrate, latency, chunk_size=4096, window_size=8):
+    """send the same random file to pools of simulated devices and print the aggregate bytes/s"""
+    print(f"device pool: {file_size} bytes per device, {baudrate} bauds per link, "
+          f"device latency {latency * 1000:.1f} ms/chunk, window {window_size}")
+    data = os.urandom(file_size)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "bench.wkt")
+        with open(file_path, "wb") as file:
+            file.write(data)
+        for device_count in device_counts:
+            links = {f"sim://react-sync-{index}": sim.SimulatedSerial.pair(baudrate)
+                     for index in range(device_count)}
+            devices = [sim.SimulatedDevice(device_port, latency=latency) for _, device_port in links.values()]
+            for device in devices:
+                device.start()
+            pool = dp.DevicePool(lambda port: rs.RSMaster(ud.UartDriver(serial_port=links[port][0]),
+                                                          window_size=window_size, chunk_size=chunk_size))
+            try:
+                pool.discover(list(links))
+                start = time.perf_counter()
+                results = pool.send_workout_file(file_path)
+                elapsed = time.perf_counter() - start
+            finally:
+                pool.disconnect()
+                for device in devices:
+                    device.stop()
+            errors = [result for result in results.values() if isinstance(result, Exception)]
+            if errors or any(device.files.get("bench.wkt") != data for device in devices):
+                raise Exception("file transfer to the device pool failed: %s" % errors)
+            print(f"  {device_count:>3} devices: {device_count * file_size / elapsed:9.0f} bytes/s ({elapsed:.2f} s)")
+
+
+async def async_file_transfer(rsm, file_path, port=None):
+    """connect, send the file and disconnect with an AsyncRSMaster
+
+    Returns:
+        float: duration of the transfer in seconds
+    """
+    await rsm.connect(port)
+    try:
+        start = time.perf_counter()
+        await rsm.send_workout_file(file_path)
+        return time.perf_counter() - start
+    finally:
+        await rsm.disconnect()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {name: samples[min(len(samples) - 1, int(len(samples) * ratio))] * 1000
+            for name, ratio in (("min", 0), ("median", 0.5), ("p99", 0.99), ("max", 1))}
+
+
+def bench_command_rtt(count, baudrate, latency, log_rate=0, transport="memory"):
+    """time the DELETE_FILE command round trip (command frame out, ack in), with both
+    masters, optionally while the device floods the link with log messages"""
+    print(f"command round trip over {transport}: {count} DELETE_FILE, {baudrate} bauds, "
+          f"device latency {latency * 1000:.1f} ms, {log_rate:g} device logs/s")
+    for use_async in (False, True):
+        host_port, port, device_port = open_link(transport, baudrate)
+        device = sim.SimulatedDevice(device_port, latency=latency, log_rate=log_rate,
+                                     files={"bench%i.wkt" % index: b"" for index in range(count)})
+        device.start()
+        master = rsa.AsyncRSMaster if use_async else rs.RSMaster
+        rsm = master(ud.UartDriver(serial_port=host_port))
+        rsm.log = False
+        samples = []
+        try:
+            if use_async:
+                async def run():
+                    await rsm.connect(port)
+                    try:
+                        for index in range(count):
+                            start = time.perf_counter()
+                            if not await rsm.delete_file("bench%i.wkt" % index):
+                                raise Exception("delete command failed")
+                            samples.append(time.perf_counter() - start)
+                    finally:
+                        await rsm.disconnect()
+                asyncio.run(run())
+            else:
+                rsm.connect(port)
+                for index in range(count):
+                    start = time.perf_counter()
+                    if not rsm.send_delete_file("bench%i.wkt" % index):
+                        raise Exception("delete command failed")
+                    samples.append(time.perf_counter() - start)
+        finally:
+            if not use_async:
+                rsm.disconnect()
+            device.stop()
+            device_port.close()
+        stats = percentiles(samples)
+        print(f"  {'AsyncRSMaster' if use_async else 'RSMaster':<14} min {stats['min']:6.2f} ms, median {stats['median']:6.2f} ms, "
+              f"p99 {stats['p99']:6.2f} ms, max {stats['max']:6.2f} ms")
+
+
+def bench_rx_decode(frame_count=20000, baudrate=115200):
+    """cpu cost of the rx path on a stream of device log frames: framing decoder alone,
+    frame parsing and log decoding as RSMaster does (log output disabled), then the
+    same with the messages stored by a device log writer"""
+    print(f"rx decode cpu: {frame_count} log frames of {1 + pl.LOG_MESSAGE_SIZE} bytes")
+    payloads = [sim.SimulatedDevice.log_payload(pl.LogLevel.LOG_LEVEL_INFO, "step %i: sensor 0x%04x ok" % (index, index))
+                for index in range(frame_count)]
+    for crc in (None, "crc16", "crc32"):
+        device_driver = ud.UartDriver(serial_port=sim.SimulatedSerial())
+        device_driver.protocol_version = 2
+        device_driver.crc = crc
+        stream = b"".join(device_driver.encode_tx_frame(rs.SerialMsgType.LOG.value, payload)[1] for payload in payloads)
+        slices = [stream[pos:pos + 4096] for pos in range(0, len(stream), 4096)]
+        rsm = rs.RSMaster(ud.UartDriver(serial_port=sim.SimulatedSerial()))
+        rsm.uart_driver.protocol_version = 2
+        rsm.uart_driver.crc = crc
+        rsm.log = False
+        start = time.process_time()
+        for data in slices:
+            rsm.uart_driver.feed_rx(data)
+        framing = time.process_time() - start
+        rsm.uart_driver.rx_decoder.reset()
+        decoded = 0
+        start = time.process_time()
+        for data in slices:
+            for rx in rsm.uart_driver.feed_rx(data):
+                frame = rsm.decode_rx_frame(rx)
+                if frame is not None:
+                    rsm.log_device_message(frame[1])
+                    decoded += 1
+        total = time.process_time() - start
+        if decoded != frame_count:
+            raise Exception("rx decode lost frames: %i/%i" % (decoded, frame_count))
+        with tempfile.TemporaryDirectory() as directory:
+            rsm.device_log = dl.DeviceLogWriter(directory)
+            rsm.device_log.start()
+            rsm.uart_driver.rx_decoder.reset()
+            start = time.process_time()
+            for data in slices:
+                for rx in rsm.uart_driver.feed_rx(data):
+                    frame = rsm.decode_rx_frame(rx)
+                    if frame is not None:
+                        rsm.log_device_message(frame[1])
+            stored = time.process_time() - start
+            rsm.device_log.stop()
+        # share of one core needed by a link saturated with log frames
+        frames_per_second = baudrate / 10 / (len(stream) / frame_count)
+        print(f"  {crc or 'no crc':<7} framing {framing / frame_count * 1e6:6.2f} us/frame, "
+              f"full rx path {total / frame_count * 1e6:6.2f} us/frame ({len(stream) / total / 1e6:5.1f} MB/s), "
+              f"{frames_per_second * total / frame_count * 100:5.2f}% cpu at {baudrate} bauds, "
+              f"stored {stored / frame_count * 1e6:6.2f} us/frame")
+
+
+STARTUP_TARGET = 0.150  # s from the rsctl launch to its first frame
+
+
+def bench_startup(count=10):
+    """cold start of the rsctl command line: from its launch to the first frame received
+    by a simulated device on a pseudo-terminal, and to its exit after a list operation"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rsctl.py")
+    print(f"rsctl cold start over pty: {count} runs of rsctl list, target {STARTUP_TARGET * 1000:.0f} ms to the first frame")
+    first_frames = []
+    totals = []
+    with tempfile.TemporaryDirectory() as directory:
+        # log files of the runs in the temporary directory
+        shutil.copy(os.path.join(os.path.dirname(script), "config.yaml"), directory)
+        for _ in range(count):
+            # no wire time: the first frame time is the rsctl one
+            path, device_port = sim.PtySerial.open(0)
+            received = []
+            read = device_port.read
+
+            def timed_read(size=1):
+                data = read(size)
+                if data and not received:
+                    received.append(time.perf_counter())
+                return data
+            device_port.read = timed_read
+            device = sim.SimulatedDevice(device_port, files={"bench.wkt": b""})
+            device.start()
+            start = time.perf_counter()
+            try:
+                result = subprocess.run([sys.executable, script, "--port", path, "list"], cwd=directory,
+                                        capture_output=True, text=True)
+                totals.append(time.perf_counter() - start)
+            finally:
+                device.stop()
+                device_port.close()
+            if result.returncode or not received:
+                raise Exception("rsctl failed (%i): %s" % (result.returncode, result.stderr or result.stdout))
+            first_frames.append(received[0] - start)
+    first_frame, total = percentiles(first_frames), percentiles(totals)
+    print(f"  first frame min {first_frame['min']:6.1f} ms, median {first_frame['median']:6.1f} ms, "
+          f"max {first_frame['max']:6.1f} ms: {'ok' if first_frame['median'] <= STARTUP_TARGET * 1000 else 'TOO SLOW'}")
+    print(f"  whole run   min {total['min']:6.1f} ms, median {total['median']:6.1f} ms, max {total['max']:6.1f} ms")
+
+
+def legacy_encode_frame(body):
+    """tx byte stuffing as done by send_tx_buffer before the framing module"""
+    body = body.replace(fr.FLAG_ESC, fr.FLAG_ESC + fr.FLAG_ESC)
+    body = body.replace(fr.FLAG_START, fr.FLAG_ESC + fr.FLAG_START)
+    body = body.replace(fr.FLAG_STOP, fr.FLAG_ESC + fr.FLAG_STOP)
+    return bytearray(fr.FLAG_START) + body + bytearray(fr.FLAG_STOP)
+
+
+def legacy_decode_frame(stream):
+    """rx de-stuffing as done by get_rx_buffer before the framing module:
+    one read and one concatenation per byte"""
+    escaping = False
+    rx = stream.read(1)
+    if rx == fr.FLAG_START:
+        while True:
+            rx += stream.read(1)
+            if escaping:
+                escaping = False
+            elif rx[-1:] == fr.FLAG_ESC:
+                escaping = True
+                rx = rx[:-1]
+            elif rx[-1:] == fr.FLAG_STOP:
+                return rx
+    return None
+
+
+def bench_codec():
+    """compare the framing codec with the former implementation on worst-case payloads"""
+    print("framing codec (us per frame, legacy -> framing module)")
+    payloads = [
+        ("196 B random", os.urandom(196)),
+        ("196 B all flags", (fr.FLAG_START + fr.FLAG_STOP + fr.FLAG_ESC) * 65 + fr.FLAG_ESC),
+        ("64 KB random", os.urandom(65536)),
+        ("64 KB all flags", (fr.FLAG_START + fr.FLAG_STOP + fr.FLAG_ESC) * 21845 + fr.FLAG_ESC),
+    ]
+    for name, payload in payloads:
+        frame = fr.encode_frame(payload)
+        if bytes(legacy_encode_frame(payload)) != frame:
+            raise Exception("framing codec encoding differs from the legacy one")
+        if fr.FrameDecoder().feed(frame) != [payload] or legacy_decode_frame(io.BytesIO(frame))[1:-1] != payload:
+            raise Exception("framing codec decoding differs from the legacy one")
+        number = 2000 if len(payload) < 1000 else 5
+        results = []
+        for function in (
+            lambda: legacy_encode_frame(payload),
+            lambda: fr.encode_frame(payload),
+            lambda: legacy_decode_frame(io.BytesIO(frame)),
+            lambda: fr.FrameDecoder().feed(frame),
+        ):
+            results.append(timeit.timeit(function, number=number) / number * 1e6)
+        print(f"  {name:<16} encode {results[0]:10.1f} -> {results[1]:8.1f}"
+              f"   decode {results[2]:10.1f} -> {results[3]:8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="React Sync serial link benchmarks")
+    parser.add_argument("benchmark", choices=["transfer", "codec", "pool", "rtt", "rx", "startup", "all"], nargs="?",
+                        default="transfer")
+    parser.add_argument("--transport", choices=["memory", "pty"], default="memory",
+                        help="link to the simulated device")
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 2, 4, 8], help="device pool sizes")
+    parser.add_argument("--size", type=int, default=20000, help="file size in bytes")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--latency", type=float, default=0.005, help="device processing time per chunk (s)")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="file bytes per chunk (protocol v2)")
+    parser.add_argument("--protocol", type=int, choices=[1, 2], default=2, help="device protocol version")
+    parser.add_argument("--bit-error-rate", type=float, default=0, help="bit flips probability on the link")
+    parser.add_argument("--crc", choices=["crc16", "crc32", "none"], default="crc16")
+    parser.add_argument("--bytes-per-second", type=int, default=0, help="tx pacing of the file chunks")
+    parser.add_argument("--compression", choices=["deflate", "none"], default="deflate")
+    parser.add_argument("--content", choices=["random", "workout"], default="random", help="content of the file sent")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="transfer with AsyncRSMaster")
+    parser.add_argument("--count", type=int, default=200, help="command round trips")
+    parser.add_argument("--log-rate", type=float, default=0, help="device log messages per second during rtt")
+    parser.add_argument("--frames", type=int, default=20000, help="log frames decoded by the rx benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="rsctl launches timed by the startup benchmark")
+    parser.add_argument("--capture", help="rx benchmark on the traffic of a serial capture file instead")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s", datefmt="%b %d %H:%M:%S")
+    if args.benchmark in ("transfer", "all"):
+        bench_file_transfer(args.windows, args.size, args.baudrate, args.latency, args.bytes_per_second,
+                            args.chunk_size, args.protocol, args.bit_error_rate, args.crc, args.use_async,
+                            args.transport, args.compression, args.content)
+    if args.benchmark in ("rtt", "all"):
+        bench_command_rtt(args.count, args.baudrate, args.latency, args.log_rate, args.transport)
+    if args.benchmark in ("rx", "all"):
+        if args.capture:
+            sc.bench_decode(args.capture, crc=args.crc)
+        else:
+            bench_rx_decode(args.frames, args.baudrate)
+    if args.benchmark in ("codec", "all"):
+        bench_codec()
+    if args.benchmark in ("pool", "all"):
+        bench_pool(args.devices, args.size, args.baudrate, args.latency, args.chunk_size, max(args.windows))
+    if args.benchmark in ("startup", "all"):
+        bench_startup(args.runs)
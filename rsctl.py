@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Headless one-shot control of a React Sync, for scripts and cron: connects as soon as
+the serial port opens, runs the operations given in order over that one connection,
+prints the outcome as one JSON document and exits
+
+usage: python rsctl.py [--port PORT] [--wait SECONDS] [--force] [--keep] [--wipe] [-v] OPERATION [ARGS] ...
+operations: list [workouts|sessions]   files of the device
+            put FILE...                send the files, unless unchanged on the device (--force)
+            del NAME...                delete device files
+            sync DIR                   send the new or changed .wkt/.ses files of the directory,
+                                       delete the files formerly sent no longer in it (unless
+                                       --keep), the device files of other hosts too (--wipe)
+e.g. python rsctl.py put monday.wkt tuesday.wkt del old.wkt list
+
+exit codes: 0 every operation succeeded, 1 an operation failed, 2 invalid usage,
+3 no React Sync connected
+
+The modules of the link are imported once the command line is checked: usage errors
+and --help do not pay their import time.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+# reference of the timings reported
+STARTED = time.perf_counter()
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_NOT_CONNECTED = 3
+
+# operation -> (min arguments, max arguments or None for no limit)
+OPERATIONS = {"list": (0, 1), "put": (1, None), "del": (1, None), "sync": (1, 1)}
+LIST_KINDS = ("workouts", "sessions")
+# delay between two connection attempts of a given port not opened yet
+PORT_RETRY_PERIOD = 0.05
+
+
+def parse_operations(words):
+    """split the command line words into operations, each keyword starting a new one
+
+    Returns:
+        list: (operation, [arguments]) in order
+
+    Raises:
+        ValueError: invalid sequence of operations
+    """
+    operations = []
+    for word in words:
+        if word in OPERATIONS:
+            operations.append((word, []))
+        elif not operations:
+            raise ValueError("unknown operation: %s" % word)
+        else:
+            operations[-1][1].append(word)
+    for operation, arguments in operations:
+        minimum, maximum = OPERATIONS[operation]
+        if len(arguments) < minimum or (maximum is not None and len(arguments) > maximum):
+            raise ValueError("invalid arguments of %s: %s" % (operation, " ".join(arguments) or "none"))
+        if operation == "list" and arguments and arguments[0] not in LIST_KINDS:
+            raise ValueError("list workouts or list sessions, not: %s" % arguments[0])
+    return operations
+
+
+def elapsed():
+    return round(time.perf_counter() - STARTED, 4)
+
+
+def connect(rsm, config, port, wait):
+    """connect the master, as soon as the port opens when waiting for it
+
+    Args:
+        port (str): serial port, the first React Sync found if None
+        wait (float): max seconds waiting for the device to be plugged
+
+    Returns:
+        str: port connected, None if no React Sync connected
+    """
+    import serial
+    import rsmaster as rs
+    deadline = time.monotonic() + wait
+    if port is not None:
+        failures = 0
+        while True:
+            try:
+                if rsm.connect(port):
+                    return port
+            except (serial.SerialException, OSError) as exception:
+                rsm.uart_driver.serial_port.port = None
+                if not failures:
+                    logging.info("React Sync %s not opened: %s", port, exception)
+                failures += 1
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(PORT_RETRY_PERIOD)
+    ports = rs.find_ports()
+    if ports:
+        try:
+            if rsm.connect(ports[0]):
+                return ports[0]
+        except (serial.SerialException, OSError) as exception:
+            logging.info("React Sync %s connection failed: %s", ports[0], exception)
+            rsm.uart_driver.serial_port.port = None
+    if wait <= 0:
+        return None
+    # plugged later: the supervisor connects as soon as the port shows up
+    import threading
+    import connection_supervisor as cs
+    connected = []
+    event = threading.Event()
+    supervisor = cs.ConnectionSupervisor(
+        rsm,
+        on_connected=lambda port: (connected.append(port), event.set()),
+        backoff_min=config.connection_backoff_min,
+        backoff_max=config.connection_backoff_max,
+        poll_period=config.connection_poll_period,
+        daemon=True,
+    )
+    supervisor.start()
+    event.wait(max(0, deadline - time.monotonic()))
+    supervisor.stop()
+    return connected[0] if connected else None
+
+
+def run_operation(rsm, device_sync, operation, arguments, force, keep, wipe):
+    """
+    Returns:
+        list: result dicts of the operation, one per file for put and del
+    """
+    if operation == "list":
+        result = {"op": "list", "ok": True}
+        for kind in arguments or LIST_KINDS:
+            result[kind] = rsm.send_list_workout() if kind == "workouts" else rsm.send_list_sessions()
+        return [result]
+    if operation == "put":
+        results = []
+        for file_path in arguments:
+            transfers = []
+            try:
+                sent = device_sync.push_file(file_path, force=force, progress=transfers.append)
+                result = {"op": "put", "file": file_path, "ok": True, "sent": sent}
+                if transfers:
+                    transfer = transfers[-1]
+                    result.update({"bytes": transfer.file_bytes, "seconds": round(transfer.elapsed, 3),
+                                   "retries": transfer.retries})
+            except Exception as exception:
+                result = {"op": "put", "file": file_path, "ok": False, "error": str(exception)}
+            results.append(result)
+        return results
+    if operation == "del":
+        return [{"op": "del", "name": name, "ok": bool(device_sync.delete_file(name))} for name in arguments]
+    result = device_sync.sync(arguments[0], delete=not keep, delete_unknown=wipe)
+    return [{"op": "sync", "dir": arguments[0], "ok": not result.failed, "uploaded": result.uploaded,
+             "deleted": result.deleted, "unchanged": result.unchanged,
+             "failed": {name: str(error) for name, error in result.failed.items()}}]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="run operations on a React Sync over one connection, JSON result on stdout",
+        epilog="operations: list [workouts|sessions] | put FILE... | del NAME... | sync DIR")
+    parser.add_argument("operations", nargs="+", metavar="OPERATION", help="operations and their arguments")
+    parser.add_argument("--port", help="serial port, the first React Sync found if not given")
+    parser.add_argument("--wait", type=float, default=0, help="max seconds waiting for the React Sync to be plugged")
+    parser.add_argument("--force", action="store_true", help="put: send the files unchanged on the device too")
+    parser.add_argument("--keep", action="store_true", help="sync: keep the files sent formerly not in the directory")
+    parser.add_argument("--wipe", action="store_true",
+                        help="sync: delete the device files not in the directory sent by other hosts too")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log to stderr too")
+    args = parser.parse_intermixed_args()
+    try:
+        operations = parse_operations(args.operations)
+    except ValueError as exception:
+        parser.error(str(exception))
+
+    import logging.handlers
+    import reactstepmonitor_config as rc
+    import rsmaster as rs
+    import uart_driver as ud
+    import device_log as dl
+    import device_sync as ds
+    config = rc.ReactStepMonitorConfig()
+    handlers = [logging.handlers.RotatingFileHandler(
+        config.log_file, maxBytes=config.log_max_bytes, backupCount=config.log_backup_count)]
+    if args.verbose:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    logging.basicConfig(
+        level=logging.INFO if config.logging_level == "info" else logging.DEBUG,
+        format="%(asctime)s %(message)s",
+        datefmt="%b %d %H:%M:%S",
+        handlers=handlers,
+    )
+    rsm = rs.RSMaster(
+        ud.UartDriver(
+            rx_timeout=config.uart_rx_timeout,
+            tx_bytes_per_second=config.uart_tx_bytes_per_second,
+            tx_frames_per_second=config.uart_tx_frames_per_second,
+            capture_dir=config.uart_capture_dir,
+        ),
+        window_size=config.transfer_window_size,
+        chunk_size=config.transfer_chunk_size,
+        crc=config.uart_crc,
+        checkpoint_dir=config.transfer_checkpoint_dir,
+        compression=config.transfer_compression,
+        rx_channels=config.rx_channels,
+        spill_dir=config.rx_spill_dir,
+    )
+    device_log = dl.config_device_log(config)
+    device_log.start()
+    rsm.device_log = device_log
+    rsm.log = config.device_log_echo
+    rsm.device_log_level = config.device_log_level
+    rsm.device_log_rate = config.device_log_rate
+    rsm.mute_device_logs = config.device_log_mute_transfers
+    timings = {"startup": elapsed()}
+    output = {"ok": False, "port": None, "operations": [], "timings": timings}
+    code = EXIT_NOT_CONNECTED
+    try:
+        port = connect(rsm, config, args.port, args.wait)
+        timings["connected"] = elapsed()
+        if port is None:
+            output["error"] = "no React Sync connected"
+            return output, code
+        output["port"] = port
+        device_sync = ds.DeviceSync(rsm, config.sync_manifest_dir)
+        for operation, arguments in operations:
+            if not rsm.is_connected():
+                output["operations"].append({"op": operation, "ok": False, "error": "React Sync link lost"})
+                continue
+            try:
+                output["operations"].extend(run_operation(rsm, device_sync, operation, arguments,
+                                                          args.force, args.keep, args.wipe))
+            except Exception as exception:
+                logging.info("%s failed: %s", operation, exception)
+                output["operations"].append({"op": operation, "ok": False, "error": str(exception)})
+        output["ok"] = all(result["ok"] for result in output["operations"])
+        code = EXIT_OK if output["ok"] else EXIT_FAILED
+        return output, code
+    finally:
+        rsm.disconnect()
+        rsm.uart_driver.stop_capture()
+        device_log.stop()
+        timings["total"] = elapsed()
+
+
+if __name__ == "__main__":
+    result, exit_code = main()
+    json.dump(result, sys.stdout)
+    sys.stdout.write("\n")
+    sys.exit(exit_code)
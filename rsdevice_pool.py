@@ -0,0 +1,287 @@
+"""
+Pool of React Sync devices driven from one process: one RSMaster per plugged dongle,
+each with its own uart driver and thread, and fan-out operations run on all the
+devices in parallel
+
+usage: python rsdevice_pool.py status | list | put <file> | del <file> | sync <dir> [--ports PORT ...]
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import re
+import threading
+import time
+import rsmaster as rs
+import uart_driver as ud
+
+
+def port_name(port):
+    """file system friendly name of a serial port: /dev/ttyACM0 -> ttyACM0"""
+    return re.sub(r"[^\w.-]", "_", os.path.basename(port))
+
+
+def config_master_factory(config, device_log=None):
+    """
+    Args:
+        config (ReactStepMonitorConfig): uart and transfer settings of the masters
+        device_log (DeviceLogWriter): writer storing the log messages of every device
+
+    Returns:
+        callable: builds the RSMaster of a serial port with the configured settings,
+            the transfer checkpoints and captures of each device in its own directory
+    """
+    def factory(port):
+        checkpoint_dir = config.transfer_checkpoint_dir
+        if checkpoint_dir:
+            checkpoint_dir = os.path.join(checkpoint_dir, port_name(port))
+        capture_dir = config.uart_capture_dir
+        if capture_dir:
+            capture_dir = os.path.join(capture_dir, port_name(port))
+        master = rs.RSMaster(
+            ud.UartDriver(
+                rx_timeout=config.uart_rx_timeout,
+                tx_bytes_per_second=config.uart_tx_bytes_per_second,
+                tx_frames_per_second=config.uart_tx_frames_per_second,
+                capture_dir=capture_dir,
+            ),
+            window_size=config.transfer_window_size,
+            chunk_size=config.transfer_chunk_size,
+            crc=config.uart_crc,
+            checkpoint_dir=checkpoint_dir,
+            compression=config.transfer_compression,
+            rx_channels=config.rx_channels,
+            spill_dir=config.rx_spill_dir,
+        )
+        master.device_log = device_log
+        master.log = config.device_log_echo
+        master.device_log_level = config.device_log_level
+        master.device_log_rate = config.device_log_rate
+        master.mute_device_logs = config.device_log_mute_transfers
+        return master
+    return factory
+
+
+class DeviceStatus:
+    """last operation run on a device of the pool"""
+
+    def __init__(self, port):
+        self.port = port
+        self.operation = None
+        self.running = False
+        self.error = None
+        self.started = 0
+        self.duration = 0
+
+    def state(self):
+        if self.operation is None:
+            return "idle"
+        if self.running:
+            return "running"
+        return "error" if self.error is not None else "ok"
+
+
+class DevicePool:
+    """React Sync devices connected by serial port"""
+
+    def __init__(self, master_factory=None, max_workers=None):
+        """constructor
+
+        Args:
+            master_factory (callable): returns a new RSMaster for a serial port,
+                one with the default settings if None
+            max_workers (int): max devices operated at once, all of them if None
+        """
+        self.master_factory = master_factory or (lambda port: rs.RSMaster())
+        self.max_workers = max_workers
+        self.masters = {}  # port -> RSMaster
+        self.statuses = {}  # port -> DeviceStatus
+        self.lock = threading.Lock()
+
+    def ports(self):
+        with self.lock:
+            return list(self.masters)
+
+    def discover(self, ports=None):
+        """connect the React Sync not in the pool yet, drop the disconnected ones
+
+        Args:
+            ports (list): serial ports to connect, every React Sync plugged if None
+
+        Returns:
+            list: ports added to the pool
+        """
+        for port in self.ports():
+            if not self.masters[port].is_connected():
+                self.remove(port)
+        if ports is None:
+            ports = rs.find_ports()
+        ports = [port for port in ports if port not in self.masters]
+        added = []
+        for port, result in self.__fan_out(ports, "connect", self.__connect).items():
+            if isinstance(result, Exception):
+                logging.info("React Sync %s: connection failed: %s", port, result)
+            elif result is not None:
+                with self.lock:
+                    self.masters[port] = result
+                added.append(port)
+        return added
+
+    def remove(self, port):
+        """disconnect a device and drop it from the pool"""
+        with self.lock:
+            master = self.masters.pop(port, None)
+            self.statuses.pop(port, None)
+        if master is not None:
+            master.disconnect()
+            master.uart_driver.stop_capture()
+
+    def disconnect(self):
+        """disconnect every device of the pool"""
+        for port in self.ports():
+            self.remove(port)
+
+    def run(self, operation, name, ports=None):
+        """run an operation on several devices in parallel
+
+        Args:
+            operation (callable): called with the RSMaster of each device
+            name (str): operation shown in the status table
+            ports (list): devices to operate, all the pool if None
+
+        Returns:
+            dict: port -> result of the operation, or the exception it raised
+        """
+        with self.lock:
+            masters = {port: master for port, master in self.masters.items()
+                       if ports is None or port in ports}
+        return self.__fan_out(list(masters), name, lambda port: operation(masters[port]))
+
+    def send_workout_file(self, file_path, ports=None):
+        return self.run(lambda master: master.send_workout_file(file_path),
+                        "put %s" % os.path.basename(file_path), ports)
+
+    def list_workouts(self, ports=None):
+        return self.run(lambda master: master.send_list_workout(), "list", ports)
+
+    def delete_file(self, filename, ports=None):
+        return self.run(lambda master: master.send_delete_file(filename), "del %s" % filename, ports)
+
+    def status(self):
+        """
+        Returns:
+            list: one dict per device: link settings, last operation and rx counters
+        """
+        rows = []
+        with self.lock:
+            devices = [(port, self.masters[port], self.statuses.get(port)) for port in sorted(self.masters)]
+        for port, master, status in devices:
+            stats = master.link_stats()
+            rows.append({
+                "port": port,
+                "connected": master.is_connected(),
+                "protocol_version": master.protocol_version,
+                "window_size": master.window_size,
+                "chunk_size": master.chunk_size,
+                "crc": master.uart_driver.crc or "none",
+                "operation": status.operation if status else None,
+                "state": status.state() if status else "idle",
+                "duration": (time.monotonic() - status.started if status.running else status.duration)
+                if status else 0,
+                "error": str(status.error) if status and status.error is not None else None,
+                "rx_frames": stats["rx_frames"],
+                "rx_lost": stats["rx_lost"],
+                "rx_crc_errors": stats["rx_crc_errors"],
+            })
+        return rows
+
+    def status_table(self):
+        """per device status as a text table"""
+        lines = ["%-16s %-5s %-28s %-18s %-8s %8s %9s %6s %6s" % (
+            "port", "link", "settings", "operation", "state", "time (s)", "rx frames", "lost", "crc")]
+        for row in self.status():
+            settings = "v%i w%i c%i %s" % (row["protocol_version"], row["window_size"], row["chunk_size"], row["crc"])
+            lines.append("%-16s %-5s %-28s %-18s %-8s %8.2f %9i %6i %6i" % (
+                row["port"], "up" if row["connected"] else "down", settings, (row["operation"] or "-")[:18],
+                row["state"], row["duration"], row["rx_frames"], row["rx_lost"], row["rx_crc_errors"]))
+            if row["error"]:
+                lines.append("    %s" % row["error"])
+        return "\n".join(lines)
+
+    def __connect(self, port):
+        master = self.master_factory(port)
+        if not master.connect(port):
+            return None
+        return master
+
+    def __fan_out(self, ports, name, operation):
+        """call operation(port) for each port, in parallel, and track the devices status"""
+        results = {}
+        if not ports:
+            return results
+        workers = min(len(ports), self.max_workers or len(ports))
+        with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="rsdevice") as executor:
+            futures = {executor.submit(self.__run_one, port, name, operation): port for port in ports}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+        return results
+
+    def __run_one(self, port, name, operation):
+        with self.lock:
+            status = self.statuses.setdefault(port, DeviceStatus(port))
+        status.operation = name
+        status.running = True
+        status.error = None
+        status.started = time.monotonic()
+        try:
+            return operation(port)
+        except Exception as exception:
+            logging.info("React Sync %s: %s failed: %s", port, name, exception)
+            status.error = exception
+            return exception
+        finally:
+            status.duration = time.monotonic() - status.started
+            status.running = False
+
+
+if __name__ == "__main__":
+    import reactstepmonitor_config as rc
+    import device_log as dl
+
+    parser = argparse.ArgumentParser(description="operate every React Sync plugged")
+    parser.add_argument("command", choices=["status", "list", "put", "del", "sync"])
+    parser.add_argument("file", nargs="?", help="file to send (put) or delete (del), directory to synchronize (sync)")
+    parser.add_argument("--ports", nargs="+", help="serial ports to use instead of every React Sync found")
+    parser.add_argument("--workers", type=int, help="max devices operated at once")
+    args = parser.parse_args()
+    if args.command in ("put", "del", "sync") and not args.file:
+        parser.error("%s needs a %s" % (args.command, "directory" if args.command == "sync" else "file"))
+    config = rc.ReactStepMonitorConfig()
+    logging.basicConfig(
+        level=logging.INFO if config.logging_level == "info" else logging.DEBUG,
+        format="%(asctime)s %(threadName)s %(message)s",
+        datefmt="%b %d %H:%M:%S",
+        filename="log.txt",
+    )
+    device_log = dl.config_device_log(config)
+    device_log.start()
+    pool = DevicePool(config_master_factory(config, device_log), args.workers)
+    pool.discover(args.ports)
+    if not pool.ports():
+        print("No React Sync found")
+    else:
+        results = {}
+        if args.command == "list":
+            results = pool.list_workouts()
+        elif args.command == "put":
+            results = pool.send_workout_file(args.file)
+        elif args.command == "del":
+            results = pool.delete_file(args.file)
+        elif args.command == "sync":
+            import device_sync as ds
+            results = ds.sync_pool(pool, args.file, config.sync_manifest_dir)
+        for port, result in sorted(results.items()):
+            print("%s: %s" % (port, result))
+        print(pool.status_table())
+    pool.disconnect()
+    device_log.stop()
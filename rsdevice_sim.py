@@ -0,0 +1,442 @@
+"""
+Simulated React Sync device speaking the serial protocol, used to measure the link
+and reproduce timeouts without the RP2040
+
+The device runs over an in-memory link (SimulatedSerial.pair) or a Linux pseudo-terminal
+(PtySerial.open) whose slave end is opened by the host with pyserial like a real port.
+
+usage: python rsdevice_sim.py [--latency S] [--baudrate B] [--bit-error-rate R] [--log-rate N]
+prints the pseudo-terminal to connect to and runs until interrupted
+"""
+import argparse
+import ctypes
+import fcntl
+import os
+import select
+import struct
+import termios
+import threading
+import logging
+import random
+import time
+import tty
+import zlib
+import serial
+import uart_driver as ud
+import framing as fr
+import rsmaster as rs
+import payload_file as pf
+import payload_ack as pa
+import payload_connect as pc
+import payload_log as pl
+import payload_reply as pr
+
+
+def corrupt(data, bit_error_rate):
+    """copy of data with random bit flips at the given bit error rate"""
+    data = bytearray(data)
+    # distance between two bit errors follows a geometric distribution
+    bit = int(random.expovariate(bit_error_rate))
+    while bit < len(data) * 8:
+        data[bit // 8] ^= 1 << (bit % 8)
+        bit += 1 + int(random.expovariate(bit_error_rate))
+    return data
+
+
+class SimulatedSerial:
+    """one end of an in-memory serial link, with the pyserial api used by UartDriver
+    writes take the time the bytes need on the wire at the given baudrate
+    and get random bit flips at the given bit error rate"""
+
+    def __init__(self, baudrate=115200, port="sim://react-sync", bit_error_rate=0):
+        self.port = port
+        self.baudrate = baudrate
+        self.bit_error_rate = bit_error_rate
+        self.timeout = None
+        self.is_open = False
+        self.peer = None
+        self.__rx = bytearray()
+        self.__condition = threading.Condition()
+
+    @staticmethod
+    def pair(baudrate=115200, bit_error_rate=0):
+        """return the (host, device) ends of a new link, the device end is open"""
+        host = SimulatedSerial(baudrate, bit_error_rate=bit_error_rate)
+        device = SimulatedSerial(baudrate, port="sim://host", bit_error_rate=bit_error_rate)
+        host.peer = device
+        device.peer = host
+        device.is_open = True
+        return host, device
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self.__condition:
+            self.is_open = False
+            self.__condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self.__rx)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        with self.__condition:
+            if not self.__rx:
+                self.__condition.wait_for(lambda: self.__rx or not self.is_open, self.timeout)
+            data = bytes(self.__rx[:size])
+            del self.__rx[:size]
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        if self.baudrate:
+            # 10 bits per byte on the wire: start + 8 data + stop
+            time.sleep(len(data) * 10 / self.baudrate)
+        if self.bit_error_rate:
+            data = corrupt(data, self.bit_error_rate)
+        self.peer.__deliver(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def __deliver(self, data):
+        with self.__condition:
+            self.__rx += data
+            self.__condition.notify_all()
+
+
+class PtySerial:
+    """device end of a Linux pseudo-terminal, with the pyserial api used by UartDriver
+    the bytes of both directions take the time they need on the wire at the given
+    baudrate and get random bit flips at the given bit error rate"""
+
+    def __init__(self, fd, slave_fd, port, baudrate=115200, bit_error_rate=0):
+        self.fd = fd
+        # kept open so that the master end does not fail while the host is not connected
+        self.slave_fd = slave_fd
+        self.port = port
+        self.baudrate = baudrate
+        self.bit_error_rate = bit_error_rate
+        self.timeout = None
+        self.is_open = True
+
+    @staticmethod
+    def open(baudrate=115200, bit_error_rate=0):
+        """return (path of the pseudo-terminal for the host, device end)"""
+        master, slave = os.openpty()
+        tty.setraw(master)
+        path = os.ttyname(slave)
+        return path, PtySerial(master, slave, path, baudrate, bit_error_rate)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            os.close(self.fd)
+            os.close(self.slave_fd)
+
+    @property
+    def in_waiting(self):
+        return struct.unpack("i", fcntl.ioctl(self.fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        readable, _, _ = select.select([self.fd], [], [], self.timeout)
+        if not readable:
+            return b""
+        try:
+            data = os.read(self.fd, size)
+        except OSError:
+            # host end closed
+            return b""
+        if self.baudrate:
+            time.sleep(len(data) * 10 / self.baudrate)
+        if self.bit_error_rate:
+            data = bytes(corrupt(data, self.bit_error_rate))
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        if self.baudrate:
+            time.sleep(len(data) * 10 / self.baudrate)
+        if self.bit_error_rate:
+            data = corrupt(data, self.bit_error_rate)
+        size = len(data)
+        data = memoryview(bytes(data))
+        while data:
+            select.select([], [self.fd], [])
+            data = data[os.write(self.fd, data):]
+        return size
+
+    def flush(self):
+        pass
+
+
+class SimulatedDevice:
+    """React Sync device behaviour: connect handshake, file commands, chunked file
+    reception and log messages"""
+
+    SESSION_EXTENSION = ".ses"
+
+    def __init__(
+        self, serial_port, window_size=16, latency=0.002, protocol_version=2, max_chunk_size=4096,
+        features=pc.FEATURE_CRC16 | pc.FEATURE_CRC32 | pc.FEATURE_RESUME | pc.FEATURE_TAGGED_REPLIES
+        | pc.FEATURE_DEFLATE | pc.FEATURE_LOG_CONTROL | pc.FEATURE_NUMBERED_FRAMES, log_rate=0, files=None,
+        reset_on_connect=True
+    ):
+        """constructor
+
+        Args:
+            serial_port (SimulatedSerial): device end of the link (SimulatedSerial, PtySerial)
+            window_size (int): max chunks in flight the device accepts, 0 for a device
+                not answering the connect capabilities (v1 stop-and-wait only)
+            latency (float): processing time of a file chunk or command in seconds (flash write)
+            protocol_version (int): highest protocol version supported
+            max_chunk_size (int): max file bytes per chunk with protocol v2
+            features (int): optional features supported, payload_connect FEATURE_ bits
+            log_rate (float): log messages sent per second, 0 for none
+            files (dict): files stored on the device, name -> content
+            reset_on_connect (bool): the connect answer uses the v1 framing (payload_connect
+                contract), False: the framing in use (former firmwares)
+        """
+        self.uart_driver = ud.UartDriver(rx_timeout=0.05, serial_port=serial_port)
+        self.window_size = window_size
+        self.protocol_version = protocol_version
+        self.max_chunk_size = max_chunk_size
+        self.features = features
+        self.latency = latency
+        self.log_rate = log_rate
+        self.negotiated_window_size = 1
+        self.tagged_replies = False
+        self.files = dict(files or {})
+        self.reset_on_connect = reset_on_connect
+        self.logs_sent = 0
+        # LOG_CONTROL settings and the messages not sent since the connection
+        self.log_min_level = pl.LogLevel.LOG_LEVEL_DEBUG.value
+        self.log_max_rate = 0
+        self.log_window = (0, 0)  # (second, messages sent in it) of the rate limit
+        self.logs_suppressed = 0
+        self.log_bytes_suppressed = 0
+        self.__chunks = {}
+        self.__next_chunk = {}
+        self.thread = threading.Thread(name="simulated_device", target=self.__worker_task)
+        self.thread.daemon = True
+        self.log_thread = threading.Thread(name="simulated_device_log", target=self.__log_task)
+        self.log_thread.daemon = True
+        self.run = False
+
+    def start(self):
+        self.run = True
+        self.thread.start()
+        if self.log_rate:
+            self.log_thread.start()
+
+    def stop(self):
+        self.run = False
+        for thread in (self.thread, self.log_thread):
+            if thread.is_alive():
+                thread.join()
+
+    def __worker_task(self):
+        while self.run:
+            for rx in self.uart_driver.get_rx_frames():
+                self.__process_rx_frame(rx)
+
+    def __log_task(self):
+        period = 1 / self.log_rate
+        next_log = time.monotonic()
+        while self.run:
+            self.send_log(pl.LogLevel.LOG_LEVEL_INFO, "step %i: sensor 0x%04x ok" % (self.logs_sent, self.logs_sent & 0xFFFF))
+            next_log += period
+            delay = next_log - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    @staticmethod
+    def log_payload(level, message):
+        """LOG frame payload as sent by the firmware: level and zero padded message"""
+        return bytes([level.value]) + message.encode("utf-8")[:pl.LOG_MESSAGE_SIZE].ljust(pl.LOG_MESSAGE_SIZE, b"\0")
+
+    def send_log(self, level, message):
+        """send a LOG frame unless filtered by the LOG_CONTROL level or rate limit"""
+        payload = self.log_payload(level, message)
+        second = int(time.monotonic())
+        sent_in_second = self.log_window[1] if self.log_window[0] == second else 0
+        if level.value < self.log_min_level or (self.log_max_rate and sent_in_second >= self.log_max_rate):
+            self.logs_suppressed += 1
+            # frame flags, header and crc the message would have used
+            self.log_bytes_suppressed += len(payload) + 5 + self.uart_driver.length_size + \
+                (fr.CRC_SIZES[self.uart_driver.crc] if self.uart_driver.crc else 0)
+            return
+        self.log_window = (second, sent_in_second + 1)
+        self.uart_driver.send_tx_buffer(rs.SerialMsgType.LOG.value, payload)
+        self.logs_sent += 1
+
+    def __send_ack(self, ack_type, data=b""):
+        self.uart_driver.send_tx_buffer(rs.SerialMsgType.ACK.value, bytearray([ack_type.value]) + data)
+
+    def __process_rx_frame(self, rx):
+        frame = self.uart_driver.parse_rx_frame(rx)
+        if frame is None:
+            # a reconnecting host sends its connect request with the v1 framing
+            frame = self.uart_driver.parse_rx_frame(rx, legacy=True)
+            if frame is None or frame[1] != rs.SerialMsgType.COMMAND.value \
+                    or frame[2][:1] != bytes([rs.CommandType.CONNECT.value]):
+                return
+        packet_id, msg_type, payload = frame
+        if msg_type == rs.SerialMsgType.COMMAND.value and payload:
+            if payload[0] == rs.CommandType.CONNECT.value:
+                if self.window_size:
+                    self.__connect(payload[1:])
+            elif payload[0] in (rs.CommandType.LIST_WORKOUTS.value, rs.CommandType.LIST_SESSIONS.value):
+                self.__list_files(packet_id, payload[0] == rs.CommandType.LIST_SESSIONS.value)
+            elif payload[0] == rs.CommandType.DELETE_FILE.value:
+                self.__delete_file(packet_id, bytes(payload[1:]).split(b"\0", 1)[0].decode("ascii", "replace"))
+            elif payload[0] == rs.CommandType.LOG_CONTROL.value and self.features & pc.FEATURE_LOG_CONTROL:
+                self.__log_control(packet_id, payload[1:])
+        elif msg_type == rs.SerialMsgType.FILE.value:
+            self.__receive_file_chunk(payload)
+
+    def __connect(self, payload):
+        host = pc.PayloadConnect(payload)
+        self.negotiated_window_size = max(1, min(self.window_size, host.window_size))
+        capabilities = pc.PayloadConnect()
+        capabilities.protocol_version = self.protocol_version
+        capabilities.window_size = self.window_size
+        if self.protocol_version >= 2:
+            capabilities.max_chunk_size = self.max_chunk_size
+        capabilities.features = self.features & host.features
+        self.tagged_replies = bool(capabilities.features & pc.FEATURE_TAGGED_REPLIES)
+        self.logs_suppressed = 0
+        self.log_bytes_suppressed = 0
+        if not capabilities.features & pc.FEATURE_RESUME:
+            # interrupted transfers are restarted from the first chunk
+            self.__chunks.clear()
+            self.__next_chunk.clear()
+        if self.reset_on_connect:
+            # the answer uses the v1 framing the host expects before the negotiation
+            self.uart_driver.protocol_version = 1
+            self.uart_driver.crc = None
+        self.__send_ack(pa.AckType.OK, capabilities.serialize())
+        # answer sent with the former framing, switch to the negotiated one
+        self.uart_driver.protocol_version = min(self.protocol_version, host.protocol_version)
+        if capabilities.features & pc.FEATURE_CRC32:
+            self.uart_driver.crc = "crc32"
+        elif capabilities.features & pc.FEATURE_CRC16:
+            self.uart_driver.crc = "crc16"
+
+    def __send_reply(self, request_id, entries, status=pa.AckType.OK):
+        """tagged answer of a command: one frame per entry, a single empty one without entries"""
+        reply = pr.PayloadReply()
+        reply.request_id = request_id
+        reply.count = len(entries)
+        reply.status = status.value
+        for index, entry in enumerate(entries or [b""]):
+            reply.index = index
+            reply.data = entry
+            self.uart_driver.send_tx_buffer(rs.SerialMsgType.COMMAND.value, reply.serialize())
+
+    def __list_files(self, request_id, sessions):
+        """one COMMAND frame per file name"""
+        time.sleep(self.latency)
+        names = [name.encode("ascii") for name in sorted(self.files)
+                 if name.endswith(self.SESSION_EXTENSION) == sessions]
+        if self.tagged_replies:
+            self.__send_reply(request_id, names)
+            return
+        for name in names:
+            self.uart_driver.send_tx_buffer(rs.SerialMsgType.COMMAND.value, name)
+
+    def __delete_file(self, request_id, name):
+        time.sleep(self.latency)
+        status = pa.AckType.ERROR if self.files.pop(name, None) is None else pa.AckType.OK
+        if self.tagged_replies:
+            self.__send_reply(request_id, [], status)
+        else:
+            self.__send_ack(status)
+
+    def __log_control(self, request_id, payload):
+        control = pl.PayloadLogControl.from_buffer_copy(bytes(payload).ljust(ctypes.sizeof(pl.PayloadLogControl), b"\0"))
+        status = pa.AckType.OK
+        if control.min_level != pl.LOG_LEVEL_KEEP:
+            if control.min_level in pl.LEVEL_NAMES:
+                self.log_min_level = control.min_level
+            else:
+                status = pa.AckType.ERROR
+        if control.max_rate != pl.LOG_RATE_KEEP:
+            self.log_max_rate = control.max_rate
+        stats = pl.PayloadLogStats()
+        stats.min_level = self.log_min_level
+        stats.max_rate = self.log_max_rate
+        stats.suppressed_messages = self.logs_suppressed
+        stats.suppressed_bytes = self.log_bytes_suppressed
+        if self.tagged_replies:
+            self.__send_reply(request_id, [bytes(stats.serialize())], status)
+        else:
+            self.__send_ack(status, stats.serialize())
+
+    def __receive_file_chunk(self, payload):
+        if self.uart_driver.protocol_version >= 2:
+            chunk = pf.PayloadFileV2.from_buffer_copy(payload[:ctypes.sizeof(pf.PayloadFileV2)])
+            data = payload[ctypes.sizeof(pf.PayloadFileV2):][:chunk.chunk_size]
+            chunk_id_size = 4
+        else:
+            chunk = pf.PayloadFile.from_buffer_copy(bytes(payload).ljust(ctypes.sizeof(pf.PayloadFile), b"\0"))
+            data = bytes(chunk.data[:chunk.chunk_size])
+            chunk_id_size = 1
+        name = bytes(chunk.name).rstrip(b"\0").decode("ascii")
+        flags = chunk.flags if self.uart_driver.protocol_version >= 2 else 0
+        time.sleep(self.latency)
+        chunks = self.__chunks.setdefault(name, {})
+        chunks[chunk.chunk_id] = data
+        if self.negotiated_window_size > 1:
+            # chunks skipped were lost on the link (dropped as corrupted): ask for them
+            next_chunk = self.__next_chunk.get(name, 0)
+            for missing in range(next_chunk, chunk.chunk_id):
+                if missing not in chunks:
+                    self.__send_ack(pa.AckType.NACK, missing.to_bytes(chunk_id_size, byteorder="little"))
+            self.__next_chunk[name] = max(next_chunk, chunk.chunk_id + 1)
+        if self.window_size:
+            # a device answering the connect request numbers its chunk acks
+            self.__send_ack(pa.AckType.OK, (chunk.chunk_id % (1 << 8 * chunk_id_size)).to_bytes(
+                chunk_id_size, byteorder="little"))
+        else:
+            self.__send_ack(pa.AckType.OK)
+        if len(chunks) == chunk.number_of_chunks:
+            content = b"".join(chunks[i] for i in range(chunk.number_of_chunks))
+            if flags & pf.FLAG_DEFLATE:
+                content = zlib.decompressobj(-pf.DEFLATE_WINDOW_BITS).decompress(content)
+            self.files[name] = content
+            del self.__chunks[name]
+            self.__next_chunk.pop(name, None)
+            logging.debug("simulated device: file %s received", name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simulated React Sync on a pseudo-terminal")
+    parser.add_argument("--baudrate", type=int, default=115200, help="link speed, 0 for no limit")
+    parser.add_argument("--latency", type=float, default=0.005, help="processing time per chunk or command (s)")
+    parser.add_argument("--bit-error-rate", type=float, default=0, help="bit flips probability on the link")
+    parser.add_argument("--log-rate", type=float, default=0, help="log messages per second")
+    parser.add_argument("--protocol", type=int, choices=[1, 2], default=2, help="protocol version")
+    parser.add_argument("--window", type=int, default=16, help="max chunks in flight, 0 for a v1 device")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", datefmt="%b %d %H:%M:%S")
+    path, device_port = PtySerial.open(args.baudrate, args.bit_error_rate)
+    device = SimulatedDevice(device_port, window_size=args.window, latency=args.latency,
+                             protocol_version=args.protocol, log_rate=args.log_rate)
+    device.start()
+    print(f"simulated React Sync on {path}", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    device.stop()
+    device_port.close()
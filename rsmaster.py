@@ -3,10 +3,15 @@ Module handling serial communication
 """
 import threading
 import queue
+import concurrent.futures
 import logging
 import time
 import serial
 import os
+import hashlib
+import contextlib
+import mmap
+import zlib
 from enum import Enum
 import sys
 import ctypes
@@ -15,6 +20,13 @@ import uart_driver as ud
 import payload_file as pf
 import payload_log as pl
 import payload_ack as pa
+import payload_connect as pc
+import payload_reply as pr
+import transfer_checkpoint as tc
+import transfer_progress as tp
+import tx_scheduler as ts
+import rx_channel as rxc
+import link_metrics as lm
 
 RS_IDENTIFIER = "RP2040"
 
@@ -27,53 +39,588 @@ class SerialMsgType(Enum):
     EVENT = 4
     ACK = 5
 
+SERIAL_MSG_TYPES = {msg_type.value for msg_type in SerialMsgType}
+
 class CommandType(Enum):
   CONNECT = 0
   LIST_WORKOUTS = 1
   LIST_SESSIONS = 2
   DELETE_FILE = 3
+  LOG_CONTROL = 4
+
+
+def find_ports():
+    """
+    Returns:
+        list: serial ports of every React Sync plugged, in the port listing order
+    """
+    ports = []
+    for port, desc, hw in list_ports.comports():
+        logging.info("description: %s", desc)
+        if desc.find(RS_IDENTIFIER) != -1:
+            ports.append(port)
+    return ports
+
+
+class CommandReply:
+    """entries of a tagged command answer, complete once its count entries are received"""
+
+    def __init__(self):
+        self.entries = {}  # index -> data
+        self.count = None
+        self.status = None
+
+    def add(self, reply):
+        """
+        Args:
+            reply (PayloadReply): answer frame of the command
+
+        Returns:
+            bool: True once the answer is complete
+        """
+        self.count = reply.count
+        self.status = reply.status
+        if reply.index < reply.count:
+            self.entries[reply.index] = reply.data
+        return len(self.entries) >= self.count
+
+    def names(self):
+        """entries decoded as the file names of a listing, in the device order"""
+        return [self.entries[index].split(b"\0", 1)[0].decode("ascii") for index in sorted(self.entries)]
+
+
+class RSMasterBase:
+    """link settings and protocol handling shared by the blocking (RSMaster)
+    and the asyncio (AsyncRSMaster) serial APIs"""
+
+    ACK_TIMEOUT = 3
+    CONNECT_TIMEOUT = 0.5
+    # max silence of the device while answering a tagged command
+    REPLY_TIMEOUT = 2
+    MAX_CHUNK_RETRIES = 3
+    WINDOW_SIZE = 8
+    CHUNK_SIZE = 4096
+    CRC_FEATURES = {"crc16": pc.FEATURE_CRC16, "crc32": pc.FEATURE_CRC32}
+
+    def __init__(
+        self, uart_driver, window_size=WINDOW_SIZE, chunk_size=CHUNK_SIZE, crc="crc16", checkpoint_dir=None,
+        compression="deflate"
+    ):
+        """constructor
+
+        Args:
+            uart_driver (UartDriver): data link of the device
+            window_size (int): max file chunks in flight wished
+            chunk_size (int): file bytes per chunk wished (protocol v2)
+            crc (str): frame integrity trailer wished: "crc16", "crc32" or "none"
+            checkpoint_dir (str): where interrupted transfers are checkpointed to be
+                resumed, None to always restart them from the first chunk
+            compression (str): file compression wished (protocol v2): "deflate" or "none",
+                a file not compressible is sent raw
+        """
+        self.uart_driver: ud.UartDriver = uart_driver
+        # link settings wished by the host, the ones used are negotiated at connection
+        self.requested_window_size = window_size
+        self.requested_chunk_size = min(chunk_size, pf.PayloadFileV2.MAX_CHUNK_SIZE)
+        self.requested_crc = crc
+        self.requested_compression = compression
+        self.checkpoint_dir = checkpoint_dir
+        # files sent compressed (negotiated)
+        self.compression = None
+        # files sent on the current link: bytes of the files, bytes sent (compressed or not), seconds
+        self.tx_files = 0
+        self.tx_file_bytes = 0
+        self.tx_wire_bytes = 0
+        self.tx_file_seconds = 0
+        # the device keeps the chunks of an interrupted transfer
+        self.resume = False
+        # command answers tagged with the packet id of the command (PayloadReply)
+        self.tagged_replies = False
+        # file chunk acks carry the chunk id: the device answered the connect request
+        self.numbered_acks = False
+        # (protocol version, crc) of the former link while connecting again, None otherwise:
+        # a device not reset by the connect request answers with it
+        self.previous_framing = None
+        self.protocol_version = 1
+        self.window_size = 1
+        self.chunk_size = pf.PayloadFile.FILE_CHUNK_SIZE
+        self.log = True
+        # DeviceLogWriter storing the device log messages
+        self.device_log = None
+        # device log level (LogLevel) and max messages per second applied at connection,
+        # None keeps the device setting
+        self.device_log_level = None
+        self.device_log_rate = None
+        # device logs muted down to WARNING during the file transfers
+        self.mute_device_logs = True
+        # the device supports the LOG_CONTROL command (negotiated)
+        self.log_control = False
+        # the device numbers its frames with consecutive packet ids (negotiated):
+        # a repeated packet id is a retransmission, dropped
+        self.numbered_frames = False
+        # last LOG_CONTROL answer (PayloadLogStats) and its time, log bytes/s the device suppresses
+        self.device_log_stats = None
+        self.device_log_stats_time = None
+        self.log_suppressed_rate = 0
+        # packet ids received from the device, to detect lost or duplicated frames
+        self.rx_sequence = ud.SequenceTracker()
+        # latencies of the current link: command answers, file chunk acks
+        self.command_rtt = lm.LatencyHistogram()
+        self.chunk_ack_rtt = lm.LatencyHistogram()
+        self.ack_timeouts = 0
+        self.nacks = 0
+        # connections opened, the ones after the first are reconnections
+        self.connections = 0
+
+    def find_port(self):
+        """set the serial port of the uart driver to the first React Sync found if none is set
+
+        Returns:
+            str: the serial port, None if no React Sync is identified
+        """
+        if not self.uart_driver.serial_port.port:
+            ports = find_ports()
+            if ports:
+                self.uart_driver.serial_port.port = ports[0]
+        if not self.uart_driver.serial_port.port:
+            logging.info("React Sync Not identified")
+            return None
+        return self.uart_driver.serial_port.port
+
+    def connect_request(self):
+        """go back to the v1 framing until the link is negotiated again, the answer of the
+        device accepted in the framing of the former link too (payload_connect contract)
 
+        Returns:
+            bytearray: payload of the connect command with the host capabilities
+        """
+        framing = (self.uart_driver.protocol_version, self.uart_driver.crc)
+        self.previous_framing = framing if framing != (1, None) else None
+        self.protocol_version = 1
+        self.window_size = 1
+        self.chunk_size = pf.PayloadFile.FILE_CHUNK_SIZE
+        self.uart_driver.protocol_version = 1
+        self.uart_driver.crc = None
+        self.resume = False
+        self.tagged_replies = False
+        self.numbered_acks = False
+        self.compression = None
+        self.log_control = False
+        self.numbered_frames = False
+        capabilities = pc.PayloadConnect()
+        capabilities.protocol_version = pc.PROTOCOL_VERSION
+        capabilities.window_size = self.requested_window_size
+        capabilities.max_chunk_size = self.requested_chunk_size
+        capabilities.features = self.CRC_FEATURES.get(self.requested_crc, 0) | pc.FEATURE_TAGGED_REPLIES \
+            | pc.FEATURE_LOG_CONTROL | pc.FEATURE_NUMBERED_FRAMES
+        if self.checkpoint_dir:
+            capabilities.features |= pc.FEATURE_RESUME
+        if self.requested_compression == "deflate":
+            capabilities.features |= pc.FEATURE_DEFLATE
+        return bytearray([CommandType.CONNECT.value]) + capabilities.serialize()
+
+    def negotiate_link(self, ack):
+        """apply the link settings answered to the connect request
+
+        Args:
+            ack (bytes): ack payload of the device, None if it did not answer
+        """
+        self.previous_framing = None
+        if ack is None:
+            logging.info("No capabilities received from React Sync - protocol v1, stop-and-wait transfer")
+            return
+        crc = None
+        if ack[0] == pa.AckType.OK.value and len(ack) > 1:
+            device = pc.PayloadConnect(ack[1:])
+            self.numbered_acks = True
+            self.window_size = max(1, min(self.requested_window_size, device.window_size))
+            if device.protocol_version >= 2 and device.max_chunk_size:
+                self.protocol_version = 2
+                self.chunk_size = min(self.requested_chunk_size, device.max_chunk_size)
+            if device.features & self.CRC_FEATURES.get(self.requested_crc, 0):
+                crc = self.requested_crc
+            self.resume = bool(self.checkpoint_dir) and bool(device.features & pc.FEATURE_RESUME)
+            self.tagged_replies = bool(device.features & pc.FEATURE_TAGGED_REPLIES)
+            self.log_control = bool(device.features & pc.FEATURE_LOG_CONTROL)
+            self.numbered_frames = bool(device.features & pc.FEATURE_NUMBERED_FRAMES)
+            if self.protocol_version >= 2 and self.requested_compression == "deflate" \
+                    and device.features & pc.FEATURE_DEFLATE:
+                self.compression = "deflate"
+        # the device switches to the negotiated framing once its answer is sent
+        self.uart_driver.protocol_version = self.protocol_version
+        self.uart_driver.crc = crc
+        logging.info("React Sync link negotiated: protocol v%i, window size %i, chunk size %i, %s%s%s%s%s",
+                     self.protocol_version, self.window_size, self.chunk_size, crc or "no crc",
+                     ", resumable transfers" if self.resume else "",
+                     ", tagged replies" if self.tagged_replies else "",
+                     ", %s compression" % self.compression if self.compression else "",
+                     ", log control" if self.log_control else "")
+
+    @staticmethod
+    def ack_for_chunk(ack, chunk_id):
+        """
+        Args:
+            ack (bytes): numbered chunk ack: [type][chunk id, little endian], 1 byte with
+                the protocol v1 (low byte of the id), 4 bytes with the v2
+
+        Returns:
+            bool: True if the ack answers the chunk
+        """
+        return int.from_bytes(ack[1:], byteorder="little") == chunk_id % (1 << 8 * (len(ack) - 1))
+
+    def log_control_request(self, level=None, max_rate=None):
+        """
+        Args:
+            level (LogLevel): min level of the messages sent by the device, None keeps it
+            max_rate (int): max messages sent by the device per second, 0 for no limit,
+                None keeps it
+
+        Returns:
+            bytearray: payload of the LOG_CONTROL command, the device answers its settings
+                and suppressed messages counters (a query when both are None)
+        """
+        control = pl.PayloadLogControl()
+        control.min_level = pl.LOG_LEVEL_KEEP if level is None else level.value
+        control.max_rate = pl.LOG_RATE_KEEP if max_rate is None else min(max_rate, pl.LOG_RATE_KEEP - 1)
+        return bytearray([CommandType.LOG_CONTROL.value]) + control.serialize()
+
+    def log_control_answer(self, data):
+        """account the answer of a LOG_CONTROL command: log bytes per second suppressed
+        by the device since the previous answer
+
+        Returns:
+            PayloadLogStats: device log settings and suppressed messages counters
+        """
+        stats = pl.PayloadLogStats(data)
+        now = time.monotonic()
+        previous = self.device_log_stats
+        if previous is not None and now > self.device_log_stats_time \
+                and stats.suppressed_bytes >= previous.suppressed_bytes:
+            self.log_suppressed_rate = (stats.suppressed_bytes - previous.suppressed_bytes) / (
+                now - self.device_log_stats_time)
+        self.device_log_stats = stats
+        self.device_log_stats_time = now
+        return stats
+
+    def transfer_log_level(self):
+        """
+        Returns:
+            LogLevel: device log level to restore after a file transfer muting the logs
+                down to WARNING, None if they are not muted (not wished, not supported,
+                already WARNING or above)
+        """
+        if not self.mute_device_logs or not self.log_control or self.device_log_stats is None:
+            return None
+        if self.device_log_stats.min_level >= pl.LogLevel.LOG_LEVEL_WARNING.value:
+            return None
+        return pl.LogLevel(self.device_log_stats.min_level)
+
+    def log_muted_transfer(self, muted):
+        """log the device messages suppressed while a transfer muted the logs
+
+        Args:
+            muted (PayloadLogStats): answer of the muting command, device_log_stats
+                being the answer of the restoring one
+        """
+        restored = self.device_log_stats
+        logging.info("React Sync logs muted during the transfer: %i messages, %i bytes suppressed (%.0f bytes/s)",
+                     restored.suppressed_messages - muted.suppressed_messages,
+                     restored.suppressed_bytes - muted.suppressed_bytes, self.log_suppressed_rate)
+
+    @staticmethod
+    def compress(data):
+        """
+        Returns:
+            bytes: data as the raw deflate stream of a FLAG_DEFLATE file
+        """
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -pf.DEFLATE_WINDOW_BITS)
+        return compressor.compress(data) + compressor.flush()
+
+    @contextlib.contextmanager
+    def open_file_transfer(self, file_path):
+        """map the file to send, compress it if negotiated and prepare its chunks
+
+        Yields:
+            tuple: (FileChunker, file name, ids of the chunks to send, TransferCheckpoint or None,
+                TransferProgress), the checkpoint is saved if the transfer is interrupted and
+                removed once complete
+        """
+        try:
+            file = open(file_path, 'rb')
+        except FileNotFoundError:
+            logging.info(f"File not found: {file_path}")
+            raise Exception(f"File not found: {file_path}")
+        filename = os.path.basename(file_path)
+        with file:
+            # chunks are read straight from the mapped file, no copy of the content
+            mapping = None
+            if os.fstat(file.fileno()).st_size:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(mapping if mapping is not None else b"")
+            content = data
+            flags = 0
+            if self.compression == "deflate" and len(data):
+                compressed = self.compress(data)
+                if len(compressed) < len(data):
+                    content = memoryview(compressed)
+                    flags = pf.FLAG_DEFLATE
+                else:
+                    logging.info("File %s not compressible, sent raw", filename)
+            filename_bytes = filename.encode('ascii')[:pf.PayloadFile.FILE_NAME_SIZE]
+            chunker = pf.FileChunker(content, filename_bytes, self.chunk_size, self.protocol_version, flags)
+            total_chunks = chunker.total_chunks
+            try:
+                if self.protocol_version < 2 and total_chunks > pf.PayloadFile.MAX_CHUNKS:
+                    error_message = "Error sending file: %s - %i bytes, the device protocol v1 is limited to %i bytes" % (
+                        filename, len(data), pf.PayloadFile.MAX_CHUNKS * pf.PayloadFile.FILE_CHUNK_SIZE)
+                    raise Exception(error_message)
+                chunk_ids = range(total_chunks)
+                checkpoint = None
+                if self.resume and self.checkpoint_dir:
+                    # the chunks acknowledged are the ones of the content sent, compressed or not
+                    checkpoint = tc.TransferCheckpoint(self.checkpoint_dir, filename,
+                                                       hashlib.sha256(content).hexdigest(),
+                                                       total_chunks, self.chunk_size)
+                    if checkpoint.load():
+                        chunk_ids = checkpoint.missing_chunks()
+                        logging.info("Resuming file: %s, %i/%i chunks already acknowledged",
+                                     filename, total_chunks - len(chunk_ids), total_chunks)
+                progress = tp.TransferProgress(
+                    filename, len(data), total_chunks, len(content), total_chunks - len(chunk_ids),
+                    len(content) - sum(chunker.chunk_length(chunk_id) for chunk_id in chunk_ids))
+                start = time.monotonic()
+                try:
+                    yield chunker, filename, chunk_ids, checkpoint, progress
+                except BaseException:
+                    # failed or cancelled
+                    if checkpoint is not None:
+                        checkpoint.save()
+                    raise
+                if checkpoint is not None:
+                    checkpoint.remove()
+                # a resumed transfer only sent the chunks missing
+                sent = len(chunk_ids) / total_chunks if total_chunks else 1
+                self.__file_sent(filename, len(data) * sent, len(content) * sent, time.monotonic() - start)
+            finally:
+                chunker.release()
+                if content is not data:
+                    data.release()
+                if mapping is not None:
+                    mapping.close()
+
+    def __file_sent(self, filename, file_bytes, wire_bytes, seconds):
+        self.tx_files += 1
+        self.tx_file_bytes += file_bytes
+        self.tx_wire_bytes += wire_bytes
+        self.tx_file_seconds += seconds
+        logging.info("File %s: %i bytes sent as %i (compression ratio %.2f) in %.2f s, %.0f bytes/s",
+                     filename, file_bytes, wire_bytes, file_bytes / wire_bytes if wire_bytes else 1,
+                     seconds, file_bytes / seconds if seconds else 0)
+
+    def decode_rx_frame(self, rx):
+        """parse a received frame body, dropping the malformed frames, and the duplicated
+        ones if the device numbers its frames (otherwise a repeated packet id is counted only)
+
+        Returns:
+            tuple: (type, payload), None if the frame is dropped
+        """
+        logging.debug("--- Rx: %s", rx)
+        frame = self.uart_driver.parse_rx_frame(rx)
+        previous_framing = self.previous_framing
+        if frame is None and previous_framing is not None:
+            # connect answer of a device still in the framing of the former link
+            frame = self.uart_driver.parse_rx_frame(rx, framing=previous_framing)
+        if frame is None:
+            logging.debug("Malformed frame dropped: %s", rx.hex("-"))
+            return None
+        packet_id, msg_type, payload = frame
+        if not self.rx_sequence.update(packet_id):
+            if self.numbered_frames:
+                logging.debug("Duplicated frame dropped: %i", packet_id)
+                return None
+            logging.debug("Repeated packet id: %i", packet_id)
+        return msg_type, payload
 
-class RSMaster:
+    def log_device_message(self, payload):
+        """log a LOG frame of the device: stored by the device log writer if set,
+        and sent to the python logging if log is True"""
+        level, message = pl.decode_log(payload)
+        if self.device_log is not None:
+            self.device_log.write(self.uart_driver.serial_port.port, pl.level_name(level), message)
+        if self.log:
+            logging.info("%s: %s", pl.level_name(level).ljust(10), message)
+
+    def reset_link_stats(self):
+        """new link: clear the frames counters, the latencies, the file transfers and the
+        device log counters"""
+        self.connections += 1
+        self.rx_sequence.reset()
+        self.uart_driver.reset_counters()
+        self.command_rtt.reset()
+        self.chunk_ack_rtt.reset()
+        self.ack_timeouts = 0
+        self.nacks = 0
+        self.device_log_stats = None
+        self.device_log_stats_time = None
+        self.log_suppressed_rate = 0
+        self.tx_files = 0
+        self.tx_file_bytes = 0
+        self.tx_wire_bytes = 0
+        self.tx_file_seconds = 0
+
+    def chunk_acked(self, transfer, chunker, chunk_id, rtt, received=None):
+        """account the ack of a file chunk in the transfer progress and the latencies"""
+        transfer.chunk_acked(chunker.chunk_length(chunk_id), rtt, received)
+        if rtt is not None:
+            self.chunk_ack_rtt.record(rtt)
+
+    def link_stats(self):
+        """frames counters, latencies and file transfers of the current link"""
+        stats = {
+            "tx_files": self.tx_files,
+            "tx_file_bytes": self.tx_file_bytes,
+            "tx_wire_bytes": self.tx_wire_bytes,
+            "compression_ratio": self.tx_file_bytes / self.tx_wire_bytes if self.tx_wire_bytes else 1,
+            "tx_file_bytes_per_second": self.tx_file_bytes / self.tx_file_seconds if self.tx_file_seconds else 0,
+            "device_log_suppressed_bytes": self.device_log_stats.suppressed_bytes if self.device_log_stats else 0,
+            "device_log_suppressed_bytes_per_second": self.log_suppressed_rate,
+            "rx_frames": self.rx_sequence.received,
+            "rx_lost": self.rx_sequence.lost,
+            "rx_duplicated": self.rx_sequence.duplicated,
+            "rx_loss_rate": self.rx_sequence.loss_rate(),
+            "rx_crc_errors": self.uart_driver.rx_crc_errors,
+            "rx_malformed": self.uart_driver.rx_malformed,
+            "tx_frames": sum(self.uart_driver.tx_type_frames.values()),
+            "ack_timeouts": self.ack_timeouts,
+            "nacks": self.nacks,
+            "reconnects": max(0, self.connections - 1),
+            "histograms": {"command_rtt": self.command_rtt.snapshot(), "chunk_ack_rtt": self.chunk_ack_rtt.snapshot()},
+        }
+        driver = self.uart_driver
+        for direction, type_frames, type_bytes, link_bytes in (
+                ("rx", driver.rx_type_frames, driver.rx_type_bytes, driver.rx_link_bytes),
+                ("tx", driver.tx_type_frames, driver.tx_type_bytes, driver.tx_link_bytes)):
+            # copies: the counters are updated by the uart threads meanwhile
+            type_frames, type_bytes = dict(type_frames), dict(type_bytes)
+            stats[direction + "_types"] = {
+                SerialMsgType(msg_type).name if msg_type in SERIAL_MSG_TYPES else str(msg_type):
+                    {"frames": frames, "bytes": type_bytes.get(msg_type, 0)}
+                for msg_type, frames in type_frames.items()}
+            stats[direction + "_link_bytes"] = link_bytes
+            # escape bytes added by the stuffing over the frame bytes, the rx bytes include the line noise
+            body_bytes = sum(type_bytes.values())
+            stats[direction + "_stuffing_overhead"] = \
+                max(0, link_bytes - body_bytes - 2 * sum(type_frames.values())) / body_bytes if body_bytes else 0
+        return stats
+
+    def log_link_stats(self):
+        stats = self.link_stats()
+        logging.info("React Sync link stats: %i frames received, %i lost, %i duplicated (loss rate %.2f%%), "
+                     "%i crc errors, %i malformed",
+                     stats["rx_frames"], stats["rx_lost"], stats["rx_duplicated"], stats["rx_loss_rate"] * 100,
+                     stats["rx_crc_errors"], stats["rx_malformed"])
+        if stats["tx_files"]:
+            logging.info("React Sync file transfers: %i files, %i bytes sent as %i (compression ratio %.2f), %.0f bytes/s",
+                         stats["tx_files"], stats["tx_file_bytes"], stats["tx_wire_bytes"],
+                         stats["compression_ratio"], stats["tx_file_bytes_per_second"])
+        if stats["device_log_suppressed_bytes"]:
+            logging.info("React Sync logs suppressed by the device: %i bytes", stats["device_log_suppressed_bytes"])
+        for name, histogram in stats["histograms"].items():
+            if histogram["count"]:
+                logging.info("React Sync %s: %i samples, p50 %.1f ms, p99 %.1f ms, max %.1f ms", name,
+                             histogram["count"], histogram["p50"] * 1000, histogram["p99"] * 1000,
+                             histogram["max"] * 1000)
+        if stats["ack_timeouts"] or stats["nacks"]:
+            logging.info("React Sync chunk acks: %i timeouts, %i nacks", stats["ack_timeouts"], stats["nacks"])
+
+
+class RSMaster(RSMasterBase):
     """Serial API"""
 
     PYTHON_LIB_VERSION = "1.0.0"
     QUEUE_SIZE = 10
-    
+    # rx channel of each reply type: (max payloads in memory, overflow policy)
+    RX_CHANNELS = {
+        # no ack lost (a transfer would wait for it) and the uart thread never waits for
+        # room: the overflow is spilled, the acks nobody reads are discarded by the next request
+        "ack": (QUEUE_SIZE, rxc.OverflowPolicy.SPILL),
+        # file names of a listing, as many as the device holds
+        "command": (QUEUE_SIZE, rxc.OverflowPolicy.SPILL),
+    }
+
     def __init__(
-        self, uart_driver=ud.UartDriver()
+        self, uart_driver=None, window_size=RSMasterBase.WINDOW_SIZE,
+        chunk_size=RSMasterBase.CHUNK_SIZE, crc="crc16", checkpoint_dir=None, compression="deflate",
+        rx_channels=None, spill_dir=None
     ):
-        self.uart_driver: ud.UartDriver = uart_driver
+        """constructor
+
+        Args:
+            uart_driver (UartDriver): data link of the device, a new one if None
+                (each master needs its own driver)
+            window_size (int): max file chunks in flight wished
+            chunk_size (int): file bytes per chunk wished (protocol v2)
+            crc (str): frame integrity trailer wished: "crc16", "crc32" or "none"
+            checkpoint_dir (str): where interrupted transfers are checkpointed to be
+                resumed, None to always restart them from the first chunk
+            compression (str): file compression wished (protocol v2): "deflate" or "none"
+            rx_channels (dict): "ack" / "command" -> (size, OverflowPolicy) replacing the
+                RX_CHANNELS defaults, "ack" applies to the chunk and the command ack channels
+            spill_dir (str): directory of the rx channels spill files, the system temporary one if None
+        """
+        if uart_driver is None:
+            uart_driver = ud.UartDriver()
+        super().__init__(uart_driver, window_size, chunk_size, crc, checkpoint_dir, compression)
+        rx_channels = dict(self.RX_CHANNELS, **(rx_channels or {}))
         self.thread_uart = threading.Thread(
             name="uart_thread", target=self.__worker_task
         )
-        self.rx_command_queue = queue.Queue(self.QUEUE_SIZE)
-        self.tx_fifo = queue.Queue(self.QUEUE_SIZE)
-        self.rx_ack_queue = queue.Queue(self.QUEUE_SIZE)
-        self.log = True
+        size, policy = rx_channels["command"]
+        self.rx_command_queue = rxc.RxChannel("command", size, policy, spill_dir=spill_dir)
+        # single writer of the link: commands go out before the pending file chunks
+        self.tx_scheduler = ts.TxScheduler(self.uart_driver)
+        # acks of the file chunks, room for a full window of chunks in flight
+        size, policy = rx_channels["ack"]
+        self.rx_ack_queue = rxc.RxChannel("ack", size + window_size, policy, spill_dir=spill_dir)
+        # the other acks: connect answer, answers of the untagged commands
+        self.rx_command_ack_queue = rxc.RxChannel("command_ack", size, policy, spill_dir=spill_dir)
+        # one file transfer at a time, and no untagged command during a transfer whose
+        # chunk acks carry no chunk id (their acks could not be told apart)
+        self.transfer_lock = threading.Lock()
+        # one untagged command waiting for its ack at a time
+        self.command_ack_lock = threading.Lock()
+        self.command_ack_waiting = False
+        # called from the uart thread when the link is lost (port closed on error)
+        self.link_lost_callback = None
+        # tagged commands waiting for their answer: packet id -> (CommandReply, Future)
+        self.pending_commands = {}
+        self.pending_lock = threading.Lock()
+        # chunk id -> reception time of its ack, for the transfer round trip times
+        self.ack_received = {}
+        # payload size of the chunk acks while a file transfer runs, None otherwise
+        self.chunk_ack_size = None
+
+    def link_stats(self):
+        """rx frames counters, file transfers, rx channels and tx queues of the current link"""
+        stats = super().link_stats()
+        stats["rx_queues"] = {channel.name: channel.stats()
+                              for channel in (self.rx_ack_queue, self.rx_command_ack_queue, self.rx_command_queue)}
+        stats["tx_queues"] = self.tx_scheduler.metrics()
+        return stats
+
+    def log_link_stats(self):
+        super().log_link_stats()
+        for name, stats in self.link_stats()["rx_queues"].items():
+            if stats["dropped"] or stats["blocked"] or stats["spilled"]:
+                logging.info("React Sync rx channel %s: %i received, max depth %i, %i dropped, "
+                             "%i blocked (%.2f s), %i spilled", name, stats["received"], stats["max_depth"],
+                             stats["dropped"], stats["blocked"], stats["blocked_seconds"], stats["spilled"])
+        self.tx_scheduler.log_metrics()
 
     def get_python_lib_version():
         """return lib version"""
         return RSMaster.PYTHON_LIB_VERSION
 
-    # def __serial_tx(self):
-    #     #  Tx communication
-    #     for node in self.nodes_registry.get_all_nodes():
-    #         while not node.tx_queue.empty():
-    #             packet: lhp.LoraHomePacket = node.tx_queue.get_nowait()
-    #             packet_bytes = packet.serialize()
-    #             logging.debug("--- Tx[lora home packet]: %s", packet_bytes)
-    #             self.uart_driver.send_tx_buffer(
-    #                 SerialMsgType.LORA_HOME.value, packet_bytes
-    #             )
-    #     try:
-    #         packet = self.dongle_system.tx_queue.get_nowait()
-    #         logging.debug("--- Tx[dongle system packet]: %s", packet)
-    #         self.uart_driver.send_tx_buffer(SerialMsgType.SYS.value, packet)
-    #     except queue.Empty:
-    #         # logging.info("queue is empty")
-    #         pass
-
     def add_to_rx_sys_queue(self, packet):
         """add packet to rx sys queue"""
         try:
@@ -83,65 +630,234 @@ class RSMaster:
             self.rx_sys_queue.put_nowait(packet)
     
     def add_to_rx_ack_queue(self, packet):
-        """add packet to rx ack queue"""
-        try:
-            self.rx_ack_queue.put_nowait(packet)
-        except queue.Full:
-            self.rx_ack_queue.get_nowait()
-            self.rx_ack_queue.put_nowait(packet)
+        """route a received ack to its channel, where it stays (overflow policy of the channel)
+        until read or discarded by the next request of its kind: the file chunk acks to the
+        ack channel, the others (connect, untagged commands) to the command ack channel"""
+        if self.is_chunk_ack(packet):
+            self.rx_ack_queue.put(packet)
+        else:
+            self.rx_command_ack_queue.put(packet)
+
+    def numbered_chunk_ack_size(self):
+        """payload size of a chunk ack: status and chunk id (4 bytes in v2 framing, the low
+        byte in v1)"""
+        return 1 + (4 if self.protocol_version >= 2 else 1)
+
+    def is_chunk_ack(self, ack):
+        """
+        Returns:
+            bool: True if the ack answers a file chunk
+        """
+        if self.numbered_acks and len(ack) == self.numbered_chunk_ack_size():
+            return True
+        # bare ack during a transfer: a chunk ack unless an untagged command waits for its answer
+        return self.chunk_ack_size is not None and not self.command_ack_waiting
+
+    @contextlib.contextmanager
+    def untagged_command(self):
+        """wait for the ack of an untagged command, one command at a time, the acks left by
+        a former command discarded; without numbered chunk acks the file transfer in
+        progress is waited for
+
+        Yields:
+            RxChannel: command ack channel
+        """
+        with self.command_ack_lock:
+            with contextlib.nullcontext() if self.numbered_acks else self.transfer_lock:
+                self.rx_command_ack_queue.clear()
+                self.command_ack_waiting = True
+                try:
+                    yield self.rx_command_ack_queue
+                finally:
+                    self.command_ack_waiting = False
 
 
-    def send_workout_file(self, file_path):
+    def send_workout_file(self, file_path, progress=None):
+        """send a file to the device
+
+        Args:
+            progress (callable): called with the TransferProgress of the file once started
+                and after each chunk acknowledged, from the calling thread
+        """
+        # the device log messages would compete with the file chunk acks on the link
+        restore_level = self.transfer_log_level()
+        muted = None
+        if restore_level is not None:
+            muted = self.send_log_control(pl.LogLevel.LOG_LEVEL_WARNING)
         try:
-            with open(file_path, 'rb') as file:
-                binary_data = file.read()
-                total_chunks = (len(binary_data) + pf.PayloadFile.FILE_CHUNK_SIZE - 1) // pf.PayloadFile.FILE_CHUNK_SIZE
-
-                for chunk_id in range(total_chunks):
-                    start_idx = chunk_id * pf.PayloadFile.FILE_CHUNK_SIZE
-                    end_idx = (chunk_id + 1) * pf.PayloadFile.FILE_CHUNK_SIZE
-                    chunk_data = binary_data[start_idx:end_idx]
-
-                    payload = pf.PayloadFile()
-                    payload.chunk_id = chunk_id
-                    payload.number_of_chunks = total_chunks
-                    payload.chunk_size = len(chunk_data)
-                    filename = os.path.basename(file_path)
-                    filename_bytes = filename.encode('ascii')[:pf.PayloadFile.FILE_NAME_SIZE]
-                    payload.name[:len(filename_bytes)] = filename_bytes
-                    payload.data[:len(chunk_data)] = chunk_data
-                    logging.info("Sending file: %s, chunk: %i/%i, chunk_size:%i",
-                                 filename, payload.chunk_id + 1, payload.number_of_chunks,
-                                 len(chunk_data))
-                    self.uart_driver.send_tx_buffer(SerialMsgType.FILE.value, payload.serialize())
-                    # Wait for ack
-                    try:
-                        ack = self.rx_ack_queue.get(timeout=3)
-                        if ack[0] == pa.AckType.ERROR.value:
-                            error_message = "Error sending file: %s, chunk: %i/%i - file error ack received" % (filename, payload.chunk_id, payload.number_of_chunks)
-                            raise Exception(error_message)  # Raise an exception
-                        elif ack[0] == pa.AckType.OK.value:
-                            logging.info("Ack received")
-                        else:
-                            error_message = "Error sending file: %s, chunk: %i/%i - no valid ack received" % (filename, payload.chunk_id, payload.number_of_chunks)
-                            raise Exception(error_message)  # Raise an exception
-                    except queue.Empty:
-                        error_message = "Timeout waiting for ack. " + "Error sending file: %s, chunk: %i/%i" % (filename, payload.chunk_id, payload.number_of_chunks)
-                        raise Exception(error_message)  # Raise an exception
+            with self.open_file_transfer(file_path) as (chunker, filename, chunk_ids, checkpoint, transfer), \
+                    self.transfer_lock:
+                if progress is not None:
+                    progress(transfer)
+                self.ack_received.clear()
+                self.chunk_ack_size = self.numbered_chunk_ack_size() if self.numbered_acks else 1
+                try:
+                    if self.window_size > 1:
+                        self.__send_file_windowed(chunker, filename, chunk_ids, checkpoint, transfer, progress)
+                    else:
+                        self.__send_file_stop_and_wait(chunker, filename, chunk_ids, checkpoint, transfer, progress)
+                finally:
+                    self.chunk_ack_size = None
+                    self.ack_received.clear()
+        finally:
+            if muted is not None and self.is_connected() and self.send_log_control(restore_level) is not None:
+                self.log_muted_transfer(muted)
 
-        except FileNotFoundError:
-            logging.info(f"File not found: {file_path}")
-            raise Exception(f"File not found: {file_path}") 
+    def __send_file_stop_and_wait(self, chunker, filename, chunk_ids, checkpoint, transfer, progress):
+        """send the chunks one by one, waiting for the ack of each chunk
+        a nacked chunk is sent again, and so is a chunk without ack when the frames
+        are crc protected (the device drops the corrupted ones) and the acks carry the
+        chunk id: the bare ack of the first copy arriving late would be taken for the
+        ack of the next chunk"""
+        total_chunks = chunker.total_chunks
+        # acks left by a former command or transfer do not answer these chunks
+        self.rx_ack_queue.clear()
+        for chunk_id in chunk_ids:
+            retries = 0
+            while True:
+                logging.info("Sending file: %s, chunk: %i/%i, chunk_size:%i%s",
+                             filename, chunk_id + 1, total_chunks,
+                             chunker.chunk_length(chunk_id), " (retry %i)" % retries if retries else "")
+                self.tx_scheduler.send(ts.TxPriority.FILE, SerialMsgType.FILE.value, chunker.chunk(chunk_id), paced=True)
+                sent = time.monotonic()
+                ack = self.__wait_chunk_ack(chunk_id, sent + self.ACK_TIMEOUT)
+                if ack is None:
+                    self.ack_timeouts += 1
+                    if self.uart_driver.crc and self.numbered_acks and retries < self.MAX_CHUNK_RETRIES:
+                        retries += 1
+                        transfer.chunk_retried()
+                        continue
+                    error_message = "Timeout waiting for ack. " + "Error sending file: %s, chunk: %i/%i" % (filename, chunk_id, total_chunks)
+                    raise Exception(error_message)  # Raise an exception
+                if ack[0] == pa.AckType.ERROR.value:
+                    error_message = "Error sending file: %s, chunk: %i/%i - file error ack received" % (filename, chunk_id, total_chunks)
+                    raise Exception(error_message)  # Raise an exception
+                elif ack[0] == pa.AckType.OK.value:
+                    logging.info("Ack received")
+                    if checkpoint is not None:
+                        checkpoint.mark_acked(chunk_id)
+                    # the ack of a chunk sent again may answer any of its copies
+                    self.chunk_acked(transfer, chunker, chunk_id, None if retries else time.monotonic() - sent)
+                    if progress is not None:
+                        progress(transfer)
+                    break
+                elif ack[0] == pa.AckType.NACK.value and retries < self.MAX_CHUNK_RETRIES:
+                    logging.info("Nack received for chunk: %i/%i", chunk_id + 1, total_chunks)
+                    self.nacks += 1
+                    retries += 1
+                    transfer.chunk_retried()
+                else:
+                    error_message = "Error sending file: %s, chunk: %i/%i - no valid ack received" % (filename, chunk_id, total_chunks)
+                    raise Exception(error_message)  # Raise an exception
+
+    def __wait_chunk_ack(self, chunk_id, deadline):
+        """ack of the chunk sent stop-and-wait, the numbered acks of other chunks (late
+        acks of a previous copy) are dropped
+
+        Returns:
+            bytes: ack payload, None if none received before the deadline
+        """
+        while True:
+            try:
+                ack = self.rx_ack_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return None
+            if len(ack) == 1:
+                if self.numbered_acks and ack[0] != pa.AckType.ERROR.value:
+                    logging.info("React Sync chunk acks without chunk id, chunks not sent again on timeout")
+                    self.numbered_acks = False
+                return ack
+            if self.ack_for_chunk(ack, chunk_id):
+                return ack
+            logging.debug("Ignoring ack %s, chunk %i in flight", ack.hex("-"), chunk_id)
+
+    def __send_file_windowed(self, chunker, filename, chunk_ids, checkpoint, transfer, progress):
+        """send the chunks with up to window_size chunks in flight
+        acks carry the chunk id, missing (timeout) or nacked chunks are sent again"""
+        total_chunks = chunker.total_chunks
+        in_flight = {}  # chunk_id -> [ack deadline, number of retries]
+        chunk_ids = list(chunk_ids)
+        next_index = 0
+        acked = 0
+        # acks left by a former command or transfer do not answer these chunks
+        self.rx_ack_queue.clear()
+
+        def send_chunk(chunk_id, retries):
+            if retries > self.MAX_CHUNK_RETRIES:
+                error_message = "Error sending file: %s, chunk: %i/%i - too many retries" % (filename, chunk_id, total_chunks)
+                raise Exception(error_message)
+            logging.info("Sending file: %s, chunk: %i/%i, chunk_size:%i%s",
+                         filename, chunk_id + 1, total_chunks, chunker.chunk_length(chunk_id),
+                         " (retry %i)" % retries if retries else "")
+            self.tx_scheduler.send(ts.TxPriority.FILE, SerialMsgType.FILE.value, chunker.chunk(chunk_id), paced=True)
+            in_flight[chunk_id] = [time.monotonic() + self.ACK_TIMEOUT, retries]
+            if retries:
+                transfer.chunk_retried()
+
+        while acked < len(chunk_ids):
+            while next_index < len(chunk_ids) and len(in_flight) < self.window_size:
+                send_chunk(chunk_ids[next_index], 0)
+                next_index += 1
+            deadline = min(deadline for deadline, _ in in_flight.values())
+            try:
+                ack = self.rx_ack_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                # selective retransmit of the chunks whose ack is overdue
+                now = time.monotonic()
+                for chunk_id, (deadline, retries) in sorted(in_flight.items()):
+                    if deadline <= now:
+                        logging.info("Timeout waiting for ack of chunk: %i/%i", chunk_id + 1, total_chunks)
+                        self.ack_timeouts += 1
+                        send_chunk(chunk_id, retries + 1)
+                continue
+            # ack without chunk id from a peer not honoring the window: oldest chunk in flight
+            chunk_id = int.from_bytes(ack[1:], byteorder="little") if len(ack) > 1 else min(in_flight)
+            if chunk_id not in in_flight:
+                logging.debug("Ignoring ack of chunk %i, not in flight", chunk_id)
+            elif ack[0] == pa.AckType.OK.value:
+                deadline, retries = in_flight.pop(chunk_id)
+                acked += 1
+                if checkpoint is not None:
+                    checkpoint.mark_acked(chunk_id)
+                # sent at the ack deadline minus the ack timeout, the ack may have been
+                # received while the next chunks of the window were sent
+                received = self.ack_received.pop(chunk_id, time.monotonic())
+                self.chunk_acked(transfer, chunker, chunk_id,
+                                 None if retries else received - deadline + self.ACK_TIMEOUT, received)
+                if progress is not None:
+                    progress(transfer)
+            elif ack[0] == pa.AckType.NACK.value:
+                logging.info("Nack received for chunk: %i/%i", chunk_id + 1, total_chunks)
+                self.nacks += 1
+                send_chunk(chunk_id, in_flight[chunk_id][1] + 1)
+            else:
+                error_message = "Error sending file: %s, chunk: %i/%i - file error ack received" % (filename, chunk_id, total_chunks)
+                raise Exception(error_message)
+        logging.info("File sent: %s, %i chunks", filename, total_chunks)
 
-    
     def send_list_workout(self):
-        self.uart_driver.send_tx_buffer(SerialMsgType.COMMAND.value, bytearray([CommandType.LIST_WORKOUTS.value]))
+        return self.__send_list(CommandType.LIST_WORKOUTS)
+
+    def send_list_sessions(self):
+        return self.__send_list(CommandType.LIST_SESSIONS)
+
+    def __send_list(self, command_type):
+        command = bytearray([command_type.value])
+        if self.tagged_replies:
+            return self.__send_command(command).names()
+        # names left by a previous listing
+        self.rx_command_queue.clear()
+        self.tx_scheduler.send(ts.TxPriority.COMMAND, SerialMsgType.COMMAND.value, command)
+        sent = time.monotonic()
 
         received_data = []
         try:
             to = 1
             while True:
                 file = self.rx_command_queue.get(timeout=to)
+                if not received_data:
+                    # untagged listing: round trip of the first name
+                    self.command_rtt.record(time.monotonic() - sent)
                 to = 0.2
                 received_data.append(file)
         except queue.Empty:
@@ -153,62 +869,193 @@ class RSMaster:
                 return []  # Return an empty list if no files are received
     
     def send_connect_request(self):
-        self.uart_driver.send_tx_buffer(SerialMsgType.COMMAND.value, bytearray([CommandType.CONNECT.value]))
+        """send the connect request with the host capabilities and negotiate the link
+        with the device answer, a device not answering keeps the v1 stop-and-wait transfer"""
+        request = self.connect_request()
+        with self.untagged_command() as acks:
+            self.tx_scheduler.send(ts.TxPriority.CONTROL, SerialMsgType.COMMAND.value, request)
+            try:
+                ack = acks.get(timeout=self.CONNECT_TIMEOUT)
+            except queue.Empty:
+                ack = None
+            self.negotiate_link(ack)
 
     def send_delete_file(self, filename):
+        """
+        Returns:
+            bool: True if the device deleted the file
+        """
         # Convert the filename string to bytes using ASCII encoding
         filename_bytes = filename.encode('ascii')
         filename_bytes += b'\0'
         # Create a bytearray with the CommandType and the filename bytes
         command = bytearray([CommandType.DELETE_FILE.value]) + filename_bytes
-        self.uart_driver.send_tx_buffer(SerialMsgType.COMMAND.value, command)
-        # Wait for ack
+        if self.tagged_replies:
+            ack = bytes([self.__send_command(command).status])
+        else:
+            with self.untagged_command() as acks:
+                self.tx_scheduler.send(ts.TxPriority.COMMAND, SerialMsgType.COMMAND.value, command)
+                sent = time.monotonic()
+                # Wait for ack
+                try:
+                    ack = acks.get(timeout=2)
+                    self.command_rtt.record(time.monotonic() - sent)
+                except queue.Empty:
+                    ack = None
+        if ack is not None and ack[0] == pa.AckType.OK.value:
+            logging.info("File: %s deleted", filename)
+            return True
+        logging.info("Error deleting file: %s", filename)
+        return False
+
+    def send_log_control(self, level=None, max_rate=None):
+        """set the min level and the max rate of the device log messages
+
+        Args:
+            level (LogLevel): min level of the messages sent by the device, None keeps it
+            max_rate (int): max messages per second, 0 for no limit, None keeps it
+
+        Returns:
+            PayloadLogStats: device log settings and suppressed messages counters,
+                None if the device does not support it or did not answer
+        """
+        if not self.log_control:
+            logging.info("React Sync log control not supported")
+            return None
+        command = self.log_control_request(level, max_rate)
         try:
-            ack = self.rx_ack_queue.get(timeout=2)
-            if ack[0] == pa.AckType.ERROR.value:
-                print("Error deleting file: %s" % filename)
-            elif ack[0] == pa.AckType.OK.value:
-                print("File: %s deleted" % filename)
+            if self.tagged_replies:
+                reply = self.__send_command(command)
+                if reply.status != pa.AckType.OK.value or not reply.entries:
+                    logging.info("React Sync log control refused")
+                    return None
+                return self.log_control_answer(reply.entries[0])
+            with self.untagged_command() as acks:
+                self.tx_scheduler.send(ts.TxPriority.COMMAND, SerialMsgType.COMMAND.value, command)
+                sent = time.monotonic()
+                ack = acks.get(timeout=2)
+                self.command_rtt.record(time.monotonic() - sent)
         except queue.Empty:
-           print("Error deleting file: %s" % filename)
+            logging.info("No answer to the React Sync log control")
+            return None
+        except Exception as exception:
+            logging.info("React Sync log control failed: %s", exception)
+            return None
+        if ack[0] != pa.AckType.OK.value:
+            logging.info("React Sync log control refused")
+            return None
+        return self.log_control_answer(ack[1:])
+
+    def __send_command(self, command):
+        """send a command and wait for its whole tagged answer, several commands
+        can be waiting at once
+
+        Returns:
+            CommandReply: answer of the device
+
+        Raises:
+            Exception: the device stopped answering before the last entry
+        """
+        reply = CommandReply()
+        future = concurrent.futures.Future()
+        # registered before the uart thread can receive the answer: packet id reserved
+        # when queued, the write awaited once the lock is released
+        with self.pending_lock:
+            request = self.tx_scheduler.enqueue(ts.TxPriority.COMMAND, SerialMsgType.COMMAND.value, command)
+            packet_id = request.packet_id
+            self.pending_commands[packet_id] = (reply, future)
+        try:
+            request.future.result()
+            sent = time.monotonic()
+            received = 0
+            while True:
+                try:
+                    future.result(timeout=self.REPLY_TIMEOUT)
+                    # whole answer received
+                    self.command_rtt.record(time.monotonic() - sent)
+                    return reply
+                except concurrent.futures.TimeoutError:
+                    if len(reply.entries) == received:
+                        raise Exception("No answer to command %i (packet %i): %i/%s entries received" % (
+                            command[0], packet_id, received, reply.count if reply.count is not None else "?"))
+                    received = len(reply.entries)
+        finally:
+            with self.pending_lock:
+                self.pending_commands.pop(packet_id, None)
+
+    def __process_reply(self, payload):
+        reply = pr.PayloadReply(payload)
+        with self.pending_lock:
+            pending = self.pending_commands.get(reply.request_id)
+        if pending is None:
+            logging.debug("Ignoring answer to packet %i, no command waiting", reply.request_id)
+            return
+        command_reply, future = pending
+        if command_reply.add(reply) and not future.done():
+            future.set_result(command_reply)
+
+    def __fail_pending_commands(self, exception):
+        """the commands waiting for an answer will not get it"""
+        with self.pending_lock:
+            pending = list(self.pending_commands.values())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(Exception("React Sync link lost: %s" % exception))
 
     def __serial_rx(self):
-        # Rx communication
-        rx = self.uart_driver.get_rx_buffer()
-        if rx is not None:
-            logging.debug("--- Rx: %s", rx)
-        if (rx is not None) and (len(rx) > 5):
-            if rx[3] == SerialMsgType.LOG.value:
-                log = pl.PayloadLog(rx[5:len(rx)-1])
-                if self.log:
-                    message = log.get_text_message()
-                    logging.info("%s: %s", pl.LogLevel(log.level).name.rsplit("_", 1)[-1].ljust(10), message)
-            elif rx[3] == SerialMsgType.COMMAND.value:
-                logging.debug("System message received: %s", rx.hex("-"))
-                self.rx_command_queue.put_nowait(rx[5:-1])
-                # put in system queue
-            elif rx[3] == SerialMsgType.ACK.value:
-                logging.debug("Ack message received: %s", rx[5:].hex("-"))
-                # put in system queue
-                self.add_to_rx_ack_queue(rx[5:])
+        # Rx communication: blocks up to the uart rx timeout when the link is idle
+        for rx in self.uart_driver.get_rx_frames():
+            self.__process_rx_frame(rx)
+
+    def __process_rx_frame(self, rx):
+        frame = self.decode_rx_frame(rx)
+        if frame is None:
+            return
+        msg_type, payload = frame
+        if msg_type == SerialMsgType.LOG.value:
+            self.log_device_message(payload)
+        elif msg_type == SerialMsgType.COMMAND.value:
+            logging.debug("System message received: %s", rx.hex("-"))
+            if self.tagged_replies:
+                self.__process_reply(payload)
+                return
+            self.rx_command_queue.put(payload)
+            # put in system queue
+        elif msg_type == SerialMsgType.ACK.value:
+            logging.debug("Ack message received: %s", payload.hex("-"))
+            # reception times of the chunk acks of the windowed transfer only
+            if self.window_size > 1 and len(payload) == self.chunk_ack_size:
+                self.ack_received[int.from_bytes(payload[1:], byteorder="little")] = time.monotonic()
+            # put in system queue
+            self.add_to_rx_ack_queue(payload)
 
     def __worker_task(self):
         while self.run:
             try:
                 self.__serial_rx()
-                # self.__serial_tx()
             except Exception as exception:
                 logging.info("Communication error - closing serial port")
                 self.run = False
                 self.uart_driver.serial_port.close()
                 self.uart_driver.serial_port.port = None
+                # the writer thread of the lost link, a new one is started on reconnection
+                self.tx_scheduler.stop()
+                self.__fail_pending_commands(exception)
+                if self.link_lost_callback:
+                    self.link_lost_callback()
 
     def start_communication(self):
         """ UART RX / TX communication thread start """
         logging.debug("Start communication")
         # self.thread_uart.daemon = True
         self.run = True
+        if self.thread_uart.ident is not None:
+            # a thread can only be started once: new one after a reconnection
+            self.thread_uart = threading.Thread(
+                name="uart_thread", target=self.__worker_task
+            )
         self.thread_uart.start()
+        self.tx_scheduler.start()
 
     def stop_communication(self):
         """stop polling"""
@@ -216,20 +1063,17 @@ class RSMaster:
         self.run = False
         if self.thread_uart.is_alive():
             self.thread_uart.join()
+        self.tx_scheduler.stop()
         logging.info("React Sync communication stopped")
 
-    def connect(self):
-        """connect"""
-        if not self.uart_driver.serial_port.port:
-            ports = list_ports.comports()
-            for port, desc, hw in ports:
-                logging.info("description: %s", desc)
-                if desc.find(RS_IDENTIFIER) != -1:
-                    self.uart_driver.serial_port.port = port
-        if not self.uart_driver.serial_port.port:
-            logging.info("React Sync Not identified")
+    def connect(self, port=None):
+        """connect to the given serial port, the first React Sync found if None"""
+        if port is not None:
+            self.uart_driver.serial_port.port = port
+        if self.find_port() is None:
             return False
         self.uart_driver.serial_port.open()
+        self.reset_link_stats()
         logging.info(
             "Connected to React Sync: %s",
             self.uart_driver.serial_port.port,
@@ -238,6 +1082,9 @@ class RSMaster:
         self.start_communication()
         logging.info("Sending connect request")
         self.send_connect_request()
+        if self.log_control:
+            # configured settings, a query of the current ones if none
+            self.send_log_control(self.device_log_level, self.device_log_rate)
         return True
 
     def is_connected(self):
@@ -254,3 +1101,10 @@ class RSMaster:
         if self.uart_driver.serial_port.is_open:
             self.stop_communication()
             self.uart_driver.serial_port.close()
+            self.__fail_pending_commands("disconnected")
+            self.log_link_stats()
+        else:
+            # port closed by a link error: the tx scheduler may still run
+            self.tx_scheduler.stop()
+        if self.uart_driver.capture is not None:
+            self.uart_driver.capture.flush()
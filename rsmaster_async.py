@@ -0,0 +1,555 @@
+"""
+Asyncio serial API: the React Sync protocol of rsmaster driven by an event loop,
+without uart thread, blocking queues nor polling
+"""
+import asyncio
+import collections
+import contextlib
+import io
+import logging
+import os
+import time
+import serial
+import rsmaster as rs
+import uart_driver as ud
+import payload_ack as pa
+import payload_log as pl
+import payload_reply as pr
+
+
+class SerialTransport:
+    """non blocking reads and writes of a serial port for an asyncio event loop
+    ports with a file descriptor (pyserial on posix) are watched with loop.add_reader /
+    add_writer, the others (Windows, simulated ports) are served by executor threads"""
+
+    READ_SIZE = 65536
+
+    def __init__(self, serial_port, on_data, on_error):
+        """constructor
+
+        Args:
+            serial_port (serial.Serial): open port, or any object with the pyserial api
+            on_data (callable): called in the loop with the bytes read
+            on_error (callable): called in the loop with the exception closing the transport
+        """
+        self.serial_port = serial_port
+        self.on_data = on_data
+        self.on_error = on_error
+        self.loop = None
+        self.fd = None
+        self.tx_buffer = bytearray()
+        self.tx_ready = asyncio.Event()
+        self.drain_waiters = []
+        self.tasks = []
+        self.closed = False
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self.fd = self.serial_port.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self.fd = None
+        if self.fd is not None:
+            self.loop.add_reader(self.fd, self.__on_readable)
+        else:
+            self.tasks = [
+                self.loop.create_task(self.__read_task()),
+                self.loop.create_task(self.__write_task()),
+            ]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+        for task in self.tasks:
+            task.cancel()
+        self.__wake_drain_waiters(serial.SerialException("serial transport closed"))
+
+    def write(self, data):
+        """queue bytes to write, in order, without blocking"""
+        if self.closed:
+            raise serial.SerialException("serial transport closed")
+        if self.fd is None:
+            self.tx_buffer += data
+            self.tx_ready.set()
+            return
+        if not self.tx_buffer:
+            try:
+                written = os.write(self.fd, data)
+            except BlockingIOError:
+                written = 0
+            except OSError as exception:
+                self.__fail(exception)
+                return
+            data = memoryview(data)[written:]
+            if not data:
+                return
+            self.loop.add_writer(self.fd, self.__on_writable)
+        self.tx_buffer += data
+
+    async def drain(self):
+        """wait until the bytes queued are written to the port"""
+        if self.closed:
+            raise serial.SerialException("serial transport closed")
+        if self.tx_buffer:
+            waiter = self.loop.create_future()
+            self.drain_waiters.append(waiter)
+            await waiter
+
+    def __wake_drain_waiters(self, exception=None):
+        for waiter in self.drain_waiters:
+            if not waiter.done():
+                if exception is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(exception)
+        self.drain_waiters.clear()
+
+    def __fail(self, exception):
+        if not self.closed:
+            self.close()
+            self.on_error(exception)
+
+    def __on_readable(self):
+        try:
+            data = os.read(self.fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as exception:
+            self.__fail(exception)
+            return
+        if not data:
+            self.__fail(serial.SerialException("device disconnected"))
+            return
+        self.on_data(data)
+
+    def __on_writable(self):
+        try:
+            written = os.write(self.fd, self.tx_buffer)
+        except BlockingIOError:
+            return
+        except OSError as exception:
+            self.__fail(exception)
+            return
+        del self.tx_buffer[:written]
+        if not self.tx_buffer:
+            self.loop.remove_writer(self.fd)
+            self.__wake_drain_waiters()
+
+    def __blocking_read(self):
+        # blocks up to the port timeout when the link is idle
+        return self.serial_port.read(self.serial_port.in_waiting or 1)
+
+    async def __read_task(self):
+        try:
+            while True:
+                data = await self.loop.run_in_executor(None, self.__blocking_read)
+                if data:
+                    self.on_data(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exception:
+            self.__fail(exception)
+
+    async def __write_task(self):
+        try:
+            while True:
+                await self.tx_ready.wait()
+                self.tx_ready.clear()
+                while self.tx_buffer:
+                    data = bytes(self.tx_buffer)
+                    self.tx_buffer.clear()
+                    await self.loop.run_in_executor(None, self.serial_port.write, data)
+                self.__wake_drain_waiters()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exception:
+            self.__fail(exception)
+
+
+class PendingRequest:
+    """frame sent to the device waiting for its reply"""
+
+    def __init__(self, packet_id, reply_type, chunk_id=None):
+        self.packet_id = packet_id
+        self.reply_type = reply_type
+        # file chunk acknowledged by the reply
+        self.chunk_id = chunk_id
+        # first reply payload and its reception time
+        self.future = asyncio.get_running_loop().create_future()
+        self.replied = None
+        # every reply payload, for the commands answered by several frames
+        self.replies = asyncio.Queue()
+        # entries of a tagged command answer
+        self.command_reply = rs.CommandReply()
+
+
+class AsyncRSMaster(rs.RSMasterBase):
+    """asyncio Serial API
+
+    The frames sent waiting for a reply are kept by packet id. A device with tagged
+    replies echoes the packet id of the command in its answer. Otherwise it answers in
+    order without echoing the packet id, so a reply goes to the oldest request waiting
+    for its type, except the chunk acks which carry their chunk id once the link is
+    negotiated: the bare acks then answer the commands only.
+    """
+
+    LIST_FIRST_REPLY_TIMEOUT = 1
+    LIST_NEXT_REPLY_TIMEOUT = 0.2
+    DELETE_TIMEOUT = 2
+
+    def __init__(
+        self, uart_driver=None, window_size=rs.RSMasterBase.WINDOW_SIZE,
+        chunk_size=rs.RSMasterBase.CHUNK_SIZE, crc="crc16", checkpoint_dir=None, compression="deflate"
+    ):
+        """constructor
+
+        Args:
+            uart_driver (UartDriver): data link of the device, a new one if None
+            window_size (int): max file chunks in flight wished
+            chunk_size (int): file bytes per chunk wished (protocol v2)
+            crc (str): frame integrity trailer wished: "crc16", "crc32" or "none"
+            checkpoint_dir (str): where interrupted transfers are checkpointed to be
+                resumed, None to always restart them from the first chunk
+            compression (str): file compression wished (protocol v2): "deflate" or "none"
+        """
+        if uart_driver is None:
+            uart_driver = ud.UartDriver()
+        super().__init__(uart_driver, window_size, chunk_size, crc, checkpoint_dir, compression)
+        self.transport = None
+        self.pending = collections.OrderedDict()  # packet id -> PendingRequest
+        self.transfer_lock = asyncio.Lock()
+
+    async def connect(self, port=None):
+        """open the serial port (the first React Sync found if None) and negotiate the link
+
+        Returns:
+            bool: False if no React Sync is identified
+        """
+        if port is not None:
+            self.uart_driver.serial_port.port = port
+        if self.find_port() is None:
+            return False
+        if not self.uart_driver.serial_port.is_open:
+            self.uart_driver.serial_port.open()
+        self.reset_link_stats()
+        self.uart_driver.rx_decoder.reset()
+        logging.info("Connected to React Sync: %s", self.uart_driver.serial_port.port)
+        self.transport = SerialTransport(self.uart_driver.serial_port, self.__on_data, self.__on_error)
+        self.transport.start()
+        logging.info("Sending connect request")
+        request = self.__send_request(rs.SerialMsgType.COMMAND.value, self.connect_request())
+        try:
+            ack = await self.__wait_reply(request, self.CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            ack = None
+        self.negotiate_link(ack)
+        if self.log_control:
+            # configured settings, a query of the current ones if none
+            await self.send_log_control(self.device_log_level, self.device_log_rate)
+        return True
+
+    def is_connected(self):
+        return self.transport is not None and not self.transport.closed
+
+    async def disconnect(self):
+        """disconnect the communication, the requests in progress fail"""
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        self.__fail_pending(serial.SerialException("React Sync disconnected"))
+        if self.uart_driver.serial_port.is_open:
+            self.uart_driver.serial_port.close()
+            self.log_link_stats()
+        if self.uart_driver.capture is not None:
+            self.uart_driver.capture.flush()
+
+    async def send_workout_file(self, file_path, progress=None):
+        """send a file to the device, cancelling the task interrupts the transfer
+        (checkpointed when resumable)
+
+        Args:
+            progress (callable): called with the TransferProgress of the file once started
+                and after each chunk acknowledged
+        """
+        async with self.transfer_lock:
+            # the device log messages would compete with the file chunk acks on the link
+            restore_level = self.transfer_log_level()
+            muted = None
+            if restore_level is not None:
+                muted = await self.send_log_control(pl.LogLevel.LOG_LEVEL_WARNING)
+            try:
+                with self.open_file_transfer(file_path) as (chunker, filename, chunk_ids, checkpoint, transfer):
+                    await self.__send_file_chunks(chunker, filename, chunk_ids, checkpoint, transfer, progress)
+            finally:
+                if muted is not None and self.is_connected() \
+                        and await self.send_log_control(restore_level) is not None:
+                    self.log_muted_transfer(muted)
+
+    async def list_workouts(self):
+        """
+        Returns:
+            list: names of the workout files of the device
+        """
+        if self.tagged_replies:
+            reply = await self.__send_command(bytearray([rs.CommandType.LIST_WORKOUTS.value]))
+            return reply.names()
+        request = self.__send_request(
+            rs.SerialMsgType.COMMAND.value, bytearray([rs.CommandType.LIST_WORKOUTS.value]),
+            reply_type=rs.SerialMsgType.COMMAND.value)
+        received_data = []
+        timeout = self.LIST_FIRST_REPLY_TIMEOUT
+        try:
+            while True:
+                received_data.append(await asyncio.wait_for(request.replies.get(), timeout))
+                timeout = self.LIST_NEXT_REPLY_TIMEOUT
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.__cancel_request(request)
+        if not received_data:
+            return []
+        return b'\r\n'.join(received_data).decode('ascii').split('\r\n')
+
+    async def delete_file(self, filename):
+        """
+        Returns:
+            bool: True if the device deleted the file
+        """
+        command = bytearray([rs.CommandType.DELETE_FILE.value]) + filename.encode('ascii') + b'\0'
+        if self.tagged_replies:
+            reply = await self.__send_command(command)
+            ack = bytes([reply.status])
+        else:
+            # bare chunk acks could not be told apart from the ack of the command:
+            # the transfer in progress is waited for
+            async with contextlib.nullcontext() if self.numbered_acks else self.transfer_lock:
+                request = self.__send_request(rs.SerialMsgType.COMMAND.value, command)
+                sent = time.monotonic()
+                try:
+                    ack = await self.__wait_reply(request, self.DELETE_TIMEOUT)
+                    self.command_rtt.record(time.monotonic() - sent)
+                except asyncio.TimeoutError:
+                    ack = None
+        if ack is not None and ack[0] == pa.AckType.OK.value:
+            logging.info("File: %s deleted", filename)
+            return True
+        logging.info("Error deleting file: %s", filename)
+        return False
+
+    async def send_log_control(self, level=None, max_rate=None):
+        """set the min level and the max rate of the device log messages
+
+        Args:
+            level (LogLevel): min level of the messages sent by the device, None keeps it
+            max_rate (int): max messages per second, 0 for no limit, None keeps it
+
+        Returns:
+            PayloadLogStats: device log settings and suppressed messages counters,
+                None if the device does not support it or did not answer
+        """
+        # the answer carries data: without tagged replies it could not be told from a chunk ack
+        if not self.log_control or not self.tagged_replies:
+            logging.info("React Sync log control not supported")
+            return None
+        try:
+            reply = await self.__send_command(self.log_control_request(level, max_rate))
+        except Exception as exception:
+            logging.info("React Sync log control failed: %s", exception)
+            return None
+        if reply.status != pa.AckType.OK.value or not reply.entries:
+            logging.info("React Sync log control refused")
+            return None
+        return self.log_control_answer(reply.entries[0])
+
+    async def __send_file_chunks(self, chunker, filename, chunk_ids, checkpoint, transfer, progress):
+        """send the chunks with up to window_size chunks in flight, a nacked or timed out
+        chunk is sent again (on timeout only if windowed, or crc protected with numbered
+        acks, as RSMaster)"""
+        total_chunks = chunker.total_chunks
+        chunk_ids = list(chunk_ids)
+        in_flight = {}  # chunk_id -> [request, ack deadline, number of retries]
+        next_index = 0
+        if progress is not None:
+            progress(transfer)
+
+        async def send_chunk(chunk_id, retries):
+            if retries > self.MAX_CHUNK_RETRIES:
+                error_message = "Error sending file: %s, chunk: %i/%i - too many retries" % (filename, chunk_id, total_chunks)
+                raise Exception(error_message)
+            logging.info("Sending file: %s, chunk: %i/%i, chunk_size:%i%s",
+                         filename, chunk_id + 1, total_chunks, chunker.chunk_length(chunk_id),
+                         " (retry %i)" % retries if retries else "")
+            payload = chunker.chunk(chunk_id)
+            wait = self.uart_driver.tx_pacing_delay(len(payload))
+            if wait:
+                await asyncio.sleep(wait)
+            request = self.__send_request(rs.SerialMsgType.FILE.value, payload, chunk_id=chunk_id)
+            in_flight[chunk_id] = [request, None, retries]
+            if retries:
+                transfer.chunk_retried()
+            # the ack timeout starts once the chunk is on the wire
+            await self.transport.drain()
+            in_flight[chunk_id][1] = time.monotonic() + self.ACK_TIMEOUT
+
+        try:
+            while in_flight or next_index < len(chunk_ids):
+                while next_index < len(chunk_ids) and len(in_flight) < self.window_size:
+                    await send_chunk(chunk_ids[next_index], 0)
+                    next_index += 1
+                deadline = min(deadline for _, deadline, _ in in_flight.values())
+                done, _ = await asyncio.wait(
+                    [request.future for request, _, _ in in_flight.values()],
+                    timeout=max(deadline - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    now = time.monotonic()
+                    for chunk_id, (request, deadline, retries) in sorted(in_flight.items()):
+                        if deadline <= now:
+                            self.__cancel_request(request)
+                            self.ack_timeouts += 1
+                            # bare acks: the late ack of the first copy would answer the next chunk
+                            if self.window_size == 1 and not (self.uart_driver.crc and self.numbered_acks):
+                                error_message = "Timeout waiting for ack. " + "Error sending file: %s, chunk: %i/%i" % (filename, chunk_id, total_chunks)
+                                raise Exception(error_message)
+                            logging.info("Timeout waiting for ack of chunk: %i/%i", chunk_id + 1, total_chunks)
+                            await send_chunk(chunk_id, retries + 1)
+                    continue
+                for chunk_id, (request, _, retries) in sorted(in_flight.items()):
+                    if not request.future.done():
+                        continue
+                    ack = request.future.result()
+                    if ack[0] == pa.AckType.OK.value:
+                        _, deadline, _ = in_flight.pop(chunk_id)
+                        if checkpoint is not None:
+                            checkpoint.mark_acked(chunk_id)
+                        # on the wire at the ack deadline minus the ack timeout, the ack may
+                        # have been received while the next chunks of the window were sent
+                        self.chunk_acked(transfer, chunker, chunk_id,
+                                         None if retries or deadline is None
+                                         else request.replied - deadline + self.ACK_TIMEOUT,
+                                         request.replied)
+                        if progress is not None:
+                            progress(transfer)
+                    elif ack[0] == pa.AckType.NACK.value:
+                        logging.info("Nack received for chunk: %i/%i", chunk_id + 1, total_chunks)
+                        self.nacks += 1
+                        await send_chunk(chunk_id, retries + 1)
+                    else:
+                        error_message = "Error sending file: %s, chunk: %i/%i - file error ack received" % (filename, chunk_id, total_chunks)
+                        raise Exception(error_message)
+        finally:
+            for request, _, _ in in_flight.values():
+                self.__cancel_request(request)
+        logging.info("File sent: %s, %i chunks", filename, total_chunks)
+
+    def __send_request(self, msg_type, payload, reply_type=rs.SerialMsgType.ACK.value, chunk_id=None):
+        """write a frame and register the reply it waits for under its packet id"""
+        if not self.is_connected():
+            raise serial.SerialException("React Sync not connected")
+        packet_id, frame = self.uart_driver.encode_tx_frame(msg_type, payload)
+        request = PendingRequest(packet_id, reply_type, chunk_id)
+        self.pending[packet_id] = request
+        self.transport.write(frame)
+        return request
+
+    async def __wait_reply(self, request, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+        finally:
+            self.__cancel_request(request)
+
+    async def __send_command(self, command):
+        """send a command and wait for its whole tagged answer
+
+        Returns:
+            CommandReply: answer of the device
+
+        Raises:
+            Exception: the device stopped answering before the last entry
+        """
+        request = self.__send_request(rs.SerialMsgType.COMMAND.value, command, reply_type=rs.SerialMsgType.COMMAND.value)
+        sent = time.monotonic()
+        try:
+            received = 0
+            while True:
+                try:
+                    reply = await asyncio.wait_for(asyncio.shield(request.future), self.REPLY_TIMEOUT)
+                    # whole answer received
+                    self.command_rtt.record(time.monotonic() - sent)
+                    return reply
+                except asyncio.TimeoutError:
+                    entries = len(request.command_reply.entries)
+                    if entries == received:
+                        raise Exception("No answer to command %i (packet %i): %i/%s entries received" % (
+                            command[0], request.packet_id, received,
+                            request.command_reply.count if request.command_reply.count is not None else "?"))
+                    received = entries
+        finally:
+            self.__cancel_request(request)
+
+    def __cancel_request(self, request):
+        """forget a request: its late reply is no longer expected"""
+        self.pending.pop(request.packet_id, None)
+        request.future.cancel()
+
+    def __fail_pending(self, exception):
+        for request in self.pending.values():
+            if not request.future.done():
+                request.future.set_exception(exception)
+                # retrieved or not, the failure is reported by the waiting coroutine
+                request.future.exception()
+        self.pending.clear()
+
+    def __pending_reply(self, reply_type, payload):
+        """request a reply goes to"""
+        if reply_type == rs.SerialMsgType.COMMAND.value and self.tagged_replies:
+            return self.pending.get(pr.PayloadReply(payload).request_id)
+        if reply_type == rs.SerialMsgType.ACK.value and len(payload) > 1 and self.numbered_acks:
+            # the file chunk acks carry the chunk id, the command acks are bare (the
+            # connect answer is received before the link is negotiated)
+            for request in reversed(self.pending.values()):
+                if request.chunk_id is not None and self.ack_for_chunk(payload, request.chunk_id):
+                    return request
+            logging.debug("Ignoring ack %s, chunk not in flight", payload.hex("-"))
+            return None
+        for request in self.pending.values():
+            # with numbered chunk acks a bare ack answers a command, never a chunk in flight
+            if request.reply_type == reply_type and (request.chunk_id is None or not self.numbered_acks):
+                return request
+        return None
+
+    def __on_data(self, data):
+        for rx in self.uart_driver.feed_rx(data):
+            frame = self.decode_rx_frame(rx)
+            if frame is None:
+                continue
+            msg_type, payload = frame
+            if msg_type == rs.SerialMsgType.LOG.value:
+                self.log_device_message(payload)
+            elif msg_type in (rs.SerialMsgType.ACK.value, rs.SerialMsgType.COMMAND.value):
+                logging.debug("Reply received: %s", payload.hex("-"))
+                request = self.__pending_reply(msg_type, payload)
+                if request is None:
+                    logging.debug("Unexpected reply dropped: %s", payload.hex("-"))
+                elif msg_type == rs.SerialMsgType.COMMAND.value and self.tagged_replies:
+                    if request.command_reply.add(pr.PayloadReply(payload)):
+                        del self.pending[request.packet_id]
+                        if not request.future.done():
+                            request.future.set_result(request.command_reply)
+                elif msg_type == rs.SerialMsgType.COMMAND.value:
+                    request.replies.put_nowait(payload)
+                else:
+                    del self.pending[request.packet_id]
+                    if not request.future.done():
+                        request.replied = time.monotonic()
+                        request.future.set_result(payload)
+
+    def __on_error(self, exception):
+        logging.info("Communication error - closing serial port: %s", exception)
+        self.transport = None
+        self.__fail_pending(exception)
+        self.uart_driver.serial_port.close()
+        self.uart_driver.serial_port.port = None
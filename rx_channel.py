@@ -0,0 +1,170 @@
+"""
+Bounded RX channels between the uart thread and the consumers of the frames received
+
+When a channel is full the uart thread applies the overflow policy of the channel
+instead of raising: it waits for room (block), drops the oldest item (drop-oldest)
+or writes the overflow to a temporary file read back in order (spill). The uart
+thread never stops reading because of a slow or absent consumer, overflows are
+counted.
+"""
+import collections
+import logging
+import queue
+import struct
+import tempfile
+import threading
+import time
+from enum import Enum
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"  # wait for room up to block_timeout, then drop the oldest
+    DROP_OLDEST = "drop-oldest"
+    SPILL = "spill"  # overflow kept in a temporary file
+
+
+class RxChannel:
+    """FIFO of received payloads (bytes), with the get/get_nowait/empty api of queue.Queue"""
+
+    BLOCK_TIMEOUT = 1.0
+    RECORD_LENGTH = struct.Struct("<I")
+
+    def __init__(self, name, maxsize, policy=OverflowPolicy.BLOCK, block_timeout=BLOCK_TIMEOUT, spill_dir=None):
+        """constructor
+
+        Args:
+            name (str): channel name in the logs and stats
+            maxsize (int): max payloads held in memory
+            policy (OverflowPolicy): what put does when the channel is full
+            block_timeout (float): max seconds put waits for room with the block policy,
+                so that an absent consumer does not stall the uart thread
+            spill_dir (str): directory of the spill file, the system temporary one if None
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.spill_file = None
+        self.spill_read = 0  # offset of the next record to read back
+        self.spilled_count = 0  # records in the spill file not read back
+        # counters
+        self.received = 0
+        self.max_depth = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0
+        self.spilled = 0
+
+    def put(self, item):
+        """add a payload, applying the overflow policy when the channel is full"""
+        with self.condition:
+            self.received += 1
+            if self.spilled_count:
+                # the items spilled before go out first
+                self.__spill(item)
+                return
+            if len(self.items) >= self.maxsize:
+                if self.policy == OverflowPolicy.SPILL:
+                    self.__spill(item)
+                    return
+                if self.policy == OverflowPolicy.BLOCK:
+                    self.blocked += 1
+                    start = time.monotonic()
+                    self.condition.wait_for(lambda: len(self.items) < self.maxsize, self.block_timeout)
+                    self.blocked_seconds += time.monotonic() - start
+                if len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+                    logging.info("RX channel %s full (%i), oldest payload dropped", self.name, self.maxsize)
+            self.items.append(item)
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.condition.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """
+        Returns:
+            bytes: oldest payload
+
+        Raises:
+            queue.Empty: none received within the timeout
+        """
+        with self.condition:
+            if block and not self.condition.wait_for(self.__available, timeout):
+                raise queue.Empty
+            if not self.__available():
+                raise queue.Empty
+            if not self.items:
+                self.__unspill()
+            item = self.items.popleft()
+            if self.spilled_count:
+                self.__unspill()
+            self.condition.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        with self.condition:
+            return not self.__available()
+
+    def qsize(self):
+        with self.condition:
+            return len(self.items) + self.spilled_count
+
+    def clear(self):
+        """drop the payloads pending (e.g. stale replies before a new request)"""
+        with self.condition:
+            self.items.clear()
+            self.__close_spill_file()
+            self.condition.notify_all()
+
+    def close(self):
+        self.clear()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "depth": len(self.items) + self.spilled_count,
+                "max_depth": self.max_depth,
+                "received": self.received,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "blocked_seconds": self.blocked_seconds,
+                "spilled": self.spilled,
+            }
+
+    def __available(self):
+        return bool(self.items) or self.spilled_count > 0
+
+    def __spill(self, item):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="rx_%s_" % self.name, dir=self.spill_dir)
+            self.spill_read = 0
+            logging.info("RX channel %s full (%i), spilling to disk", self.name, self.maxsize)
+        self.spill_file.seek(0, 2)
+        self.spill_file.write(self.RECORD_LENGTH.pack(len(item)) + bytes(item))
+        self.spilled_count += 1
+        self.spilled += 1
+        self.condition.notify_all()
+
+    def __unspill(self):
+        """move spilled records back to memory, up to maxsize"""
+        self.spill_file.seek(self.spill_read)
+        while self.spilled_count and len(self.items) < self.maxsize:
+            (length,) = self.RECORD_LENGTH.unpack(self.spill_file.read(self.RECORD_LENGTH.size))
+            self.items.append(self.spill_file.read(length))
+            self.spilled_count -= 1
+        self.spill_read = self.spill_file.tell()
+        if not self.spilled_count:
+            self.__close_spill_file()
+
+    def __close_spill_file(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.spilled_count = 0
+        self.spill_read = 0
@@ -0,0 +1,426 @@
+"""
+Capture of the raw serial traffic of a UartDriver and its replay
+
+A capture file starts with MAGIC and the wall clock time of its start, followed by
+one record per chunk of bytes read from or written to the port: direction,
+nanoseconds since the start (monotonic clock), length, bytes. Records are appended
+through a buffered file by the uart and tx threads; a truncated last record
+(process killed) is ignored when reading.
+
+ReplaySerial feeds the bytes received in a capture back into a UartDriver (RSMaster,
+AsyncRSMaster) at the original speed, scaled, or as fast as possible.
+
+usage: python serial_capture.py info CAPTURE
+       python serial_capture.py replay CAPTURE [--speed 1] [--no-lockstep] [--crc crc16]
+       python serial_capture.py bench CAPTURE [--repeat 5]
+"""
+import argparse
+import collections
+import datetime
+import logging
+import os
+import struct
+import threading
+import time
+import serial
+import framing as fr
+
+MAGIC = b"RSCAP\x00\x01\x00"  # name and format version
+HEADER = struct.Struct("<d")  # epoch seconds of the capture start
+RECORD = struct.Struct("<BQI")  # direction, nanoseconds since the start, length
+RX = 0
+TX = 1
+DIRECTIONS = {RX: "rx", TX: "tx"}
+
+
+class CaptureWriter:
+    """append the chunks of bytes of a serial link to a capture file, cheap enough to be
+    called from the uart thread: one buffered write per chunk, flushed at most every
+    FLUSH_INTERVAL seconds"""
+
+    BUFFER_SIZE = 65536
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        """constructor, creates the file
+
+        Args:
+            path (str): capture file, replaced if it exists
+            flush_interval (float): max seconds a record stays in the write buffer
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_interval_ns = int(flush_interval * 1e9)
+        self.lock = threading.Lock()
+        self.file = open(path, "wb", buffering=self.BUFFER_SIZE)
+        self.start = time.monotonic_ns()
+        self.flushed = self.start
+        self.file.write(MAGIC + HEADER.pack(time.time()))
+        self.records = 0
+        self.bytes = 0
+
+    def record(self, direction, data):
+        """append a chunk, never raises: the capture stops on a write error
+
+        Args:
+            direction (int): RX or TX
+            data (bytes): bytes read from or written to the port
+        """
+        now = time.monotonic_ns()
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.write(RECORD.pack(direction, now - self.start, len(data)))
+                self.file.write(data)
+                if now - self.flushed >= self.flush_interval_ns:
+                    self.file.flush()
+                    self.flushed = now
+            except (OSError, ValueError) as exception:
+                logging.info("Serial capture %s stopped: %s", self.path, exception)
+                self.file = None
+                return
+            self.records += 1
+            self.bytes += len(data)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def capture_path(directory):
+    """new capture file of a directory, named after the current time"""
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(directory, "serial-%s.rscap" % stamp)
+
+
+def read_header(file):
+    """
+    Returns:
+        float: epoch seconds of the capture start
+
+    Raises:
+        Exception: not a capture file
+    """
+    header = file.read(len(MAGIC) + HEADER.size)
+    if len(header) < len(MAGIC) + HEADER.size or header[:len(MAGIC)] != MAGIC:
+        raise Exception("Not a serial capture file: %s" % file.name)
+    return HEADER.unpack_from(header, len(MAGIC))[0]
+
+
+def read_capture(path):
+    """
+    Yields:
+        tuple: (seconds since the capture start, direction, bytes) of each record
+    """
+    with open(path, "rb") as file:
+        read_header(file)
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            direction, nanoseconds, length = RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield nanoseconds / 1e9, direction, data
+
+
+class ReplaySerial:
+    """serial port replaying the bytes received in a capture, with the pyserial api used by
+    UartDriver; the bytes written are compared with the captured ones, then dropped
+
+    The received chunks are released at their captured time divided by speed. In lockstep
+    each chunk also waits (up to lockstep_timeout) for the writes that preceded it in the
+    capture, its delay then counting from them: a master doing the same requests gets its
+    answers in the same order and with the same device latencies, whatever its own speed."""
+
+    LOCKSTEP_TIMEOUT = 1.0
+
+    def __init__(self, path, speed=1.0, lockstep=True, lockstep_timeout=LOCKSTEP_TIMEOUT):
+        """constructor
+
+        Args:
+            path (str): capture file
+            speed (float): replay speed factor, 0 for as fast as possible
+            lockstep (bool): received chunks wait for the captured writes preceding them
+            lockstep_timeout (float): max seconds a chunk waits for the writes, so that a
+                master not doing the captured requests still gets the traffic
+        """
+        self.port = "replay://" + path
+        self.timeout = None
+        self.is_open = False
+        self.speed = speed
+        self.lockstep = lockstep
+        self.lockstep_timeout = lockstep_timeout
+        # rx chunks: (captured tx bytes before, captured time of the last of them, captured time, bytes)
+        self.chunks = collections.deque()
+        self.captured_tx = bytearray()
+        last_tx_time = 0
+        for seconds, direction, data in read_capture(path):
+            if direction == TX:
+                self.captured_tx += data
+                last_tx_time = seconds
+            else:
+                self.chunks.append((len(self.captured_tx), last_tx_time, seconds, data))
+        self.rx_total = sum(len(chunk[3]) for chunk in self.chunks)
+        self.condition = threading.Condition()
+        self.opened = None
+        # (bytes written so far, time) after each write
+        self.writes = collections.deque([(0, None)])
+        self.written = 0
+        # counters
+        self.rx_bytes = 0
+        self.tx_mismatch = None  # offset of the first byte written differing from the capture
+        self.lockstep_timeouts = 0
+        self.finished = threading.Event()
+
+    def open(self):
+        with self.condition:
+            self.is_open = True
+            if self.opened is None:
+                # the replay timeline starts at the first open, reconnections continue it
+                self.opened = time.monotonic()
+                self.writes[0] = (0, self.opened)
+
+    def close(self):
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            if not self.chunks:
+                return 0
+            delay = self.__release_delay()
+            return len(self.chunks[0][3]) if delay is not None and delay <= 0 else 0
+
+    def __write_time(self, tx_bytes):
+        """time of the write reaching tx_bytes bytes written, None if not reached yet"""
+        # chunks are released in order: the writes before tx_bytes are not needed any more
+        while len(self.writes) > 1 and self.writes[1][0] <= tx_bytes:
+            self.writes.popleft()
+        for written, at in self.writes:
+            if written >= tx_bytes:
+                return at
+        return None
+
+    def __release_delay(self):
+        """seconds before the next chunk is released, None while waiting for writes"""
+        tx_before, tx_time, captured, _ = self.chunks[0]
+        now = time.monotonic()
+        if self.lockstep and tx_before:
+            anchor = self.__write_time(tx_before)
+            if anchor is None:
+                # the lockstep timeout counts from when the chunk would have been released
+                due = self.opened + (captured / self.speed if self.speed else 0)
+                if now - due < self.lockstep_timeout:
+                    return None
+                self.lockstep_timeouts += 1
+                # released now, the next chunks of the same writes count from now
+                self.writes.append((tx_before, now))
+                return 0
+            return anchor + ((captured - tx_time) / self.speed if self.speed else 0) - now
+        return self.opened + (captured / self.speed if self.speed else 0) - now
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self.condition:
+            while self.is_open:
+                if self.chunks:
+                    delay = self.__release_delay()
+                    if delay is not None and delay <= 0:
+                        break
+                    if delay is None:
+                        delay = self.lockstep_timeout / 10
+                else:
+                    self.finished.set()
+                    delay = None
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return b""
+                    delay = left if delay is None else min(delay, left)
+                self.condition.wait(delay)
+            else:
+                return b""
+            tx_before, tx_time, captured, data = self.chunks[0]
+            if len(data) > size:
+                self.chunks[0] = (tx_before, tx_time, captured, data[size:])
+                data = data[:size]
+            else:
+                self.chunks.popleft()
+            self.rx_bytes += len(data)
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        with self.condition:
+            if self.tx_mismatch is None:
+                expected = self.captured_tx[self.written:self.written + len(data)]
+                if expected != data:
+                    self.tx_mismatch = self.written + next(
+                        (index for index, (byte, captured) in enumerate(zip(data, expected)) if byte != captured),
+                        len(expected))
+            self.written += len(data)
+            self.writes.append((self.written, time.monotonic()))
+            self.condition.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def capture_info(path):
+    """
+    Returns:
+        dict: start (epoch s), duration (s) and for rx and tx: chunks, bytes and
+            frames per message type byte
+    """
+    with open(path, "rb") as file:
+        start = read_header(file)
+    info = {"start": start, "duration": 0}
+    decoders = {}
+    for direction in DIRECTIONS.values():
+        info[direction] = {"chunks": 0, "bytes": 0, "types": collections.Counter()}
+        decoders[direction] = fr.FrameDecoder()
+    for seconds, direction, data in read_capture(path):
+        entry = info[DIRECTIONS[direction]]
+        entry["chunks"] += 1
+        entry["bytes"] += len(data)
+        for body in decoders[DIRECTIONS[direction]].feed(data):
+            if len(body) > 2:
+                entry["types"][body[2]] += 1
+        info["duration"] = seconds
+    return info
+
+
+def decode_capture(rsm, records):
+    """decode the received chunks of a capture as RSMaster.__serial_rx does, without
+    threads nor timing: the link settings follow the connect requests written and
+    their answers, frames are parsed and the log messages decoded
+
+    Args:
+        rsm (RSMasterBase): master decoding the frames, its uart driver port is not used
+        records (list): (seconds, direction, bytes) of the capture
+
+    Returns:
+        int: frames decoded
+    """
+    import rsmaster as rs  # rsmaster imports uart_driver, which imports this module
+    tx_decoder = fr.FrameDecoder()
+    connecting = False
+    decoded = 0
+    for _, direction, data in records:
+        if direction == TX:
+            for body in tx_decoder.feed(data):
+                # connect requests are sent with the v1 framing without crc
+                if len(body) > 4 and body[2] == rs.SerialMsgType.COMMAND.value \
+                        and body[3] == len(body) - 4 and body[4] == rs.CommandType.CONNECT.value:
+                    rsm.connect_request()
+                    connecting = True
+            continue
+        for rx in rsm.uart_driver.feed_rx(data):
+            frame = rsm.decode_rx_frame(rx)
+            if frame is None:
+                continue
+            decoded += 1
+            msg_type, payload = frame
+            if msg_type == rs.SerialMsgType.LOG.value:
+                rsm.log_device_message(payload)
+            elif msg_type == rs.SerialMsgType.ACK.value and connecting:
+                connecting = False
+                rsm.negotiate_link(payload)
+    return decoded
+
+
+def bench_decode(path, repeat=5, crc="crc16"):
+    """cpu cost of the rx path (framing, parsing, log decoding) on the traffic of a capture"""
+    import rsmaster as rs
+    import uart_driver as ud
+    records = list(read_capture(path))
+    rx_bytes = sum(len(data) for _, direction, data in records if direction == RX)
+    duration = records[-1][0] if records else 0
+    print(f"rx decode cpu of {path}: {rx_bytes} bytes received in {duration:.1f} s")
+    best = None
+    for _ in range(repeat):
+        rsm = rs.RSMaster(ud.UartDriver(), crc=crc)
+        rsm.log = False
+        start = time.process_time()
+        decoded = decode_capture(rsm, records)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    driver = rsm.uart_driver
+    print(f"  {decoded} frames decoded, {driver.rx_crc_errors} crc errors, {driver.rx_malformed} malformed")
+    if decoded and best:
+        print(f"  {best / decoded * 1e6:6.2f} us/frame, {rx_bytes / best / 1e6:5.1f} MB/s"
+              + (f", {best / duration * 100:5.2f}% cpu at the captured rate" if duration else ""))
+
+
+def replay(path, speed=1.0, lockstep=True, crc="crc16"):
+    """replay the traffic of a capture into a RSMaster connected to it, then print
+    the link stats of the master"""
+    import link_metrics as lm
+    import rsmaster as rs
+    import uart_driver as ud
+    port = ReplaySerial(path, speed, lockstep)
+    rsm = rs.RSMaster(ud.UartDriver(serial_port=port), crc=crc)
+    rsm.log = False
+    start = time.monotonic()
+    rsm.connect(port.port)
+    port.finished.wait()
+    # frames of the last chunk processed
+    time.sleep(rsm.uart_driver.serial_port.timeout or 0.1)
+    elapsed = time.monotonic() - start
+    stats = rsm.link_stats()
+    rsm.disconnect()
+    print(f"replayed {port.rx_bytes}/{port.rx_total} bytes in {elapsed:.2f} s, {port.written} bytes written "
+          + (f"differing from the capture at byte {port.tx_mismatch}" if port.tx_mismatch is not None
+             else "as captured") + f", {port.lockstep_timeouts} lockstep timeouts")
+    for line in lm.format_stats(port.port, stats):
+        print(line)
+
+
+def print_info(path):
+    import rsmaster as rs
+    info = capture_info(path)
+    stamp = datetime.datetime.fromtimestamp(info["start"]).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{path}: captured {stamp}, {info['duration']:.3f} s")
+    for direction in DIRECTIONS.values():
+        entry = info[direction]
+        types = ", ".join("%s %i" % (rs.SerialMsgType(msg_type).name if msg_type in rs.SERIAL_MSG_TYPES else str(msg_type), count)
+                          for msg_type, count in sorted(entry["types"].items()))
+        print(f"  {direction}: {entry['chunks']} chunks, {entry['bytes']} bytes, frames: {types or 'none'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="inspect, replay and benchmark a React Sync serial capture")
+    parser.add_argument("command", choices=["info", "replay", "bench"])
+    parser.add_argument("capture", help="capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay: speed factor, 0 for as fast as possible")
+    parser.add_argument("--no-lockstep", dest="lockstep", action="store_false",
+                        help="replay: received bytes at their captured time only, not after the captured writes")
+    parser.add_argument("--crc", choices=["crc16", "crc32", "none"], default="crc16",
+                        help="crc requested by the master, as when captured")
+    parser.add_argument("--repeat", type=int, default=5, help="bench: runs, the fastest is reported")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s", datefmt="%b %d %H:%M:%S")
+    if args.command == "info":
+        print_info(args.capture)
+    elif args.command == "replay":
+        replay(args.capture, args.speed, args.lockstep, args.crc)
+    else:
+        bench_decode(args.capture, args.repeat, args.crc)
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import pytest
+import payload_ack as pa
+import payload_connect as pc
+import rsdevice_sim as sim
+import rsmaster as rs
+import rsmaster_async as rsa
+import uart_driver as ud
+
+
+def run_with_device(coroutine, **device_options):
+    """run coroutine(master, host port, device) against a simulated device"""
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, **device_options)
+    device.start()
+
+    async def run():
+        master = rsa.AsyncRSMaster(ud.UartDriver(serial_port=host), window_size=4, chunk_size=512)
+        master.log = False
+        try:
+            return await coroutine(master, host.port, device)
+        finally:
+            await master.disconnect()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        device.stop()
+
+
+@pytest.mark.parametrize("features", [None, pc.FEATURE_CRC16])
+def test_commands(features):
+    async def commands(master, port, device):
+        assert await master.connect(port)
+        assert master.tagged_replies == (features is None)
+        assert sorted(await master.list_workouts()) == ["a.wkt", "b.wkt"]
+        assert await master.delete_file("a.wkt")
+        assert not await master.delete_file("a.wkt")
+        assert await master.list_workouts() == ["b.wkt"]
+
+    options = {"files": {"a.wkt": b"1", "b.wkt": b"2"}}
+    if features is not None:
+        options["features"] = features
+    run_with_device(commands, **options)
+
+
+def test_concurrent_commands():
+    async def commands(master, port, device):
+        await master.connect(port)
+        listings = await asyncio.gather(*(master.list_workouts() for _ in range(8)))
+        assert listings == [["a.wkt"]] * 8
+
+    run_with_device(commands, files={"a.wkt": b"1"})
+
+
+@pytest.mark.parametrize("window_size", [8, 0])
+def test_untagged_delete_during_a_windowed_transfer(tmp_path, window_size):
+    """the bare ack of the delete does not complete a chunk in flight"""
+    data = os.urandom(30000)
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(data)
+
+    async def transfer_and_delete(master, port, device):
+        await master.connect(port)
+        assert not master.tagged_replies
+        transfer = asyncio.ensure_future(master.send_workout_file(str(file_path)))
+        await asyncio.sleep(0.05)
+        deleted = await master.delete_file("old.wkt")
+        await transfer
+        return deleted
+
+    assert run_with_device(transfer_and_delete, window_size=window_size, latency=0.005,
+                           features=pc.FEATURE_CRC16, files={"old.wkt": b"1"})
+
+
+class NullTransport:
+    closed = False
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_bare_ack_answers_the_command_not_a_chunk_in_flight():
+    """a device answering the delete before the ack of a chunk sent earlier"""
+    async def replies():
+        master = rsa.AsyncRSMaster(ud.UartDriver())
+        master.transport = NullTransport()
+        master.numbered_acks = True
+        send_request = master._AsyncRSMaster__send_request
+        chunk = send_request(rs.SerialMsgType.FILE.value, b"chunk", chunk_id=3)
+        delete = send_request(rs.SerialMsgType.COMMAND.value, b"\x03old.wkt\0")
+        device = ud.UartDriver()
+        for ack in (bytes([pa.AckType.OK.value]), bytes([pa.AckType.OK.value, 3])):
+            _, frame = device.encode_tx_frame(rs.SerialMsgType.ACK.value, ack)
+            master._AsyncRSMaster__on_data(frame)
+            if len(ack) == 1:
+                assert delete.future.done() and not chunk.future.done()
+        assert chunk.future.result() == bytes([pa.AckType.OK.value, 3])
+        assert not master.pending
+
+    asyncio.run(replies())
+
+
+def test_transfer_progress(tmp_path):
+    data = os.urandom(10000)
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(data)
+    updates = []
+
+    async def transfer(master, port, device):
+        await master.connect(port)
+        await master.send_workout_file(str(file_path), progress=lambda progress: updates.append(progress.acked_chunks))
+        return device.files["w.wkt"]
+
+    assert run_with_device(transfer) == data
+    assert updates[0] == 0
+    assert updates == sorted(updates)
+    assert updates[-1] == len(updates) - 1
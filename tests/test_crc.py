@@ -0,0 +1,39 @@
+import pytest
+import framing as fr
+import uart_driver as ud
+
+
+def crc_drivers(crc):
+    sender = ud.UartDriver()
+    receiver = ud.UartDriver()
+    for driver in (sender, receiver):
+        driver.protocol_version = 2
+        driver.crc = crc
+    return sender, receiver
+
+
+@pytest.mark.parametrize("crc, trailer", [("crc16", b"\x29\xb1"), ("crc32", b"\xcb\xf4\x39\x26")])
+def test_crc_trailer_check_values(crc, trailer):
+    assert fr.crc_trailer(crc, b"123456789") == trailer
+    assert len(trailer) == fr.CRC_SIZES[crc]
+
+
+@pytest.mark.parametrize("crc", ["crc16", "crc32"])
+def test_uart_frame_round_trip(crc):
+    sender, receiver = crc_drivers(crc)
+    payload = bytes(range(200))
+    packet_id, frame = sender.encode_tx_frame(3, payload)
+    (body,) = fr.FrameDecoder().feed(frame)
+    assert receiver.parse_rx_frame(body) == (packet_id, 3, payload)
+
+
+@pytest.mark.parametrize("crc", ["crc16", "crc32"])
+def test_uart_frame_corrupted(crc):
+    sender, receiver = crc_drivers(crc)
+    _, frame = sender.encode_tx_frame(3, b"payload")
+    (body,) = fr.FrameDecoder().feed(frame)
+    corrupted = bytearray(body)
+    corrupted[5] ^= 0x01
+    assert receiver.parse_rx_frame(bytes(corrupted)) is None
+    assert receiver.parse_rx_frame(body[:1]) is None
+    assert (receiver.rx_crc_errors, receiver.rx_malformed) == (2, 0)
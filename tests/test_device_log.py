@@ -0,0 +1,75 @@
+import json
+import time
+import device_log as dl
+
+
+def write_batch(writer, records):
+    """write the records through a started writer, flushed when stopped"""
+    writer.start()
+    for record in records:
+        writer.write(*record)
+    writer.stop()
+
+
+def test_records_written_and_queried(tmp_path):
+    writer = dl.DeviceLogWriter(str(tmp_path))
+    write_batch(writer, [
+        ("sim://a", "INFO", "boot", 1000.0),
+        ("sim://b", "WARNING", "battery low", 1001.0),
+        ("sim://a", "ERROR", "flash write failed", 1002.0),
+    ])
+    assert writer.written == 3
+    with open(tmp_path / dl.FILE_NAME, encoding="utf-8") as file:
+        assert json.loads(file.readline()) == {"t": 1000.0, "port": "sim://a", "level": "INFO", "msg": "boot"}
+    messages = lambda **criteria: [record["msg"] for record in dl.query(str(tmp_path), dl.record_filter(**criteria))]
+    assert messages() == ["boot", "battery low", "flash write failed"]
+    assert messages(level="WARNING") == ["battery low", "flash write failed"]
+    assert messages(port="sim://a", pattern="fail") == ["flash write failed"]
+    assert messages(since=1001.0, until=1002.0) == ["battery low"]
+
+
+def test_rotation_by_size_keeps_backup_count_files(tmp_path):
+    writer = dl.DeviceLogWriter(str(tmp_path), max_bytes=200, backup_count=2)
+    for batch in range(5):
+        write_batch(writer, [("sim://a", "INFO", "batch %i message %i" % (batch, i), 1000.0 + batch) for i in range(4)])
+    rotated = dl.rotated_files(str(tmp_path))
+    assert len(rotated) == 2
+    # oldest records deleted with their file, the others in order across the files
+    records = list(dl.query(str(tmp_path), dl.record_filter()))
+    assert [record["t"] for record in records] == [1002.0] * 4 + [1003.0] * 4 + [1004.0] * 4
+
+
+def test_rotation_by_age(tmp_path):
+    writer = dl.DeviceLogWriter(str(tmp_path), max_bytes=0, rotate_seconds=0.05, flush_interval=0.01)
+    writer.start()
+    writer.write("sim://a", "INFO", "first")
+    time.sleep(0.2)
+    writer.write("sim://a", "INFO", "second")
+    writer.stop()
+    assert len(dl.rotated_files(str(tmp_path))) == 1
+    assert [record["msg"] for record in dl.query(str(tmp_path), dl.record_filter())] == ["first", "second"]
+
+
+def test_oldest_records_dropped_when_the_writer_lags(tmp_path):
+    writer = dl.DeviceLogWriter(str(tmp_path), max_pending=3)
+    for i in range(5):
+        writer.write("sim://a", "INFO", str(i), 1000.0 + i)
+    assert writer.dropped == 2
+    writer.stop()
+    assert [record["msg"] for record in dl.query(str(tmp_path), dl.record_filter())] == ["2", "3", "4"]
+
+
+def test_incomplete_last_line_skipped(tmp_path):
+    path = tmp_path / dl.FILE_NAME
+    path.write_text('{"t":1,"port":"p","level":"INFO","msg":"a"}\nnot json\n{"t":2,"port":"p"', encoding="utf-8")
+    records = list(dl.read_records(str(path)))
+    assert [record["msg"] for record, _ in records] == ["a"]
+    # resumed from the position after the last complete record
+    assert list(dl.read_records(str(path), records[-1][1])) == []
+
+
+def test_parse_time():
+    now = time.time()
+    assert abs(dl.parse_time("10m") - (now - 600)) < 5
+    assert abs(dl.parse_time("1.5h") - (now - 5400)) < 5
+    assert dl.parse_time("2026-01-02T03:04:05") == dl.datetime.datetime(2026, 1, 2, 3, 4, 5).timestamp()
@@ -0,0 +1,66 @@
+import device_sync as ds
+import rsdevice_sim as sim
+import rsmaster as rs
+import uart_driver as ud
+
+
+def test_save_and_load(tmp_path):
+    manifest = ds.DeviceManifest(str(tmp_path), "device")
+    manifest.record("a.wkt", 10, "aa")
+    manifest.record("b.ses", 20, "bb")
+    manifest.save()
+    loaded = ds.DeviceManifest(str(tmp_path), "device").load()
+    assert loaded.files == {"a.wkt": (10, "aa"), "b.ses": (20, "bb")}
+    assert loaded.is_stored("a.wkt", 10, "aa")
+    assert not loaded.is_stored("a.wkt", 10, "ab")
+    assert not loaded.is_stored("c.wkt", 10, "aa")
+
+
+def test_missing_or_invalid_manifest_empty(tmp_path):
+    assert ds.DeviceManifest(str(tmp_path), "device").load().files == {}
+    (tmp_path / "device.json").write_text('{"a.wkt": {"size": 1}}')
+    assert ds.DeviceManifest(str(tmp_path), "device").load().files == {}
+
+
+def test_forget(tmp_path):
+    manifest = ds.DeviceManifest(str(tmp_path), "device")
+    manifest.record("a.wkt", 10, "aa")
+    manifest.forget("a.wkt")
+    manifest.forget("unknown.wkt")
+    assert manifest.files == {}
+
+
+def test_reconcile_with_the_device_listing(tmp_path):
+    manifest = ds.DeviceManifest(str(tmp_path), "device")
+    manifest.record("kept.wkt", 1, "k")
+    manifest.record("deleted.wkt", 2, "d")
+    unknown = manifest.reconcile(["kept.wkt", "other.wkt", "another.ses"])
+    assert unknown == ["another.ses", "other.wkt"]
+    assert manifest.files == {"kept.wkt": (1, "k")}
+
+
+def test_sync_deletes_only_the_files_sent(tmp_path):
+    local = tmp_path / "local"
+    local.mkdir()
+    (local / "a.wkt").write_bytes(b"a" * 300)
+    (local / "b.wkt").write_bytes(b"b" * 300)
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, files={"other.wkt": b"o"})
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host))
+    master.log = False
+    try:
+        master.connect(host.port)
+        device_sync = ds.DeviceSync(master, str(tmp_path / "manifests"))
+        result = device_sync.sync(str(local))
+        assert (result.uploaded, result.deleted) == (["a.wkt", "b.wkt"], [])
+        (local / "b.wkt").unlink()
+        result = device_sync.sync(str(local))
+        assert (result.unchanged, result.deleted) == (["a.wkt"], ["b.wkt"])
+        assert sorted(device.files) == ["a.wkt", "other.wkt"]
+        result = device_sync.sync(str(local), delete_unknown=True)
+        assert result.deleted == ["other.wkt"]
+        assert sorted(device.files) == ["a.wkt"]
+    finally:
+        master.disconnect()
+        device.stop()
@@ -0,0 +1,75 @@
+import pytest
+import rsdevice_pool as dp
+import rsdevice_sim as sim
+import rsmaster as rs
+import uart_driver as ud
+
+PORTS = ["sim://a", "sim://b", "sim://c"]
+
+
+@pytest.fixture
+def pool():
+    """pool of 3 simulated devices, each one storing a.wkt"""
+    hosts = {}
+    devices = {}
+    for port in PORTS:
+        host, device_port = sim.SimulatedSerial.pair(0)
+        host.port = port
+        hosts[port] = host
+        devices[port] = sim.SimulatedDevice(device_port, files={"a.wkt": port.encode()})
+        devices[port].start()
+
+    def master_factory(port):
+        master = rs.RSMaster(ud.UartDriver(serial_port=hosts[port]))
+        master.log = False
+        return master
+
+    device_pool = dp.DevicePool(master_factory)
+    device_pool.hosts = hosts
+    device_pool.devices = devices
+    yield device_pool
+    device_pool.disconnect()
+    for device in devices.values():
+        device.stop()
+
+
+def test_port_name():
+    assert dp.port_name("/dev/ttyACM0") == "ttyACM0"
+    assert dp.port_name("COM3") == "COM3"
+    assert dp.port_name("sim://a") == "a"
+
+
+def test_fan_out(pool, tmp_path):
+    assert sorted(pool.discover(PORTS)) == PORTS
+    # already in the pool: not connected again
+    assert pool.discover(PORTS) == []
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(b"workout")
+    assert pool.send_workout_file(str(file_path)) == {port: None for port in PORTS}
+    for device in pool.devices.values():
+        assert device.files["w.wkt"] == b"workout"
+    assert pool.delete_file("a.wkt", ports=["sim://b"]) == {"sim://b": True}
+    listings = pool.list_workouts()
+    assert {port: sorted(names) for port, names in listings.items()} == {
+        "sim://a": ["a.wkt", "w.wkt"], "sim://b": ["w.wkt"], "sim://c": ["a.wkt", "w.wkt"]}
+    assert [row["state"] for row in pool.status()] == ["ok"] * 3
+
+
+def test_failure_isolated_to_its_device(pool, tmp_path):
+    pool.discover(PORTS)
+    results = pool.send_workout_file(str(tmp_path / "missing.wkt"), ports=["sim://a"])
+    assert isinstance(results["sim://a"], Exception)
+    rows = {row["port"]: row for row in pool.status()}
+    assert rows["sim://a"]["state"] == "error"
+    assert "missing.wkt" in rows["sim://a"]["error"]
+    assert rows["sim://b"]["operation"] == "connect" and rows["sim://b"]["state"] == "ok"
+    assert "missing.wkt" in pool.status_table()
+    # the other devices still answer
+    assert set(pool.list_workouts(ports=["sim://b", "sim://c"])) == {"sim://b", "sim://c"}
+
+
+def test_disconnected_device_dropped(pool):
+    pool.discover(PORTS)
+    pool.hosts["sim://b"].close()
+    assert pool.discover([]) == []
+    assert sorted(pool.ports()) == ["sim://a", "sim://c"]
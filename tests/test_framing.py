@@ -0,0 +1,52 @@
+import pytest
+import framing as fr
+
+
+def test_stuff_escapes_the_flags():
+    assert fr.stuff(b"\x01\x12\x13\x14\x02") == b"\x01\x14\x12\x14\x13\x14\x14\x02"
+    assert fr.stuff(b"plain") == b"plain"
+
+
+def test_unstuff_round_trip_of_every_byte():
+    body = bytes(range(256)) * 2
+    assert fr.unstuff(fr.stuff(body)) == body
+    assert fr.unstuff(b"\x14\x14\x14\x12") == b"\x14\x12"
+
+
+def test_encode_frame():
+    assert fr.encode_frame(b"\x01\x12") == b"\x12\x01\x14\x12\x13"
+
+
+def test_decoder_whole_frames():
+    decoder = fr.FrameDecoder()
+    bodies = [b"\x00\x01", b"\x12\x13\x14", b""]
+    stream = b"".join(fr.encode_frame(body) for body in bodies)
+    assert decoder.feed(stream) == bodies
+    assert decoder.discarded == 0
+
+
+@pytest.mark.parametrize("split", range(1, 12))
+def test_decoder_split_feeds(split):
+    """frames split anywhere, between an escape and its escaped byte too"""
+    bodies = [b"\x14\x12ab", b"\x13\x14\x14"]
+    stream = b"".join(fr.encode_frame(body) for body in bodies)
+    decoder = fr.FrameDecoder()
+    frames = decoder.feed(stream[:split]) + decoder.feed(stream[split:])
+    assert frames == bodies
+
+
+def test_decoder_byte_by_byte():
+    body = bytes(range(32))
+    decoder = fr.FrameDecoder()
+    frames = []
+    for byte in fr.encode_frame(body):
+        frames += decoder.feed(bytes([byte]))
+    assert frames == [body]
+
+
+def test_decoder_discards_noise_and_truncated_frames():
+    decoder = fr.FrameDecoder()
+    # 3 bytes of noise, a frame truncated by the start of the next one (start flag and 2 bytes)
+    stream = b"abc" + b"\x12\x01\x02" + fr.encode_frame(b"\x05")
+    assert decoder.feed(stream) == [b"\x05"]
+    assert decoder.discarded == 6
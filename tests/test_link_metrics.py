@@ -0,0 +1,105 @@
+import re
+import socket
+import urllib.request
+import pytest
+import link_metrics as lm
+import rsdevice_sim as sim
+import rsmaster as rs
+import uart_driver as ud
+
+SAMPLE = re.compile(r'^reactsync_\w+\{port="[^"]*"(,\w+="[^"]*")*\} -?[0-9.e+-]+(inf)?$')
+
+
+def test_histogram_percentiles_within_a_sub_bucket():
+    histogram = lm.LatencyHistogram()
+    for millisecond in range(1, 101):
+        histogram.record(millisecond / 1000)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["mean"] == pytest.approx(0.0505)
+    assert snapshot["max"] == 0.1
+    for name, value in (("p50", 0.05), ("p90", 0.09), ("p99", 0.099)):
+        assert value <= snapshot[name] <= value * (1 + 1 / lm.LatencyHistogram.SUB_BUCKETS)
+    # cumulative export buckets, a sub-bucket straddling a bound counted in the next one
+    counts = [count for _, count in snapshot["buckets"]]
+    assert counts == sorted(counts) and counts[-1] == 100
+    assert 9 <= dict(snapshot["buckets"])[0.01] <= 10
+    histogram.reset()
+    assert histogram.snapshot()["count"] == 0 and histogram.percentile(0.5) == 0
+
+
+def test_histogram_extremes():
+    histogram = lm.LatencyHistogram()
+    histogram.record(0)
+    histogram.record(-1)
+    histogram.record(3600)
+    assert histogram.percentile(1) == 3600
+    assert histogram.percentile(0.5) <= 1e-6
+    # beyond the range: counted in the last bucket
+    histogram.record(10 ** 6)
+    assert histogram.percentile(1) == 2 ** 37 / 1e6
+
+
+def test_prometheus_text():
+    histogram = lm.LatencyHistogram()
+    histogram.record(0.003)
+    text = lm.prometheus_text({'/dev/tty"0': {
+        "rx_frames": 12,
+        "connected": True,
+        "rx_types": {"LOG": {"frames": 10, "bytes": 400}},
+        "histograms": {"command_rtt": histogram.snapshot()},
+    }})
+    lines = text.splitlines()
+    assert "# TYPE reactsync_rx_frames gauge" in lines
+    assert 'reactsync_rx_frames{port="/dev/tty\\"0"} 12.0' in lines
+    assert 'reactsync_rx_types_frames{port="/dev/tty\\"0",type="LOG"} 10.0' in lines
+    assert "# TYPE reactsync_command_rtt_seconds histogram" in lines
+    assert 'reactsync_command_rtt_seconds_bucket{port="/dev/tty\\"0",le="0.002"} 0.0' in lines
+    assert 'reactsync_command_rtt_seconds_bucket{port="/dev/tty\\"0",le="0.005"} 1.0' in lines
+    assert 'reactsync_command_rtt_seconds_count{port="/dev/tty\\"0"} 1.0' in lines
+    # booleans are not metrics
+    assert "connected" not in text
+
+
+@pytest.fixture
+def master():
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, files={"a.wkt": b"1"})
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host))
+    master.log = False
+    assert master.connect(host.port)
+    master.send_list_workout()
+    yield master
+    master.disconnect()
+    device.stop()
+
+
+def test_stats_of_a_master_exported(master):
+    stats = lm.masters_stats([master])
+    port_stats = stats["sim://react-sync"]
+    assert port_stats["histograms"]["command_rtt"]["count"] >= 1
+    for line in lm.prometheus_text(stats).splitlines():
+        assert line.startswith("# TYPE ") or SAMPLE.match(line), line
+    assert lm.summary_line("sim://react-sync", port_stats).startswith("React Sync sim://react-sync link: rx ")
+    report = lm.format_stats("sim://react-sync", port_stats)
+    assert any(line.strip().startswith("command_rtt") for line in report)
+
+
+def test_exporter_file_and_endpoint(master, tmp_path):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        http_port = probe.getsockname()[1]
+    file = tmp_path / "reactsync.prom"
+    exporter = lm.MetricsExporter(lambda: lm.masters_stats([master]), file=str(file), http_port=http_port,
+                                  period=0.05)
+    exporter.start()
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:%i/metrics" % http_port, timeout=5) as response:
+            body = response.read().decode("utf-8")
+    finally:
+        exporter.stop()
+    assert 'reactsync_rx_frames{port="sim://react-sync"}' in body
+    # written once more when stopped
+    assert file.read_text().startswith("# TYPE ")
+    assert not (tmp_path / "reactsync.prom.tmp").exists()
@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+import payload_connect as pc
+import payload_log as pl
+import rsdevice_sim as sim
+import rsmaster as rs
+import rsmaster_async as rsa
+import uart_driver as ud
+
+FEATURES = pc.FEATURE_CRC16 | pc.FEATURE_NUMBERED_FRAMES | pc.FEATURE_LOG_CONTROL
+
+
+@pytest.fixture
+def link():
+    """(master, device) factory, the device features and options given"""
+    started = []
+
+    def connect(features=FEATURES, level=None, rate=None, **device_options):
+        host, device_port = sim.SimulatedSerial.pair(0)
+        device = sim.SimulatedDevice(device_port, features=features, **device_options)
+        device.start()
+        master = rs.RSMaster(ud.UartDriver(serial_port=host))
+        master.log = False
+        master.device_log_level = level
+        master.device_log_rate = rate
+        started.append((master, device))
+        assert master.connect(host.port)
+        return master, device
+
+    yield connect
+    for master, device in started:
+        master.disconnect()
+        device.stop()
+
+
+@pytest.mark.parametrize("tagged", [True, False])
+def test_settings_applied_at_connection(link, tagged):
+    features = FEATURES | (pc.FEATURE_TAGGED_REPLIES if tagged else 0)
+    master, device = link(features, pl.LogLevel.LOG_LEVEL_WARNING, 5)
+    assert master.log_control and master.tagged_replies == tagged
+    assert (device.log_min_level, device.log_max_rate) == (pl.LogLevel.LOG_LEVEL_WARNING.value, 5)
+    assert master.device_log_stats.min_level == pl.LogLevel.LOG_LEVEL_WARNING.value
+
+
+@pytest.mark.parametrize("tagged", [True, False])
+def test_suppressed_messages_counted(link, tagged):
+    master, device = link(FEATURES | (pc.FEATURE_TAGGED_REPLIES if tagged else 0))
+    stats = master.send_log_control(pl.LogLevel.LOG_LEVEL_INFO)
+    assert (stats.min_level, stats.suppressed_messages) == (pl.LogLevel.LOG_LEVEL_INFO.value, 0)
+    for _ in range(3):
+        device.send_log(pl.LogLevel.LOG_LEVEL_DEBUG, "filtered")
+    device.send_log(pl.LogLevel.LOG_LEVEL_INFO, "sent")
+    # a query keeps the settings
+    stats = master.send_log_control()
+    assert (stats.min_level, stats.max_rate) == (pl.LogLevel.LOG_LEVEL_INFO.value, 0)
+    assert stats.suppressed_messages == 3
+    assert stats.suppressed_bytes == device.log_bytes_suppressed > 0
+    assert device.logs_sent == 1
+
+
+def test_not_supported(link):
+    master, device = link(pc.FEATURE_CRC16 | pc.FEATURE_TAGGED_REPLIES, pl.LogLevel.LOG_LEVEL_ERROR)
+    assert not master.log_control
+    assert master.send_log_control(pl.LogLevel.LOG_LEVEL_ERROR) is None
+    assert device.log_min_level == pl.LogLevel.LOG_LEVEL_DEBUG.value
+
+
+def test_logs_muted_during_a_transfer(link, tmp_path):
+    master, device = link(FEATURES | pc.FEATURE_TAGGED_REPLIES, latency=0.01)
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(bytes(range(256)) * 64)
+    levels = []
+
+    def progress(transfer):
+        levels.append(device.log_min_level)
+        device.send_log(pl.LogLevel.LOG_LEVEL_INFO, "chunk acked")
+
+    master.send_workout_file(str(file_path), progress=progress)
+    assert device.files["w.wkt"] == file_path.read_bytes()
+    assert set(levels) == {pl.LogLevel.LOG_LEVEL_WARNING.value}
+    # restored once sent, the messages of the transfer suppressed
+    assert device.log_min_level == pl.LogLevel.LOG_LEVEL_DEBUG.value
+    assert master.device_log_stats.suppressed_messages == len(levels)
+
+
+def test_logs_not_muted_when_not_wished(link, tmp_path):
+    master, device = link(FEATURES | pc.FEATURE_TAGGED_REPLIES)
+    master.mute_device_logs = False
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(b"workout")
+    levels = []
+    master.send_workout_file(str(file_path), progress=lambda transfer: levels.append(device.log_min_level))
+    assert set(levels) == {pl.LogLevel.LOG_LEVEL_DEBUG.value}
+
+
+def test_async_log_control():
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port)
+    device.start()
+
+    async def control():
+        master = rsa.AsyncRSMaster(ud.UartDriver(serial_port=host))
+        master.log = False
+        master.device_log_rate = 20
+        try:
+            assert await master.connect(host.port)
+            assert device.log_max_rate == 20
+            stats = await master.send_log_control(pl.LogLevel.LOG_LEVEL_ERROR)
+            assert (stats.min_level, stats.max_rate) == (pl.LogLevel.LOG_LEVEL_ERROR.value, 20)
+        finally:
+            await master.disconnect()
+
+    try:
+        asyncio.run(control())
+    finally:
+        device.stop()
+    assert device.log_min_level == pl.LogLevel.LOG_LEVEL_ERROR.value
@@ -0,0 +1,66 @@
+import mmap
+import random
+import payload_file as pf
+
+NAME = b"workout.wkt"
+
+
+def payload_v1(chunk_id, total_chunks, data):
+    chunk = pf.PayloadFile()
+    chunk.chunk_id = chunk_id
+    chunk.number_of_chunks = total_chunks
+    chunk.chunk_size = len(data)
+    chunk.name[:len(NAME)] = NAME
+    chunk.data[:len(data)] = data
+    return bytes(chunk.serialize())
+
+
+def payload_v2(chunk_id, total_chunks, data, flags=0):
+    chunk = pf.PayloadFileV2(data)
+    chunk.chunk_id = chunk_id
+    chunk.number_of_chunks = total_chunks
+    chunk.chunk_size = len(data)
+    chunk.flags = flags
+    chunk.name[:len(NAME)] = NAME
+    return bytes(chunk.serialize())
+
+
+def test_v1_chunks_same_as_payload_file():
+    data = random.Random(1).randbytes(2 * pf.PayloadFile.FILE_CHUNK_SIZE + 10)
+    chunker = pf.FileChunker(memoryview(data), NAME, pf.PayloadFile.FILE_CHUNK_SIZE, 1)
+    assert chunker.total_chunks == 3
+    size = pf.PayloadFile.FILE_CHUNK_SIZE
+    for chunk_id in range(3):
+        # fixed size: the last chunk is zero padded, not left with the previous chunk bytes
+        assert bytes(chunker.chunk(chunk_id)) == payload_v1(chunk_id, 3, data[chunk_id * size:(chunk_id + 1) * size])
+
+
+def test_v2_chunks_same_as_payload_file_v2():
+    data = random.Random(2).randbytes(1000)
+    chunker = pf.FileChunker(memoryview(data), NAME, 256, 2, pf.FLAG_DEFLATE)
+    assert chunker.total_chunks == 4
+    assert [chunker.chunk_length(chunk_id) for chunk_id in range(4)] == [256, 256, 256, 232]
+    for chunk_id in range(4):
+        # only the valid bytes of the last chunk
+        assert bytes(chunker.chunk(chunk_id)) == payload_v2(
+            chunk_id, 4, data[chunk_id * 256:(chunk_id + 1) * 256], pf.FLAG_DEFLATE)
+
+
+def test_chunks_share_one_buffer():
+    chunker = pf.FileChunker(memoryview(bytes(range(64))), NAME, 16, 2)
+    first = chunker.chunk(0)
+    second = chunker.chunk(1)
+    assert first.obj is second.obj is chunker.buffer
+    assert bytes(first[-16:]) == bytes(range(16, 32))
+
+
+def test_release_unlocks_the_file_mapping(tmp_path):
+    path = tmp_path / "w.wkt"
+    path.write_bytes(bytes(range(100)))
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        chunker = pf.FileChunker(memoryview(mapping), NAME, 32, 2)
+        chunker.chunk(3)
+        chunker.release()
+        mapping.close()
+        assert mapping.closed
@@ -0,0 +1,43 @@
+import pytest
+import framing as fr
+import rsdevice_sim as sim
+import rsmaster as rs
+import uart_driver as ud
+
+
+@pytest.mark.parametrize("reset_on_connect", [True, False])
+def test_reconnect_negotiates_the_link_again(reset_on_connect):
+    """the connect answer is accepted in the v1 framing and in the framing of the former link"""
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, files={"a.wkt": b"1"}, reset_on_connect=reset_on_connect)
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host))
+    master.log = False
+    try:
+        assert master.connect(host.port)
+        assert (master.protocol_version, master.uart_driver.crc) == (2, "crc16")
+        master.disconnect()
+        # the device keeps its framing, the host sends the connect request in v1 framing
+        assert master.connect(host.port)
+        assert (master.protocol_version, master.uart_driver.crc) == (2, "crc16")
+        assert master.previous_framing is None
+        assert master.send_list_workout() == ["a.wkt"]
+    finally:
+        master.disconnect()
+        device.stop()
+
+
+def test_connect_answer_in_former_framing_only_while_connecting():
+    master = rs.RSMaster(ud.UartDriver())
+    master.uart_driver.protocol_version = 2
+    master.uart_driver.crc = "crc16"
+    encoder = ud.UartDriver()
+    encoder.protocol_version = 2
+    encoder.crc = "crc16"
+    _, frame = encoder.encode_tx_frame(rs.SerialMsgType.ACK.value, bytes([0]))
+    body = fr.unstuff(frame[1:-1])
+    master.connect_request()
+    assert master.previous_framing == (2, "crc16")
+    assert master.decode_rx_frame(body) == (rs.SerialMsgType.ACK.value, bytearray([0]))
+    master.negotiate_link(None)
+    assert master.decode_rx_frame(body) is None
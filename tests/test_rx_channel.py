@@ -0,0 +1,129 @@
+import os
+import queue
+import threading
+import time
+import pytest
+import payload_connect as pc
+import rsdevice_sim as sim
+import rsmaster as rs
+import rx_channel as rxc
+import uart_driver as ud
+
+
+def fill(channel, count):
+    for index in range(count):
+        channel.put(bytes([index]))
+
+
+def drain(channel):
+    items = []
+    while not channel.empty():
+        items.append(channel.get_nowait())
+    return items
+
+
+def test_fifo():
+    channel = rxc.RxChannel("test", 4)
+    fill(channel, 3)
+    assert channel.qsize() == 3
+    assert drain(channel) == [b"\x00", b"\x01", b"\x02"]
+    with pytest.raises(queue.Empty):
+        channel.get(timeout=0.01)
+
+
+def test_drop_oldest():
+    channel = rxc.RxChannel("test", 3, rxc.OverflowPolicy.DROP_OLDEST)
+    fill(channel, 5)
+    assert drain(channel) == [b"\x02", b"\x03", b"\x04"]
+    stats = channel.stats()
+    assert (stats["received"], stats["dropped"], stats["max_depth"], stats["blocked"]) == (5, 2, 3, 0)
+
+
+def test_block_drops_the_oldest_after_the_timeout():
+    channel = rxc.RxChannel("test", 2, rxc.OverflowPolicy.BLOCK, block_timeout=0.01)
+    fill(channel, 3)
+    assert drain(channel) == [b"\x01", b"\x02"]
+    stats = channel.stats()
+    assert (stats["blocked"], stats["dropped"]) == (1, 1)
+
+
+def test_block_waits_for_the_consumer():
+    channel = rxc.RxChannel("test", 1, rxc.OverflowPolicy.BLOCK, block_timeout=5)
+    channel.put(b"first")
+    received = []
+    consumer = threading.Thread(target=lambda: received.append(channel.get(timeout=5)))
+    consumer.start()
+    channel.put(b"second")
+    consumer.join()
+    assert received == [b"first"]
+    assert channel.get_nowait() == b"second"
+    assert channel.stats()["dropped"] == 0
+
+
+def test_spill_keeps_the_order(tmp_path):
+    channel = rxc.RxChannel("test", 2, rxc.OverflowPolicy.SPILL, spill_dir=str(tmp_path))
+    fill(channel, 6)
+    assert channel.qsize() == 6
+    assert channel.get_nowait() == b"\x00"
+    # put while items are spilled: after them
+    channel.put(b"\x06")
+    assert drain(channel) == [bytes([index]) for index in range(1, 7)]
+    stats = channel.stats()
+    assert (stats["spilled"], stats["dropped"], stats["depth"]) == (5, 0, 0)
+
+
+def test_clear(tmp_path):
+    channel = rxc.RxChannel("test", 2, rxc.OverflowPolicy.SPILL, spill_dir=str(tmp_path))
+    fill(channel, 4)
+    channel.clear()
+    assert channel.empty()
+    assert channel.qsize() == 0
+    channel.put(b"new")
+    assert drain(channel) == [b"new"]
+
+
+@pytest.mark.parametrize("window_size, device_window_size", [(4, 8), (1, 8), (1, 0)])
+def test_untagged_delete_during_a_transfer(tmp_path, window_size, device_window_size):
+    """the ack of the delete is not taken for a chunk ack, nor a chunk ack for its answer"""
+    data = os.urandom(20000)
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(data)
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, window_size=device_window_size, latency=0.005,
+                                 features=pc.FEATURE_CRC16, files={"old.wkt": b"1"})
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host), window_size=window_size, chunk_size=512)
+    master.log = False
+    try:
+        master.connect(host.port)
+        assert not master.tagged_replies
+        transfer = threading.Thread(target=master.send_workout_file, args=(str(file_path),))
+        transfer.start()
+        time.sleep(0.05)
+        assert master.send_delete_file("old.wkt")
+        assert not master.send_delete_file("missing.wkt")
+        transfer.join()
+        assert device.files == {"w.wkt": data}
+    finally:
+        master.disconnect()
+        device.stop()
+
+
+def test_stale_acks_kept_then_discarded():
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, features=pc.FEATURE_CRC16, files={"old.wkt": b"1"})
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host))
+    master.log = False
+    try:
+        master.connect(host.port)
+        assert master.rx_command_ack_queue.policy == rxc.OverflowPolicy.SPILL
+        # acks nobody waits for: spilled, the uart thread does not wait for room
+        for _ in range(master.rx_command_ack_queue.maxsize + 5):
+            master.add_to_rx_ack_queue(b"\x01")
+        assert master.rx_command_ack_queue.stats()["dropped"] == 0
+        # discarded by the next untagged command
+        assert master.send_delete_file("old.wkt")
+    finally:
+        master.disconnect()
+        device.stop()
@@ -0,0 +1,65 @@
+import rsmaster as rs
+import uart_driver as ud
+
+
+def test_consecutive_ids():
+    tracker = ud.SequenceTracker()
+    for packet_id in range(10):
+        assert tracker.update(packet_id)
+    assert (tracker.received, tracker.lost, tracker.duplicated) == (10, 0, 0)
+
+
+def test_wrap():
+    tracker = ud.SequenceTracker()
+    for packet_id in (0xFFFE, 0xFFFF, 0, 1):
+        assert tracker.update(packet_id)
+    assert (tracker.lost, tracker.duplicated, tracker.resynchronized) == (0, 0, 0)
+
+
+def test_gaps_counted_across_the_wrap():
+    tracker = ud.SequenceTracker()
+    for packet_id in (0xFFFE, 2, 3):
+        tracker.update(packet_id)
+    # 0xFFFF, 0, 1 missing
+    assert tracker.lost == 3
+    assert tracker.loss_rate() == 3 / 6
+
+
+def test_gap():
+    tracker = ud.SequenceTracker()
+    for packet_id in (0, 1, 4, 5):
+        tracker.update(packet_id)
+    assert tracker.lost == 2
+    assert tracker.loss_rate() == 2 / 6
+
+
+def test_duplicate_counted():
+    tracker = ud.SequenceTracker()
+    assert tracker.update(7)
+    assert tracker.update(8)
+    assert not tracker.update(7)
+    assert tracker.duplicated == 1
+    assert tracker.lost == 0
+    # the sequence goes on after the duplicate
+    assert tracker.update(9)
+    assert tracker.lost == 0
+
+
+def test_peer_restart_resynchronizes():
+    tracker = ud.SequenceTracker()
+    tracker.update(1000)
+    assert tracker.update(0)
+    assert (tracker.resynchronized, tracker.duplicated, tracker.lost) == (1, 0, 0)
+    tracker.reset()
+    assert (tracker.received, tracker.resynchronized, tracker.expected) == (0, 0, None)
+
+
+def test_repeated_packet_id_delivered_unless_numbered_frames():
+    body = bytes([0, 7, rs.SerialMsgType.ACK.value, 1, 0])
+    master = rs.RSMaster(ud.UartDriver())
+    assert master.decode_rx_frame(body) == (rs.SerialMsgType.ACK.value, b"\x00")
+    assert master.decode_rx_frame(body) == (rs.SerialMsgType.ACK.value, b"\x00")
+    assert master.rx_sequence.duplicated == 1
+    master.numbered_frames = True
+    assert master.decode_rx_frame(body) is None
+    assert master.rx_sequence.duplicated == 2
@@ -0,0 +1,96 @@
+import pytest
+import rsdevice_sim as sim
+import rsmaster as rs
+import serial_capture as sc
+import uart_driver as ud
+
+
+def test_records_read_back(tmp_path):
+    path = str(tmp_path / "link.rscap")
+    writer = sc.CaptureWriter(path)
+    writer.record(sc.TX, b"\x12request\x13")
+    writer.record(sc.RX, b"\x12ans")
+    writer.record(sc.RX, b"wer\x13")
+    writer.close()
+    # closed: not recorded, no error
+    writer.record(sc.RX, b"late")
+    records = list(sc.read_capture(path))
+    assert [(direction, data) for _, direction, data in records] == [
+        (sc.TX, b"\x12request\x13"), (sc.RX, b"\x12ans"), (sc.RX, b"wer\x13")]
+    times = [seconds for seconds, _, _ in records]
+    assert times == sorted(times)
+    assert (writer.records, writer.bytes) == (3, 17)
+
+
+def test_truncated_last_record_ignored(tmp_path):
+    path = str(tmp_path / "link.rscap")
+    writer = sc.CaptureWriter(path)
+    writer.record(sc.RX, b"complete")
+    writer.record(sc.RX, b"killed while written")
+    writer.close()
+    with open(path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 5)
+    assert [data for _, _, data in sc.read_capture(path)] == [b"complete"]
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes(b"some text, not a capture")
+    with pytest.raises(Exception):
+        list(sc.read_capture(str(path)))
+
+
+@pytest.fixture
+def session(tmp_path):
+    """capture of a session with a simulated device: connect, list, send a file"""
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(bytes(range(256)) * 8)
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, files={"a.wkt": b"1"})
+    device.start()
+    driver = ud.UartDriver(serial_port=host, capture_dir=str(tmp_path / "captures"))
+    master = rs.RSMaster(driver, chunk_size=512, compression="none")
+    master.log = False
+    try:
+        assert master.connect(host.port)
+        assert master.send_list_workout() == ["a.wkt"]
+        master.send_workout_file(str(file_path))
+    finally:
+        master.disconnect()
+        device.stop()
+    path = driver.capture.path
+    driver.stop_capture()
+    return path, str(file_path)
+
+
+def test_capture_of_a_session(session):
+    path, _ = session
+    info = sc.capture_info(path)
+    # connect answer and chunk acks
+    assert info["rx"]["types"][rs.SerialMsgType.ACK.value] == 5
+    assert info["tx"]["types"][rs.SerialMsgType.FILE.value] == 4
+    assert info["tx"]["types"][rs.SerialMsgType.COMMAND.value] >= 2
+    # rx decoded offline as the uart thread did: frames and link settings
+    master = rs.RSMaster(ud.UartDriver(), chunk_size=512)
+    master.log = False
+    decoded = sc.decode_capture(master, list(sc.read_capture(path)))
+    assert decoded == sum(info["rx"]["types"].values())
+    assert master.uart_driver.rx_crc_errors == 0
+    assert master.protocol_version == 2
+
+
+def test_replay_answers_the_same_requests(session):
+    path, file_path = session
+    port = sc.ReplaySerial(path, speed=0)
+    master = rs.RSMaster(ud.UartDriver(serial_port=port), chunk_size=512, compression="none")
+    master.log = False
+    try:
+        assert master.connect(port.port)
+        assert master.send_list_workout() == ["a.wkt"]
+        master.send_workout_file(file_path)
+        assert port.finished.wait(5)
+    finally:
+        master.disconnect()
+    assert port.tx_mismatch is None
+    assert port.rx_bytes == port.rx_total
+    assert port.lockstep_timeouts == 0
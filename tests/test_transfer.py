@@ -0,0 +1,114 @@
+import asyncio
+import random
+import pytest
+import framing as fr
+import rsdevice_sim as sim
+import rsmaster as rs
+import rsmaster_async as rsa
+import uart_driver as ud
+
+CHUNK_SIZE = 512
+
+
+def drop_frames(port, dropped):
+    """drop the frames of the port writes whose index is in dropped, counting the
+    file chunks only (frames longer than a command)"""
+    decoder = fr.FrameDecoder()
+    write = port.write
+    chunks = [0]
+
+    def lossy_write(data):
+        kept = bytearray()
+        for body in decoder.feed(data):
+            if len(body) > CHUNK_SIZE // 2:
+                chunks[0] += 1
+                if chunks[0] - 1 in dropped:
+                    continue
+            kept += fr.encode_frame(body)
+        write(bytes(kept))
+        return len(data)
+
+    port.write = lossy_write
+
+
+def transfer(asynchronous, data, tmp_path, bit_error_rate=0, dropped=(), window_size=4):
+    """send data to a simulated device with a small window
+
+    Returns:
+        tuple: (content received by the device, link stats of the master, progress updates)
+    """
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(data)
+    host, device_port = sim.SimulatedSerial.pair(0, bit_error_rate=bit_error_rate)
+    device = sim.SimulatedDevice(device_port)
+    device.start()
+    if dropped:
+        drop_frames(host, dropped)
+    updates = []
+
+    def progress(transfer_progress):
+        updates.append((transfer_progress.acked_chunks, transfer_progress.total_chunks))
+
+    try:
+        if asynchronous:
+            async def send():
+                master = rsa.AsyncRSMaster(ud.UartDriver(serial_port=host), window_size=window_size,
+                                           chunk_size=CHUNK_SIZE, compression="none")
+                master.log = False
+                master.ACK_TIMEOUT = 0.3
+                try:
+                    assert await master.connect(host.port)
+                    await master.send_workout_file(str(file_path), progress=progress)
+                    return master.link_stats()
+                finally:
+                    await master.disconnect()
+
+            stats = asyncio.run(send())
+        else:
+            master = rs.RSMaster(ud.UartDriver(serial_port=host), window_size=window_size,
+                                 chunk_size=CHUNK_SIZE, compression="none")
+            master.log = False
+            master.ACK_TIMEOUT = 0.3
+            try:
+                assert master.connect(host.port)
+                assert master.window_size == window_size
+                master.send_workout_file(str(file_path), progress=progress)
+                stats = master.link_stats()
+            finally:
+                master.disconnect()
+    finally:
+        device.stop()
+    return device.files.get("w.wkt"), stats, updates
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_nacked_chunk_sent_again(tmp_path, asynchronous):
+    """chunk 1 lost: nacked when chunk 2 arrives, its ack comes after the ack of the next ones"""
+    data = random.Random(1).randbytes(10 * CHUNK_SIZE)
+    received, stats, updates = transfer(asynchronous, data, tmp_path, dropped={1})
+    assert received == data
+    assert stats["nacks"] == 1
+    assert stats["ack_timeouts"] == 0
+    assert updates[-1] == (10, 10)
+    assert [acked for acked, _ in updates] == list(range(11))
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_last_chunk_sent_again_on_ack_timeout(tmp_path, asynchronous):
+    """no chunk after the lost one to have it nacked: sent again once its ack is overdue"""
+    data = random.Random(2).randbytes(6 * CHUNK_SIZE)
+    received, stats, _ = transfer(asynchronous, data, tmp_path, dropped={5})
+    assert received == data
+    assert stats["ack_timeouts"] == 1
+    assert stats["nacks"] == 0
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_noisy_link(tmp_path, asynchronous):
+    """corrupted chunks and acks dropped by the crc check, the file still arrives intact"""
+    random.seed(3)
+    data = random.randbytes(40 * CHUNK_SIZE)
+    received, stats, updates = transfer(asynchronous, data, tmp_path, bit_error_rate=2e-5)
+    assert received == data
+    assert updates[-1] == (40, 40)
+    assert stats["rx_crc_errors"] + stats["nacks"] + stats["ack_timeouts"] > 0
@@ -0,0 +1,70 @@
+import json
+import transfer_checkpoint as tc
+
+HASH = "0123456789abcdef0123456789abcdef"
+
+
+def checkpoint(directory, total_chunks=20, content_hash=HASH, chunk_size=512):
+    return tc.TransferCheckpoint(str(directory), "w.wkt", content_hash, total_chunks, chunk_size)
+
+
+def test_load_after_a_partial_save(tmp_path):
+    saved = checkpoint(tmp_path)
+    for chunk_id in (0, 1, 2, 9, 19):
+        saved.mark_acked(chunk_id)
+    saved.save()
+    loaded = checkpoint(tmp_path)
+    assert loaded.load() == 5
+    assert loaded.is_acked(9) and not loaded.is_acked(10)
+    assert loaded.missing_chunks() == [3, 4, 5, 6, 7, 8] + list(range(10, 19))
+
+
+def test_saved_at_most_every_save_period(tmp_path):
+    saved = checkpoint(tmp_path)
+    # first ack saved at once, the next ones within the period on the next save
+    saved.mark_acked(0)
+    saved.mark_acked(1)
+    assert checkpoint(tmp_path).load() == 1
+    saved.save()
+    assert checkpoint(tmp_path).load() == 2
+
+
+def test_other_transfer_not_resumed(tmp_path):
+    saved = checkpoint(tmp_path)
+    saved.mark_acked(3)
+    saved.save()
+    assert checkpoint(tmp_path, chunk_size=1024).load() == 0
+    assert checkpoint(tmp_path, total_chunks=21).load() == 0
+    assert checkpoint(tmp_path, content_hash="f" * 32).load() == 0
+
+
+def test_invalid_checkpoint_ignored(tmp_path):
+    invalid = checkpoint(tmp_path)
+    with open(invalid.path, "w") as file:
+        json.dump({"hash": HASH}, file)
+    assert invalid.load() == 0
+    assert invalid.missing_chunks() == list(range(20))
+
+
+def test_bitmap_of_the_wrong_length_ignored(tmp_path):
+    saved = checkpoint(tmp_path)
+    saved.mark_acked(0)
+    saved.save()
+    with open(saved.path) as file:
+        content = json.load(file)
+    for acked in ("ff", "ff" * 4):
+        content["acked"] = acked
+        with open(saved.path, "w") as file:
+            json.dump(content, file)
+        loaded = checkpoint(tmp_path)
+        assert loaded.load() == 0
+        assert loaded.missing_chunks() == list(range(20))
+
+
+def test_remove(tmp_path):
+    saved = checkpoint(tmp_path)
+    saved.mark_acked(0)
+    saved.save()
+    saved.remove()
+    saved.remove()
+    assert checkpoint(tmp_path).load() == 0
@@ -0,0 +1,77 @@
+import pytest
+import rsdevice_sim as sim
+import rsmaster as rs
+import transfer_progress as tp
+import uart_driver as ud
+
+
+def test_throughput_over_the_rate_window():
+    progress = tp.TransferProgress("w.wkt", 4000, 40, 4000)
+    start = progress.started
+    for second in range(1, 5):
+        progress.chunk_acked(100, received=start + second)
+    assert progress.bytes_per_second == pytest.approx(100)
+    # the first second no longer in the window: twice as fast since
+    progress.chunk_acked(300, received=start + 5)
+    assert progress.samples[0][0] == start + 3
+    assert progress.bytes_per_second == pytest.approx(200)
+    assert progress.eta == pytest.approx((4000 - 700) / 200)
+
+
+def test_round_trip_times():
+    progress = tp.TransferProgress("w.wkt", 300, 3, 300)
+    progress.chunk_acked(100, rtt=0.08)
+    progress.chunk_acked(100, rtt=0.16)
+    # retried chunk: its round trip time is not known
+    progress.chunk_acked(100)
+    assert progress.rtt == pytest.approx(0.08 + 0.125 * 0.08)
+    assert (progress.rtt_last, progress.rtt_max) == (0.16, 0.16)
+
+
+def test_finished():
+    progress = tp.TransferProgress("w.wkt", 1000, 2, 400)
+    assert progress.eta is None
+    assert "eta -" in progress.summary()
+    progress.chunk_acked(300, received=progress.started + 1)
+    # compressed content: the file rate is the content rate times the compression ratio
+    assert progress.file_bytes_per_second == pytest.approx(300 * 1000 / 400)
+    progress.chunk_acked(100, received=progress.started + 2)
+    assert progress.finished == progress.started + 2
+    assert (progress.fraction, progress.eta, progress.elapsed) == (1.0, 0, 2)
+    assert "100% 2/2 chunks" in str(progress) and "done in 2.0 s" in str(progress)
+
+
+def test_resumed_transfer():
+    progress = tp.TransferProgress("w.wkt", 1000, 10, 1000, acked_chunks=6, acked_bytes=600)
+    assert progress.fraction == 0.6
+    progress.chunk_retried()
+    progress.chunk_acked(100, received=progress.started + 1)
+    assert (progress.acked_chunks, progress.retries) == (7, 1)
+    # the chunks acknowledged before are not part of the throughput
+    assert progress.bytes_per_second == pytest.approx(100)
+
+
+@pytest.mark.parametrize("window_size", [1, 4])
+def test_progress_of_a_transfer(tmp_path, window_size):
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, latency=0.005)
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host), window_size=window_size, chunk_size=256,
+                         compression="none")
+    master.log = False
+    file_path = tmp_path / "w.wkt"
+    file_path.write_bytes(bytes(range(256)) * 20)
+    updates = []
+    try:
+        assert master.connect(host.port)
+        master.send_workout_file(str(file_path), progress=lambda progress: updates.append(
+            (progress, progress.acked_chunks, progress.acked_bytes)))
+    finally:
+        master.disconnect()
+        device.stop()
+    progress = updates[-1][0]
+    assert [(chunks, acked_bytes) for _, chunks, acked_bytes in updates] == [(i, 256 * i) for i in range(21)]
+    assert progress.finished is not None and progress.fraction == 1.0
+    # at least the device latency, more with the chunks queued before it in the window
+    assert 0.005 <= progress.rtt_max < 0.5
+    assert progress.bytes_per_second > 0
@@ -0,0 +1,119 @@
+import threading
+import pytest
+import framing as fr
+import rsdevice_sim as sim
+import rsmaster as rs
+import tx_scheduler as ts
+import uart_driver as ud
+
+
+class RecordingPort:
+    """serial port keeping the bytes written"""
+
+    def __init__(self):
+        self.timeout = None
+        self.is_open = True
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def written_frames(driver):
+    """(packet id, type, payload) of the frames written on a RecordingPort"""
+    return [driver.parse_rx_frame(body) for body in fr.FrameDecoder().feed(bytes(driver.serial_port.written))]
+
+
+def scheduler_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "tx_scheduler" and thread.is_alive()]
+
+
+def test_frames_written_by_priority():
+    driver = ud.UartDriver(serial_port=RecordingPort())
+    scheduler = ts.TxScheduler(driver)
+    scheduler.run = True
+    # queued before the writer starts: written together, highest class first
+    scheduler.send(ts.TxPriority.FILE, rs.SerialMsgType.FILE.value, b"chunk 0", wait=False)
+    scheduler.send(ts.TxPriority.FILE, rs.SerialMsgType.FILE.value, b"chunk 1", wait=False)
+    scheduler.send(ts.TxPriority.COMMAND, rs.SerialMsgType.COMMAND.value, b"\x01", wait=False)
+    scheduler.send(ts.TxPriority.CONTROL, rs.SerialMsgType.ACK.value, b"\x00", wait=False)
+    scheduler.start()
+    try:
+        assert scheduler.send(ts.TxPriority.COMMAND, rs.SerialMsgType.COMMAND.value, b"\x02") == 4
+    finally:
+        scheduler.stop()
+    frames = written_frames(driver)
+    assert [payload for _, _, payload in frames] == [b"\x00", b"\x01", b"chunk 0", b"chunk 1", b"\x02"]
+    # ids assigned when written: in sequence on the wire
+    assert [packet_id for packet_id, _, _ in frames] == [0, 1, 2, 3, 4]
+    metrics = scheduler.metrics()
+    assert (metrics["file"]["sent"], metrics["command"]["sent"], metrics["control"]["sent"]) == (2, 2, 1)
+    assert metrics["writes"] == 2
+
+
+def test_enqueue_reserves_the_packet_id():
+    driver = ud.UartDriver(serial_port=RecordingPort())
+    scheduler = ts.TxScheduler(driver)
+    scheduler.run = True
+    scheduler.send(ts.TxPriority.FILE, rs.SerialMsgType.FILE.value, b"chunk", wait=False)
+    request = scheduler.enqueue(ts.TxPriority.COMMAND, rs.SerialMsgType.COMMAND.value, b"\x01")
+    assert request.packet_id == 0
+    scheduler.start()
+    try:
+        assert request.future.result(timeout=5) == 0
+    finally:
+        scheduler.stop()
+    # the command overtakes the chunk queued before it, the chunk gets the next id
+    assert written_frames(driver) == [(0, rs.SerialMsgType.COMMAND.value, b"\x01"),
+                                      (1, rs.SerialMsgType.FILE.value, b"chunk")]
+
+
+def test_stop_fails_the_frames_not_written():
+    scheduler = ts.TxScheduler(ud.UartDriver(serial_port=RecordingPort()))
+    scheduler.run = True
+    request = scheduler.enqueue(ts.TxPriority.FILE, rs.SerialMsgType.FILE.value, b"chunk")
+    scheduler.stop()
+    with pytest.raises(Exception):
+        request.future.result(timeout=1)
+    with pytest.raises(Exception):
+        scheduler.send(ts.TxPriority.COMMAND, rs.SerialMsgType.COMMAND.value, b"\x01")
+
+
+def test_start_twice_single_writer():
+    before = len(scheduler_threads())
+    scheduler = ts.TxScheduler(ud.UartDriver(serial_port=RecordingPort()))
+    scheduler.start()
+    scheduler.start()
+    try:
+        assert len(scheduler_threads()) == before + 1
+    finally:
+        scheduler.stop()
+    assert len(scheduler_threads()) == before
+
+
+def test_single_scheduler_thread_across_reconnections():
+    before = len(scheduler_threads())
+    host, device_port = sim.SimulatedSerial.pair(0)
+    device = sim.SimulatedDevice(device_port, files={"a.wkt": b"1"})
+    device.start()
+    master = rs.RSMaster(ud.UartDriver(serial_port=host))
+    master.log = False
+    port = host.port
+    try:
+        for _ in range(4):
+            assert master.connect(port)
+            assert len(scheduler_threads()) == before + 1
+            assert master.send_list_workout() == ["a.wkt"]
+            # link error: the uart thread closes the port
+            host.close()
+            master.thread_uart.join(timeout=5)
+            assert not master.thread_uart.is_alive()
+            master.disconnect()
+            assert len(scheduler_threads()) == before
+    finally:
+        master.disconnect()
+        device.stop()
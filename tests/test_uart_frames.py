@@ -0,0 +1,44 @@
+import pytest
+import framing as fr
+import uart_driver as ud
+
+
+def frame_body(frame):
+    (body,) = fr.FrameDecoder().feed(frame)
+    return body
+
+
+@pytest.mark.parametrize("protocol_version, payload_size", [(1, 200), (2, 200), (2, 4096)])
+def test_uart_frame_round_trip(protocol_version, payload_size):
+    sender = ud.UartDriver()
+    receiver = ud.UartDriver()
+    for driver in (sender, receiver):
+        driver.protocol_version = protocol_version
+    payload = bytes(range(256)) * (payload_size // 256) + bytes(range(payload_size % 256))
+    packet_id, frame = sender.encode_tx_frame(3, payload)
+    assert receiver.parse_rx_frame(frame_body(frame)) == (packet_id, 3, payload)
+
+
+def test_length_field_size():
+    driver = ud.UartDriver()
+    _, frame = driver.encode_tx_frame(3, b"\x01")
+    assert frame_body(frame) == b"\x00\x00\x03\x01\x01"
+    driver.protocol_version = 2
+    _, frame = driver.encode_tx_frame(3, b"\x01")
+    assert frame_body(frame) == b"\x00\x01\x03\x00\x01\x01"
+
+
+def test_payload_length_not_matching_the_frame():
+    receiver = ud.UartDriver()
+    receiver.protocol_version = 2
+    assert receiver.parse_rx_frame(b"\x00\x01\x03\x00\x02\x00") is None
+    assert receiver.parse_rx_frame(b"\x00\x01") is None
+    assert receiver.rx_malformed == 2
+
+
+def test_legacy_parse_of_a_connect_request():
+    """v1 framing without crc whatever the negotiated framing"""
+    receiver = ud.UartDriver()
+    receiver.protocol_version = 2
+    receiver.crc = "crc32"
+    assert receiver.parse_rx_frame(b"\x00\x05\x02\x01\x00", legacy=True) == (5, 2, b"\x00")
@@ -0,0 +1,88 @@
+"""
+On-disk checkpoint of a file transfer: bitmap of the chunks acknowledged by the device
+so that a transfer interrupted by a link drop resumes at the first missing chunk
+"""
+import json
+import logging
+import os
+import time
+
+
+class TransferCheckpoint:
+    """acknowledged chunks of a file transfer, keyed by file name and content hash"""
+
+    SAVE_PERIOD = 0.5  # seconds between two saves while chunks are acknowledged
+
+    def __init__(self, directory, filename, content_hash, total_chunks, chunk_size):
+        self.path = os.path.join(directory, "%s.%s.json" % (filename, content_hash[:16]))
+        self.filename = filename
+        self.content_hash = content_hash
+        self.total_chunks = total_chunks
+        self.chunk_size = chunk_size
+        self.bitmap = bytearray((total_chunks + 7) // 8)
+        self.saved_at = 0
+        self.dirty = False
+
+    def load(self):
+        """restore the acknowledged chunks of a previous attempt of the same transfer
+
+        Returns:
+            int: number of chunks already acknowledged
+        """
+        try:
+            with open(self.path, "r") as file:
+                checkpoint = json.load(file)
+            if (checkpoint["hash"] == self.content_hash
+                    and checkpoint["total_chunks"] == self.total_chunks
+                    and checkpoint["chunk_size"] == self.chunk_size):
+                bitmap = bytearray.fromhex(checkpoint["acked"])
+                if len(bitmap) != len(self.bitmap):
+                    raise ValueError("bitmap of %d bytes for %d chunks" % (len(bitmap), self.total_chunks))
+                self.bitmap = bitmap
+        except FileNotFoundError:
+            pass
+        except (KeyError, ValueError) as exception:
+            logging.info("Ignoring invalid transfer checkpoint %s: %s", self.path, exception)
+        return self.acked_count()
+
+    def is_acked(self, chunk_id):
+        return bool(self.bitmap[chunk_id >> 3] & (1 << (chunk_id & 7)))
+
+    def mark_acked(self, chunk_id):
+        """record an acknowledged chunk, saved at most every SAVE_PERIOD"""
+        self.bitmap[chunk_id >> 3] |= 1 << (chunk_id & 7)
+        self.dirty = True
+        if time.monotonic() - self.saved_at >= self.SAVE_PERIOD:
+            self.save()
+
+    def acked_count(self):
+        return sum(bin(byte).count("1") for byte in self.bitmap)
+
+    def missing_chunks(self):
+        """ids of the chunks not acknowledged yet, in order"""
+        return [chunk_id for chunk_id in range(self.total_chunks) if not self.is_acked(chunk_id)]
+
+    def save(self):
+        """write the checkpoint, atomically replacing the previous one"""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({
+                "file": self.filename,
+                "hash": self.content_hash,
+                "total_chunks": self.total_chunks,
+                "chunk_size": self.chunk_size,
+                "acked": self.bitmap.hex(),
+            }, file)
+        os.replace(temporary_path, self.path)
+        self.saved_at = time.monotonic()
+        self.dirty = False
+
+    def remove(self):
+        """the transfer is complete, forget it"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,108 @@
+"""
+Progress of a file transfer: chunks and bytes acknowledged, throughput, ack round trip
+time and estimated time left, updated on each ack and passed to the progress callback
+of send_workout_file
+"""
+import collections
+import time
+
+
+class TransferProgress:
+    """state of a file transfer, updated by the thread (or task) sending it"""
+
+    RATE_WINDOW = 2.0  # seconds of acks the throughput is measured over
+    RTT_SMOOTHING = 0.125  # weight of a new sample in the smoothed round trip time
+
+    def __init__(self, filename, file_bytes, total_chunks, total_bytes, acked_chunks=0, acked_bytes=0):
+        """constructor
+
+        Args:
+            filename (str): name of the file sent
+            file_bytes (int): size of the file
+            total_chunks (int): chunks of the content sent
+            total_bytes (int): size of the content sent, compressed or not
+            acked_chunks (int): chunks acknowledged before this transfer (resumed)
+            acked_bytes (int): content bytes acknowledged before this transfer (resumed)
+        """
+        self.filename = filename
+        self.file_bytes = file_bytes
+        self.total_chunks = total_chunks
+        self.total_bytes = total_bytes
+        self.acked_chunks = acked_chunks
+        self.acked_bytes = acked_bytes
+        self.retries = 0
+        self.started = time.monotonic()
+        self.finished = None
+        # ack round trip times in seconds: smoothed, last and max
+        self.rtt = None
+        self.rtt_last = None
+        self.rtt_max = 0
+        # (time, acked bytes) of the acks of the last RATE_WINDOW seconds
+        self.samples = collections.deque([(self.started, acked_bytes)])
+
+    def chunk_acked(self, length, rtt=None, received=None):
+        """
+        Args:
+            length (int): content bytes of the chunk
+            rtt (float): seconds between the chunk write and its ack, None if unknown (retried chunk)
+            received (float): time.monotonic() of the ack reception, now if None
+        """
+        now = max(received or time.monotonic(), self.samples[-1][0])
+        self.acked_chunks += 1
+        self.acked_bytes += length
+        if rtt is not None:
+            self.rtt_last = rtt
+            self.rtt_max = max(self.rtt_max, rtt)
+            self.rtt = rtt if self.rtt is None else self.rtt + self.RTT_SMOOTHING * (rtt - self.rtt)
+        self.samples.append((now, self.acked_bytes))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.RATE_WINDOW:
+            self.samples.popleft()
+        if self.acked_chunks >= self.total_chunks:
+            self.finished = now
+
+    def chunk_retried(self):
+        self.retries += 1
+
+    @property
+    def fraction(self):
+        """content acknowledged, 0 to 1"""
+        return self.acked_bytes / self.total_bytes if self.total_bytes else 1.0
+
+    @property
+    def bytes_per_second(self):
+        """content bytes acknowledged per second over the last RATE_WINDOW seconds"""
+        (first_time, first_bytes), (last_time, last_bytes) = self.samples[0], self.samples[-1]
+        return (last_bytes - first_bytes) / (last_time - first_time) if last_time > first_time else 0
+
+    @property
+    def file_bytes_per_second(self):
+        """file bytes per second, the content rate times the compression ratio"""
+        return self.bytes_per_second * self.file_bytes / self.total_bytes if self.total_bytes else 0
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def eta(self):
+        """
+        Returns:
+            float: seconds left at the current throughput, None while unknown
+        """
+        if self.finished is not None:
+            return 0
+        rate = self.bytes_per_second
+        return (self.total_bytes - self.acked_bytes) / rate if rate else None
+
+    def summary(self):
+        """one line state: percentage, chunks, rate, rtt and eta"""
+        eta = self.eta
+        return "%s: %3.0f%% %i/%i chunks, %.1f KB/s, rtt %s, %s" % (
+            self.filename, self.fraction * 100, self.acked_chunks, self.total_chunks,
+            self.file_bytes_per_second / 1024,
+            "%.0f ms" % (self.rtt * 1000) if self.rtt is not None else "-",
+            "done in %.1f s" % self.elapsed if self.finished is not None
+            else "eta %.1f s" % eta if eta is not None else "eta -")
+
+    def __str__(self):
+        return self.summary()
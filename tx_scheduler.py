@@ -0,0 +1,257 @@
+"""
+Serial TX scheduler: the only writer of a UartDriver link
+
+Frames are queued by priority class (control > command > file data) and written by
+one thread, in packet id order since the ids are assigned when the frames are written,
+except for the frames queued with their id reserved (enqueue): a command registers its
+id for the answer before the frame can be written, and may overtake lower class frames
+queued before it.
+A command issued during a file upload goes out before the next file chunk, and the
+frames waiting at once are coalesced into a single write. The file chunks are paced
+by the uart tx rate limits without delaying the frames of the other classes.
+"""
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from enum import IntEnum
+
+
+class TxPriority(IntEnum):
+    CONTROL = 0  # link management (connect, acks)
+    COMMAND = 1  # device commands (list, delete)
+    FILE = 2  # file data chunks
+
+
+class TxRequest:
+    """frame waiting in a tx queue"""
+
+    def __init__(self, priority, type, payload, paced):
+        self.priority = priority
+        self.type = type
+        self.payload = payload
+        self.paced = paced
+        self.enqueued = time.monotonic()
+        # packet id reserved when queued, None: assigned when written
+        self.packet_id = None
+        # packet id once written
+        self.future = concurrent.futures.Future()
+
+
+class TxQueueStats:
+    """counters of a priority class"""
+
+    def __init__(self):
+        self.max_depth = 0
+        self.sent = 0
+        self.wait_total = 0
+        self.wait_max = 0
+
+    def account(self, wait):
+        self.sent += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class TxScheduler:
+    """priority queues of the frames to send and the thread writing them"""
+
+    QUEUE_SIZE = 16
+    MAX_WRITE_SIZE = 8192  # bytes of payload coalesced in one write, one frame at least
+
+    def __init__(self, uart_driver, queue_size=QUEUE_SIZE):
+        """constructor
+
+        Args:
+            uart_driver (UartDriver): link written, its rate limits pace the file chunks
+            queue_size (int): max frames waiting per priority class, a sender blocks
+                when the queue of its class is full
+        """
+        self.uart_driver = uart_driver
+        self.queue_size = queue_size
+        self.queues = {priority: collections.deque() for priority in TxPriority}
+        self.stats = {priority: TxQueueStats() for priority in TxPriority}
+        self.writes = 0
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.condition = threading.Condition()
+        # paced frame at the head of the file queue: time it may be written
+        self.paced_ready_at = None
+        self.run = False
+        self.thread = None
+
+    def start(self):
+        """start the writer thread, nothing done if it runs already (single writer)"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.condition:
+            self.run = True
+        self.thread = threading.Thread(name="tx_scheduler", target=self.__worker_task, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """stop the thread, the frames not written yet fail"""
+        with self.condition:
+            self.run = False
+            self.condition.notify_all()
+        if self.thread is not None and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        with self.condition:
+            pending = [request for queue in self.queues.values() for request in queue]
+            for queue in self.queues.values():
+                queue.clear()
+            self.paced_ready_at = None
+            self.condition.notify_all()
+        for request in pending:
+            request.future.set_exception(Exception("Serial link closed, frame not sent"))
+
+    def send(self, priority, type, payload, paced=False, wait=True):
+        """queue a frame
+
+        Args:
+            priority (TxPriority): class of the frame
+            type (int): SerialMsgType value
+            payload (bytes): payload of the frame, copied unless waiting for the write
+            paced (bool): frame throttled by the uart tx rate limits
+            wait (bool): block until the frame is written
+
+        Returns:
+            int: packet id of the frame if waiting for the write, None otherwise
+
+        Raises:
+            Exception: the scheduler is stopped or the write failed
+        """
+        # the caller may reuse its buffer as soon as it is not waiting
+        request = TxRequest(priority, type, payload if wait else bytes(payload), paced)
+        self.__queue(request)
+        if wait:
+            return request.future.result()
+        return None
+
+    def enqueue(self, priority, type, payload, paced=False):
+        """queue a frame with its packet id reserved at once, without waiting for the write
+
+        Args:
+            priority (TxPriority): class of the frame
+            type (int): SerialMsgType value
+            payload (bytes): payload of the frame, not copied
+            paced (bool): frame throttled by the uart tx rate limits
+
+        Returns:
+            TxRequest: packet_id of the frame, future done once it is written
+
+        Raises:
+            Exception: the scheduler is stopped
+        """
+        request = TxRequest(priority, type, payload, paced)
+        self.__queue(request, reserve_id=True)
+        return request
+
+    def __queue(self, request, reserve_id=False):
+        with self.condition:
+            queue = self.queues[request.priority]
+            while self.run and len(queue) >= self.queue_size:
+                self.condition.wait()
+            if not self.run:
+                raise Exception("Serial link closed, frame not sent")
+            if reserve_id:
+                request.packet_id = self.uart_driver.reserve_packet_id()
+            queue.append(request)
+            stats = self.stats[request.priority]
+            stats.max_depth = max(stats.max_depth, len(queue))
+            self.condition.notify_all()
+
+    def metrics(self):
+        """
+        Returns:
+            dict: per priority class name the frames queued (depth), the max depth seen,
+                the frames sent and their mean/max time in queue, and the writes done with
+                the frames coalesced per write
+        """
+        with self.condition:
+            metrics = {
+                priority.name.lower(): {
+                    "depth": len(self.queues[priority]),
+                    "max_depth": self.stats[priority].max_depth,
+                    "sent": self.stats[priority].sent,
+                    "wait_mean": self.stats[priority].wait_total / self.stats[priority].sent
+                    if self.stats[priority].sent else 0,
+                    "wait_max": self.stats[priority].wait_max,
+                }
+                for priority in TxPriority
+            }
+            metrics["writes"] = self.writes
+            metrics["frames_per_write"] = self.frames_written / self.writes if self.writes else 0
+            metrics["bytes_written"] = self.bytes_written
+        return metrics
+
+    def log_metrics(self):
+        metrics = self.metrics()
+        logging.info("React Sync tx: %i writes, %.2f frames per write, %s", metrics["writes"], metrics["frames_per_write"],
+                     ", ".join("%s %i sent (max queued %i, wait mean %.1f ms, max %.1f ms)" % (
+                         priority.name.lower(), metrics[priority.name.lower()]["sent"],
+                         metrics[priority.name.lower()]["max_depth"], metrics[priority.name.lower()]["wait_mean"] * 1000,
+                         metrics[priority.name.lower()]["wait_max"] * 1000) for priority in TxPriority))
+
+    def __next_batch(self):
+        """frames to write together, highest priority first, waits while none can be sent
+
+        Returns:
+            list: TxRequest, empty once stopped
+        """
+        with self.condition:
+            while self.run:
+                batch = []
+                size = 0
+                timeout = None
+                for priority in TxPriority:
+                    queue = self.queues[priority]
+                    while queue and (not batch or size + len(queue[0].payload) <= self.MAX_WRITE_SIZE):
+                        request = queue[0]
+                        if request.paced:
+                            now = time.monotonic()
+                            if self.paced_ready_at is None:
+                                # rate limits accounted once per frame, when it reaches the head
+                                self.paced_ready_at = now + self.uart_driver.tx_pacing_delay(len(request.payload))
+                            if self.paced_ready_at > now:
+                                timeout = self.paced_ready_at - now
+                                break
+                            self.paced_ready_at = None
+                        batch.append(queue.popleft())
+                        size += len(request.payload)
+                        if request.paced:
+                            # one paced frame per write: the next one has its own delay
+                            break
+                    if timeout is not None:
+                        # lower classes wait behind the paced frame
+                        break
+                if batch:
+                    # room in the queues for blocked senders
+                    self.condition.notify_all()
+                    return batch
+                self.condition.wait(timeout)
+            return []
+
+    def __worker_task(self):
+        while True:
+            batch = self.__next_batch()
+            if not batch:
+                return
+            try:
+                packet_ids = self.uart_driver.send_tx_frames(
+                    [(request.type, request.payload, request.packet_id) for request in batch])
+            except Exception as exception:
+                logging.info("Serial write failed: %s", exception)
+                for request in batch:
+                    request.future.set_exception(exception)
+                continue
+            now = time.monotonic()
+            with self.condition:
+                self.writes += 1
+                self.frames_written += len(batch)
+                self.bytes_written += sum(len(request.payload) for request in batch)
+                for request in batch:
+                    self.stats[request.priority].account(now - request.enqueued)
+            for request, packet_id in zip(batch, packet_ids):
+                request.future.set_result(packet_id)
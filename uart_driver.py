@@ -1,85 +1,325 @@
-import sys
 import serial
 import logging
+import threading
 import time
+import rate_limiter as rl
+import framing as fr
+import serial_capture as sc
+from collections import Counter, deque
 
 class UartDriver:
     """UART data link layer implementation
     data integrity and correctness is managed with bytestuffing flags"""
 
-    FLAG_START = b"\x12"
-    FLAG_STOP = b"\x13"
-    FLAG_ESC = b"\x14"
+    FLAG_START = fr.FLAG_START
+    FLAG_STOP = fr.FLAG_STOP
+    FLAG_ESC = fr.FLAG_ESC
 
-    TX_PACKET_ID = 0
+    RX_TIMEOUT = 0.1
 
-    def __init__(self):
-        """constructor"""
-        self.serial_port = serial.Serial(port=None)
-        self.serial_port.baudrate = 115200
-        self.serial_port.bytesize = serial.EIGHTBITS
-        self.serial_port.parity = serial.PARITY_NONE
-        self.serial_port.stopbits = serial.STOPBITS_ONE
-
-    def send_tx_buffer(self, type, payload):
+    PACKET_ID_MASK = 0xFFFF  # 16-bit packet ids, wrapping
+
+    def __init__(
+        self, rx_timeout=RX_TIMEOUT, serial_port=None,
+        tx_bytes_per_second=0, tx_frames_per_second=0, capture_dir=None
+    ):
+        """constructor
+
+        Args:
+            rx_timeout (float): max time in seconds a read blocks waiting for bytes
+            serial_port (serial.Serial): port to use instead of a new unconfigured one,
+                any object with the pyserial read/write api (e.g. simulated device)
+            tx_bytes_per_second (int): max rate of the paced (bulk) frames, 0 for no limit
+            tx_frames_per_second (int): max paced frames per second, 0 for no limit
+            capture_dir (str): directory of a new capture file of the raw traffic, None for none
+        """
+        if serial_port is None:
+            serial_port = serial.Serial(port=None)
+            serial_port.baudrate = 115200
+            serial_port.bytesize = serial.EIGHTBITS
+            serial_port.parity = serial.PARITY_NONE
+            serial_port.stopbits = serial.STOPBITS_ONE
+        self.serial_port = serial_port
+        self.serial_port.timeout = rx_timeout
+        # protocol v2 frames carry a 16-bit payload length, v1 frames an 8-bit one
+        self.protocol_version = 1
+        # negotiated integrity trailer of the frames: None, "crc16" or "crc32"
+        self.crc = None
+        self.reset_counters()
+        # per link tx sequence number
+        self.tx_packet_id = 0
+        self.tx_lock = threading.Lock()
+        self.tx_byte_bucket = rl.TokenBucket(tx_bytes_per_second)
+        self.tx_frame_bucket = rl.TokenBucket(tx_frames_per_second)
+        self.rx_decoder = fr.FrameDecoder()
+        self.rx_frames = deque()
+        # raw traffic capture (serial_capture), None when not capturing
+        self.capture = None
+        if capture_dir:
+            self.start_capture(sc.capture_path(capture_dir))
+
+    def start_capture(self, path):
+        """record every chunk of bytes read and written to a capture file
+
+        Args:
+            path (str): capture file, replaced if it exists
+        """
+        self.stop_capture()
+        self.capture = sc.CaptureWriter(path)
+        logging.info("Serial traffic captured to %s", path)
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            logging.info("Serial capture %s closed: %i chunks, %i bytes",
+                         self.capture.path, self.capture.records, self.capture.bytes)
+            self.capture = None
+
+    def reset_counters(self):
+        """clear the frames counters (new connection)"""
+        # rx frames dropped
+        self.rx_crc_errors = 0
+        self.rx_malformed = 0
+        # frames and frame body bytes (before stuffing) per message type
+        self.tx_type_frames = Counter()
+        self.tx_type_bytes = Counter()
+        self.rx_type_frames = Counter()
+        self.rx_type_bytes = Counter()
+        # bytes on the wire: stuffed frames with their flags
+        self.tx_link_bytes = 0
+        self.rx_link_bytes = 0
+
+    @property
+    def length_size(self):
+        """size in bytes of the payload length field of the frames"""
+        return 2 if self.protocol_version >= 2 else 1
+
+    def tx_pacing_delay(self, payload_size):
+        """account a paced (bulk) frame in the tx rate limits
+
+        Returns:
+            float: time in seconds to wait before sending it
+        """
+        # stuffing overhead is not known yet, header and flags are
+        return max(self.tx_frame_bucket.reserve(),
+                   self.tx_byte_bucket.reserve(payload_size + 5 + self.length_size))
+
+    def encode_tx_frame(self, type, payload):
+        """build the frame of a packet with the next packet id, for a caller doing
+        its own writes (asyncio transport); frames must be written in packet id order
+
+        Returns:
+            tuple: (packet id, bytes of the stuffed frame)
+        """
+        with self.tx_lock:
+            packet_id, txbuffer = self.__encode_tx_frame(type, payload)
+            if self.capture is not None:
+                # captured when encoded, the writes follow in the same order
+                self.capture.record(sc.TX, txbuffer)
+            return packet_id, txbuffer
+
+    def reserve_packet_id(self):
+        """packet id of a frame written later (send_tx_frames), before the frames sent meanwhile
+
+        Returns:
+            int: packet id reserved
+        """
+        with self.tx_lock:
+            packet_id = self.tx_packet_id
+            self.tx_packet_id = (self.tx_packet_id + 1) & UartDriver.PACKET_ID_MASK
+            return packet_id
+
+    def __encode_tx_frame(self, type, payload, packet_id=None):
+        data_length = int.to_bytes(
+            len(payload), length=self.length_size, byteorder="big", signed=False
+        )
+        type = int.to_bytes(type, length=1, byteorder="big", signed=False)
+        # add message type and packet_id
+        if packet_id is None:
+            packet_id = self.tx_packet_id
+            self.tx_packet_id = (self.tx_packet_id + 1) & UartDriver.PACKET_ID_MASK
+        p_id = int.to_bytes(packet_id, length=2, byteorder="big", signed=False)
+        body = p_id + type + data_length + payload
+        if self.crc:
+            body += fr.crc_trailer(self.crc, body)
+        txbuffer = fr.encode_frame(body)
+        self.tx_type_frames[type[0]] += 1
+        self.tx_type_bytes[type[0]] += len(body)
+        self.tx_link_bytes += len(txbuffer)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("tx buffer: %s", txbuffer.hex(":"))
+        return packet_id, txbuffer
+
+    def send_tx_buffer(self, type, payload, paced=False):
         """send serial packet over uart with given type and payload
         manage bytestuffing
 
         Args:
             type (byte): the type of the serial packet
             payload (bytearray): the payload of the packet
+            paced (bool): bulk frame throttled by the tx rate limits,
+                other frames (commands, acks) are sent immediately
+
+        Returns:
+            int: packet id of the frame sent
         """
         logging.debug("SEND_TX_BUFFER")
-        data_length = int.to_bytes(
-            len(payload), length=1, byteorder="big", signed=False
-        )
-        # add message type and packet_id
-        p_id = int.to_bytes(
-            UartDriver.TX_PACKET_ID, length=2, byteorder="big", signed=False
-        )
-        type = int.to_bytes(type, length=1, byteorder="big", signed=False)
-        UartDriver.TX_PACKET_ID = UartDriver.TX_PACKET_ID + 1
-        txbuffer = p_id + type + data_length + payload
-        # do byte stuffing
-        txbuffer = txbuffer.replace(
-            UartDriver.FLAG_ESC, UartDriver.FLAG_ESC + UartDriver.FLAG_ESC
-        )
-        txbuffer = txbuffer.replace(
-            UartDriver.FLAG_START, UartDriver.FLAG_ESC + UartDriver.FLAG_START
-        )
-        txbuffer = txbuffer.replace(
-            UartDriver.FLAG_STOP, UartDriver.FLAG_ESC + UartDriver.FLAG_STOP
-        )
+        if paced:
+            wait = self.tx_pacing_delay(len(payload))
+            if wait:
+                time.sleep(wait)
+        # packet id and write under the same lock: ids go out in sequence
+        with self.tx_lock:
+            packet_id, txbuffer = self.__encode_tx_frame(type, payload)
+            if self.capture is not None:
+                self.capture.record(sc.TX, txbuffer)
+            self.serial_port.write(txbuffer)
+            self.serial_port.flush()
+        return packet_id
 
-        # add FLAG_START and FLAG_STOP
-        txbuffer = (
-            bytearray(UartDriver.FLAG_START)
-            + txbuffer
-            + bytearray(UartDriver.FLAG_STOP)
-        )
-        logging.debug("tx buffer: %s", txbuffer.hex(":"))
-        self.serial_port.write(txbuffer)
-        self.serial_port.flush()
-        time.sleep(.050) #TODO to be better managed
+    def send_tx_frames(self, packets):
+        """send several packets in a single write, not paced (tx scheduler)
+
+        Args:
+            packets (list): (type, payload, packet id reserved or None for the next one)
+                of each packet, in sending order
+
+        Returns:
+            list: packet ids of the frames sent
+        """
+        with self.tx_lock:
+            frames = [self.__encode_tx_frame(type, payload, packet_id) for type, payload, packet_id in packets]
+            txbuffer = b"".join(frame for _, frame in frames)
+            if self.capture is not None:
+                self.capture.record(sc.TX, txbuffer)
+            self.serial_port.write(txbuffer)
+            self.serial_port.flush()
+        return [packet_id for packet_id, _ in frames]
+
+    def feed_rx(self, data):
+        """decode bytes read from the uart by the caller (asyncio transport)
+
+        Returns:
+            list: rx frame bodies completed by these bytes
+        """
+        self.rx_link_bytes += len(data)
+        if self.capture is not None:
+            self.capture.record(sc.RX, data)
+        frames = self.rx_decoder.feed(data)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for frame in frames:
+                logging.debug("rx buffer: %s", frame.hex(":"))
+        return frames
+
+    def __read_uart(self):
+        """bulk read of the pending bytes, waits for one byte up to rx timeout"""
+        data = self.serial_port.read(self.serial_port.in_waiting or 1)
+        if data:
+            self.rx_frames.extend(self.feed_rx(data))
+
+    def get_rx_frames(self):
+        """read all the bytes available on the uart (blocking up to the rx timeout
+        when none is pending) and return every complete frame decoded
+
+        Returns:
+            list: rx frame bodies received over uart, may be empty
+        """
+        if not self.rx_frames:
+            self.__read_uart()
+        frames = list(self.rx_frames)
+        self.rx_frames.clear()
+        return frames
 
     def get_rx_buffer(self):
         """processing incoming bytes on the uart - manage bytestuffing
 
         Returns:
-            bytearry: rx packet received over uart
+            bytes: rx frame body received over uart, None if none is complete
         """
-        escaping = False
-        if self.serial_port.in_waiting:
-            rx = self.serial_port.read()
-            if rx == bytearray(self.FLAG_START):
-                while True:
-                    rx += self.serial_port.read()
-                    if escaping:
-                        escaping = False
-                    elif rx[-1].to_bytes(1, sys.byteorder) == self.FLAG_ESC:
-                        escaping = True
-                        rx = rx[:-1]
-                    elif rx[-1].to_bytes(1, sys.byteorder) == self.FLAG_STOP:
-                        logging.debug("rx buffer: %s", rx.hex(":"))
-                        return rx
+        if not self.rx_frames:
+            self.__read_uart()
+        if self.rx_frames:
+            return self.rx_frames.popleft()
         return None
+
+    def parse_rx_frame(self, rx, legacy=False, framing=None):
+        """split a de-stuffed rx frame body [p_id:2][type][len][payload][crc]
+
+        Args:
+            legacy (bool): parse with the v1 framing without crc used before the link
+                negotiation (connect requests) instead of the negotiated one
+            framing (tuple): (protocol version, crc) to parse with instead of the negotiated
+                one, e.g. the framing of a former link
+
+        Returns:
+            tuple: (packet id, type, payload), None if the frame is malformed or corrupted
+        """
+        if legacy:
+            framing = (1, None)
+        protocol_version, crc = framing if framing is not None else (self.protocol_version, self.crc)
+        if crc:
+            crc_size = fr.CRC_SIZES[crc]
+            if len(rx) < crc_size or fr.crc_trailer(crc, rx[:-crc_size]) != rx[-crc_size:]:
+                self.rx_crc_errors += 1
+                return None
+            rx = rx[:-crc_size]
+        header_size = 3 + (2 if protocol_version >= 2 else 1)
+        if len(rx) < header_size:
+            self.rx_malformed += 1
+            return None
+        length = int.from_bytes(rx[3:header_size], byteorder="big", signed=False)
+        if len(rx) != header_size + length:
+            self.rx_malformed += 1
+            return None
+        packet_id = int.from_bytes(rx[0:2], byteorder="big", signed=False)
+        self.rx_type_frames[rx[2]] += 1
+        self.rx_type_bytes[rx[2]] += len(rx) + (fr.CRC_SIZES[crc] if crc else 0)
+        return packet_id, rx[2], rx[header_size:]
+
+
+class SequenceTracker:
+    """follow the wrapping 16-bit packet ids received from a peer
+    to count the frames lost (gaps) and duplicated (replayed ids)"""
+
+    MODULO = UartDriver.PACKET_ID_MASK + 1
+    # ids older than this are considered a peer restart rather than duplicates
+    DUPLICATE_WINDOW = 64
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """forget the peer sequence (new connection) and clear the counters"""
+        with self.lock:
+            self.expected = None
+            self.received = 0
+            self.lost = 0
+            self.duplicated = 0
+            self.resynchronized = 0
+
+    def update(self, packet_id):
+        """account a received packet id, duplicates counted but left to the caller to drop
+
+        Returns:
+            bool: False if the packet id repeats a recent one
+        """
+        with self.lock:
+            self.received += 1
+            if self.expected is not None:
+                gap = (packet_id - self.expected) % self.MODULO
+                if gap >= self.MODULO // 2:
+                    if self.MODULO - gap <= self.DUPLICATE_WINDOW:
+                        self.duplicated += 1
+                        return False
+                    self.resynchronized += 1
+                else:
+                    self.lost += gap
+            self.expected = (packet_id + 1) % self.MODULO
+            return True
+
+    def loss_rate(self):
+        """ratio of frames lost over frames expected"""
+        with self.lock:
+            expected = self.received - self.duplicated + self.lost
+            return self.lost / expected if expected else 0.0